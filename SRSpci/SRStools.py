@@ -6,8 +6,29 @@ elaborate raw spectral data and obtain the spectral aerosol optical depth (AOD).
 To see versions and changelog, open the __init__.py
 
 """
+import os
 import numpy as np
 from datetime import datetime, timedelta
+
+# Ver. 0.9.7: Gueymard's table is looked for into the package directory
+GUEYMARD_FILE = os.path.join( os.path.dirname( os.path.abspath(__file__) ),\
+                              'gueymard_crsec_table.dat' )
+_GueymardCache = {}
+
+# Ver. 0.9.7: season-dependent coefficients, indexed by the season code given
+# by stdatm (0: MLW, 1: MLS, 2: USSA+avg.), so that one array indexing
+# selects the right values for any number of records
+SEASON_PRES  = np.array([ 1.0180,  1.0133,    1.01325 ]) # Std. pressure [bar]
+SEASON_HSCAL = np.array([ 1.28e-4, 1.1859e-4, 1.184e-4 ])# Pressure decay [1/m]
+SEASON_O3COL = np.array([ 0.3768,  0.3316,    0.3434 ])  # Ozone col. [atm-cm]
+SEASON_NO2COL= np.array([ 1.99e-4, 2.18e-4,   2.04e-4 ]) # NO2 col. [atm-cm]
+SEASON_WVCOL = np.array([ 0.9108,  2.9816,    1.419 ])   # Water vapour [cm]
+SEASON_WVSCAL= np.array([ 0.529e-3,0.552e-3,  0.5405e-3])# WV col. decay [1/m]
+# Effective O3 and NO2 temperature: c11 - c12*H (standard), c21 + c22*Tground
+SEASON_C11 = np.array([ 220.46,  232.12,   226.29 ])
+SEASON_C12 = np.array([ 1.67,    2.42,     2.045 ])
+SEASON_C21 = np.array([ 142.68,  332.41,   237.545 ])
+SEASON_C22 = np.array([ 0.28498, -0.34467, -0.029845 ])
 #%%---------------------------------------------------------------------------
 def datenum( dt ):
     """ DATENUM function emulates the corresponding MATLAB/OCTAVE one """
@@ -286,23 +307,24 @@ def stdatm(Date, Height):
 
     Parameters
     ----------
-    Date : datetime object or string
+    Date : datetime object, datetime64 array or string
         Input is accepted in one of these formats:
          1. single datetime value. UTC-referenced values are required
-         2. season (``winter``/``summer``) referred to the Northern Hemisphere
-         3. other formats are accepted, but produce generic std. P value
+         2. array of datetime64 values: one Season and Pres per record
+         3. season (``winter``/``summer``) referred to the Northern Hemisphere
+         4. other formats are accepted, but produce generic std. P value
     Height : float
         Elevation of the measurement site, in [meters] above mean sea level.
 
     Returns
     -------
-    Pres : float
-        Standard atmospheric pressure value at the given altitude in [bar]
-    Season : int
+    Season : int or ndarray
         Numerical code representing the actual season of measurement:
          0 is the northern hemisphere "Winter" (from October to March)
          1 is the northern hemisphere "Summer" (from April to September)
          2 if the input Date was not in a valid format (std. atmosphere used)
+    Pres : float or ndarray
+        Standard atmospheric pressure value at the given altitude in [bar]
     """
     if   isinstance(Date, datetime):
         Season = 1 * (4 <= Date.month <= 9)  # Sort of "step function"
@@ -310,17 +332,15 @@ def stdatm(Date, Height):
         if   Date.lower() in [ 'winter', 'win', 'w' ]: Season = 0
         elif Date.lower() in [ 'summer', 'sum', 's' ]: Season = 1
         else: Season = 2
+    # Ver. 0.9.7: arrays of datetime64 give one value per record
+    elif isinstance(Date, np.ndarray) and np.issubdtype(Date.dtype, np.datetime64):
+        Month = Date.astype('datetime64[M]').astype(int) % 12 + 1
+        Season = 1 * ( (Month >= 4) & (Month <= 9) )
     else: Season = 2
 
-    if Season == 0:
-        # Winter Std Atmosphere for Mid Latitudes
-        return Season, 1.0180 * np.exp( -1.28e-4 * Height )
-    elif Season == 1:
-        # Summer Std Atmosphere for Mid Latitudes
-        return Season, 1.0133 * np.exp( -1.1859e-4 * Height )
-    else:
-        # If Date is not in a valid format, use the US standard atmosphere
-        return Season, 1.01325 * np.exp( -1.184e-4 * Height )
+    # 0: Winter, 1: Summer Std Atmosphere for Mid Latitudes, 2: if Date is
+    # not in a valid format, use the US standard atmosphere
+    return Season, SEASON_PRES[Season] * np.exp( -SEASON_HSCAL[Season] * Height )
 
 def airmass(zang, O3=False, Lat=45.):
     """
@@ -355,7 +375,7 @@ def airmass(zang, O3=False, Lat=45.):
     if O3:
         O3layer = 26. - 0.1 * (Lat**2)**0.5  # Non-negative value for Latitude
         factor = ( 6371.229**2. ) / ( 6371.229 + O3layer )**2.
-        return 1. / ( 1. - factor * ( np.sin(Z)**2. )**0.5 )
+        return 1. / ( 1. - factor * np.sin(Z)**2. )**0.5
     else:
         return 1. / ( np.cos(Z) + 0.50572 * ( 96.07995 - zang )**-1.6364 )
 
@@ -388,6 +408,85 @@ def Guyairmass(zang, C):
     return \
     1. / ( np.cos(Z) + a[C-1][0] * (zang**a[C-1][1]) * (a[C-1][2] - zang)**a[C-1][3] )
 
+#%%---------------------------------------------------------------------------
+# Ver. 0.9.7: introducing gueymard_table and gueymard_coeff
+def gueymard_table():
+    """
+    Return Gueymard's (2001) table of extraterrestrial spectrum and absorption
+    coefficients, with columns: λ [nm], E0nλ, Awλ, Aoλ, Anλ.
+    The file is read only at the first call, then kept in memory.
+    """
+    if 'table' not in _GueymardCache:
+        _GueymardCache['table'] = np.loadtxt( GUEYMARD_FILE )
+    return _GueymardCache['table']
+
+def gueymard_coeff(WaveLgt, Col, Slit=None):
+    """
+    Interpolate one column of Gueymard's table onto the instrument's
+    wavelength grid. Results are cached by grid, so that repeated calls with
+    the same spectrometer wavelengths cost a dictionary lookup.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Full set of spectrometer's wavelengths, in [nanometers]
+    Col : integer
+        Column of the table: 1 (E0nλ), 2 (Awλ), 3 (Aoλ) or 4 (Anλ)
+    Slit : slitconv.SlitMatrix, optional
+        If given, the column is convolved with the slit function of the
+        instrument (built on the same WaveLgt grid) instead of interpolated
+
+    Returns
+    -------
+    Coeff : ndarray
+        Selected coefficients on the WaveLgt grid (read-only array)
+    """
+    WaveLgt = np.ascontiguousarray(WaveLgt, dtype=float)
+    Key = ( Col, WaveLgt.shape, hash(WaveLgt.tobytes()) )
+    if Slit is not None:
+        if not np.array_equal( Slit.WaveLgt, WaveLgt ):
+            raise ValueError('gueymard_coeff: Slit built for another grid')
+        Key += ( Slit.key(), )
+    if Key not in _GueymardCache:
+        if len(_GueymardCache) > 64: _GueymardCache.clear()
+        Table = gueymard_table()
+        if Slit is None:
+            Coeff = np.interp( WaveLgt, Table[:,0], Table[:,Col] )
+        else:
+            Coeff = Slit.apply( Table[:,Col] )
+        Coeff.setflags(write=False)
+        _GueymardCache[Key] = Coeff
+    return _GueymardCache[Key]
+
+# Ver. 0.9.7: introducing seasonindex, tground and efftemp
+def seasonindex(Season):
+    """
+    Turn a season code (or an array of codes, one per record) into a column
+    of indices for the SEASON_* tables: any code other than 0 or 1 is 2.
+    """
+    Season = np.atleast_1d( np.asarray(Season) ).astype(int)
+    return np.where( (Season == 0) | (Season == 1), Season, 2 )[:,None]
+
+def tground(Tamb, Height):
+    """
+    Ground temperature [K] as used by Gueymard (2001) for the effective gas
+    temperatures, from the ambient temperature [Celsius] at the site.
+    """
+    y = Height / 1000.
+    return ( Tamb + 273.15 - np.minimum(49.42, 70.24 - 23.428 * y + \
+        2.523 * y**2) ) / (1. - np.minimum(0.1878, 0.26073 - 0.082424 * y + \
+        9.098e-3 * y**2) )
+
+def efftemp(Tamb, Height, Season):
+    """
+    Effective temperature [K] of the O3 and NO2 layers: from the standard
+    profile where Tamb=999, from the ground temperature otherwise.
+    Tamb and Season broadcast against each other (see seasonindex).
+    """
+    H = Height / 1000.
+    return np.where( Tamb == 999, SEASON_C11[Season] - SEASON_C12[Season] * H,
+                     SEASON_C21[Season] + SEASON_C22[Season] * tground(Tamb, Height) )
+
 #%%---------------------------------------------------------------------------
 def rayleigh_OD(WaveLgt, Lat, Height, Pres=0 ):
     """
@@ -436,7 +535,7 @@ def rayleigh_OD(WaveLgt, Lat, Height, Pres=0 ):
 
     return sig_s * Pres * 1e6 * N_avog / ( Ma_dry * grav )
 
-def ozone_OD(WaveLgt, Height, O3col=999, Tamb=999, Season=2 ):
+def ozone_OD(WaveLgt, Height, O3col=999, Tamb=999, Season=2, Slit=None ):
     """
     Estimate the Optical Depth due to the Ozone absorption bands.
     Most of the algorithm is based on the SUNRAD.pack (ver. 0.94) implementation
@@ -449,82 +548,77 @@ def ozone_OD(WaveLgt, Height, O3col=999, Tamb=999, Season=2 ):
         Full set of spectrometer's wavelengths, in [nanometers]
     Height : float
         Elevation of the measurement site, in [meters] above mean sea level.
-    O3col : float, optional
+    O3col : float or array_like, optional
         Ozone effective pathlength (i.e. total column amount) measured in
         [atm-cm] units. The **default** value is evaluated for a standard
         Mid-Latitude Winter/Summer atmosphere. Actual season must be specified
-        with the **Season** argument
-    Tamb : float, optional
+        with the **Season** argument. An array gives one value per spectrum,
+        where the 999 entries are replaced by the default value.
+    Tamb : float or array_like, optional
         Ambient (daily) temperature in [Celsius], measured at the observating
         site or estimated according to standard atmospheric values (if Tamb=999)
-    Season : integer, optional
+        An array gives one value per spectrum, as for **O3col**.
+    Season : integer or array_like, optional
         Though optional, it is **highly recommended**. The code represents the
         actual season of measurement, and is given by the stdatm function:
           0 is the northern hemisphere "Winter" (from October to March)
           1 is the northern hemisphere "Summer" (from April to September)
           2 if the input Date was not in a valid format (std. atmosphere used)
+        An array gives one code per spectrum.
+    Slit : slitconv.SlitMatrix, optional
+        Slit convolution of the instrument (on WaveLgt): the Gueymard
+        coefficients are convolved instead of interpolated (gueymard_coeff)
     Returns
     -------
     Tau_Oz : ndarray
-        Ozone absorption contribution to the total atmospheric Optical Depth
+        Ozone absorption contribution to the total atmospheric Optical Depth.
+        Shape is (N_wavelengths,) for scalar **O3col**, **Tamb** and
+        **Season**, otherwise (N_spectra, N_wavelengths).
     """
     H  = Height/1000.          # Site altitude in [km asl]
+    WaveLgt = np.asarray(WaveLgt, dtype=float)
+    Scalar = np.ndim(O3col) == 0 and np.ndim(Tamb) == 0 and np.ndim(Season) == 0
+    # Ver. 0.9.7: one row per spectrum, broadcasting over the wavelengths
+    O3col = np.atleast_1d( np.asarray(O3col, dtype=float) )[:,None]
+    Tamb  = np.atleast_1d( np.asarray(Tamb,  dtype=float) )[:,None]
 
-    # 1. Initialize useful lambda functions
+    Season = seasonindex(Season)
+
+    # 1. Initialize useful lambda function
     AoCoeff = lambda a1, a2, a3, a4, x: (a1 + a2 * x + a3 * x**2) / (1. + a4 * x)
-    Tground = lambda x,y: ( x + 273.15 - min(49.42, 70.24 - 23.428 * y +\
-            2.523 * y**2) ) / (1. - min(0.1878, 0.26073 - 0.082424 * y +\
-            9.098e-3 * y**2) )
 
     # 2. Read Ozone absorption coefficient values at ref, temperature Tro=228K
-    Gueymard_table = np.loadtxt('gueymard_crsec_table.dat')
-    Guey_wvl = Gueymard_table[:,0] # Original Gueymard's wvl grid
-    AoTro_gm = Gueymard_table[:,3] # Original Ao values from Gueymard's table
-    AoTro = np.interp(WaveLgt, Guey_wvl, AoTro_gm)
+    AoTro = gueymard_coeff(WaveLgt, 3, Slit)
 
     # 3. Calculate the total ozone column in [atm-cm]=[10^-3 DU] and the
-    #    effective ozone temperature (Teo) using the actal daily-avgd. Tamb
-    if Season == 0: # Winter: use MLW values
-        c0  = 0.3768
-        c11 = 220.46;  c12 = 1.67
-        c21 = 142.68;  c22 = 0.28498
-    elif Season == 1: # Summer: use MLS values
-        c0  = 0.3316
-        c11 = 232.12;  c12 = 2.42
-        c21 = 332.41;  c22 = - 0.34467
-    else : # Season == 2 or any other undefined season: use USSA+avg. values
-        c0  = 0.3434
-        c11 = 226.29;  c12 = 2.045
-
-    if O3col == 999:
-        O3col = c0 * (1. - 8.98e-3 * H)
-
-    if Tamb == 999:
-            Teo = c11 - c12 * H
-    elif Tamb != 999:
-            Teo = c21 + c22 * Tground(Tamb, H)
-
-    Ao3 = np.copy(AoTro) # Initialize Ao3 as a copy of AoTro
+    #    effective ozone temperature (Teo) using the actal daily-avgd. Tamb,
+    #    with the coefficients of the season of each record
+    O3col = np.where( O3col == 999, SEASON_O3COL[Season] * (1. - 8.98e-3 * H),\
+                      O3col )
+    Teo = efftemp(Tamb, Height, Season)
+    dT  = Teo - 228.
+
+    # Temperature corrections, applied band by band on the whole grid
     WL = WaveLgt/1000.  # Support variable, Wavelengths in [micrometers]
-    for w in range(len(WaveLgt)):
-        if WaveLgt[w] < 310.:
-            Ao3[w] = max( 0, AoTro[w] + (Teo - 228.) * \
-                AoCoeff(0.25326  , -1.7253  , 2.92850, -3.5890, WL[w]) + \
-                AoCoeff(9.6635e-3, -0.063685, 0.10464, -3.6879, WL[w]) * \
-                (Teo - 228.)**2 )
-        elif 310. <= WaveLgt[w] < 344.:
-            Ao3[w] = max( 0, AoTro[w] + (Teo - 228.) * \
-                AoCoeff(0.396260, -2.3272  , 3.41760, 0, WL[w]) + \
-                AoCoeff(0.018268, -0.063685, 0.10464, 0, WL[w]) * \
-                (Teo - 228.)**2 )
-        # Within 344<=WVL<407 and for WVL>560, no Temperature correction is needed
-        elif 407. <= WaveLgt[w] < 560.:
-            Ao3[w] = max( 0, AoTro[w] * ( 1. + 0.0037083 * (Teo - 228.) * \
-                    np.exp(28.04 * (0.4474 - WL[w])) ) )
-    return Ao3 * O3col
+    Ao3 = np.repeat( AoTro[None,:], len(dT), axis=0 )
+    B1 = WaveLgt < 310.
+    Ao3[:,B1] = np.maximum( 0, AoTro[B1] + dT * \
+        AoCoeff(0.25326  , -1.7253  , 2.92850, -3.5890, WL[B1]) + \
+        AoCoeff(9.6635e-3, -0.063685, 0.10464, -3.6879, WL[B1]) * dT**2 )
+    B2 = (WaveLgt >= 310.) & (WaveLgt < 344.)
+    Ao3[:,B2] = np.maximum( 0, AoTro[B2] + dT * \
+        AoCoeff(0.396260, -2.3272  , 3.41760, 0, WL[B2]) + \
+        AoCoeff(0.018268, -0.063685, 0.10464, 0, WL[B2]) * dT**2 )
+    # Within 344<=WVL<407 and for WVL>560, no Temperature correction is needed
+    B3 = (WaveLgt >= 407.) & (WaveLgt < 560.)
+    Ao3[:,B3] = np.maximum( 0, AoTro[B3] * ( 1. + 0.0037083 * dT * \
+        np.exp(28.04 * (0.4474 - WL[B3])) ) )
+
+    Tau_Oz = Ao3 * O3col
+    return Tau_Oz[0] if Scalar else Tau_Oz
 
 # Ver. 0.9.5: introducing no2_OD
-def no2_OD(WaveLgt, Height, Tamb=999, Season=2 ):
+def no2_OD(WaveLgt, Height, Tamb=999, Season=2, NO2col=999, Slit=None ):
     """
     Estimate the Optical Depth due to the NO2 absorption bands.
     Most of the algorithm is based on the SUNRAD.pack (ver. 0.94) implementation
@@ -537,121 +631,145 @@ def no2_OD(WaveLgt, Height, Tamb=999, Season=2 ):
         Full set of spectrometer's wavelengths, in [nanometers]
     Height : float
         Elevation of the measurement site, in [meters] above mean sea level.
-    Tamb : float, optional
+    Tamb : float or array_like, optional
         Ambient (daily) temperature in [Celsius], measured at the observating
         site or estimated according to standard atmospheric values (if Tamb=999)
-    Season : integer, optional
+        An array gives one value per spectrum.
+    Season : integer or array_like, optional
         Though optional, it is **highly recommended**. The code represents the
         actual season of measurement, and is given by the stdatm function:
           0 is the northern hemisphere "Winter" (from October to March)
           1 is the northern hemisphere "Summer" (from April to September)
           2 if the input Date was not in a valid format (std. atmosphere used)
+        An array gives one code per spectrum.
+    NO2col : float or array_like, optional
+        Reduced NO2 pathlength in [atm-cm]. The **default** (999) is the
+        seasonal value selected by **Season**; an array gives one value per
+        spectrum, where the 999 entries are replaced by the default value.
+    Slit : slitconv.SlitMatrix, optional
+        Slit convolution of the instrument (on WaveLgt): the Gueymard
+        coefficients are convolved instead of interpolated (gueymard_coeff)
     Returns
     -------
     Tau_NO2 : ndarray
-        Ozone absorption contribution to the total atmospheric Optical Depth
+        NO2 absorption contribution to the total atmospheric Optical Depth.
+        Shape is (N_wavelengths,) for scalar **Tamb**, **NO2col** and
+        **Season**, otherwise (N_spectra, N_wavelengths).
     """
-    H  = Height/1000. # Site altitude in [km asl]
-    # Initialize useful lambda function
-    Tground = lambda x,y: ( x + 273.15 - min(49.42, 70.24 - 23.428 * y +\
-            2.523 * y**2) ) / (1. - min(0.1878, 0.26073 - 0.082424 * y +\
-            9.098e-3 * y**2) )
+    WaveLgt = np.asarray(WaveLgt, dtype=float)
+    Scalar = np.ndim(NO2col) == 0 and np.ndim(Tamb) == 0 and np.ndim(Season) == 0
+    # Ver. 0.9.7: one row per spectrum, broadcasting over the wavelengths
+    NO2col = np.atleast_1d( np.asarray(NO2col, dtype=float) )[:,None]
+    Tamb   = np.atleast_1d( np.asarray(Tamb,   dtype=float) )[:,None]
+    Season = seasonindex(Season)
 
     # Read NO2 absorption coefficient values at ref, temperature Trn=243.2K
-    Gueymard_table = np.loadtxt('gueymard_crsec_table.dat')
-    Guey_wvl = Gueymard_table[:,0] # Original Gueymard's wvl grid
-    AoTrn_gm = Gueymard_table[:,4] # Original Ao values from Gueymard's table
-    AoTrn = np.interp(WaveLgt, Guey_wvl, AoTrn_gm)
-
-    # Estimate the reduced NO2 path length in [atm-cm] and
-    if Season == 0: # Winter: use MLW values
-        NO2col = 1.99e-4
-        c11 = 220.46;  c12 = 1.67
-        c21 = 142.68;  c22 = 0.28498
-    elif Season == 1: # Summer: use MLS values
-        NO2col = 2.18e-4
-        c11 = 232.12;  c12 = 2.42
-        c21 = 332.41;  c22 = - 0.34467
-    else : # Season == 2 or any other undefined season: use USSA+avg. values
-        NO2col = 2.04e-4
-        c11 = 226.29;  c12 = 2.045
-
-    if Tamb == 999:
-            Ten = c11 - c12 * H
-    elif Tamb != 999:
-            Ten = c21 + c22 * Tground(Tamb, H)
-
-    Aon = np.copy(AoTrn) # Initialize Aon as a copy of AoTrn
+    AoTrn = gueymard_coeff(WaveLgt, 4, Slit)
+
+    # Estimate the reduced NO2 path length in [atm-cm] and the effective
+    # NO2 temperature, with the coefficients of the season of each record
+    NO2col = np.where( NO2col == 999, SEASON_NO2COL[Season], NO2col )
+    Ten = efftemp(Tamb, Height, Season)
+
+    # Temperature correction factor, evaluated once per band on the whole grid
     WL = WaveLgt/1000.  # Support variable, Wavelengths in [micrometers]
-    for w in range(len(WaveLgt)):
-        if WaveLgt[w] < 625.:
-            Aon[w] = max( 0, 1. + (Ten - 243.2) * np.polyval([-42.635, \
-                96.615, -86.136, 37.821, -8.1829, 0.69773], WL[w]) )
-        else :
-            Aon[w] = max( 0, 1. + (Ten - 243.2) * \
-                np.polyval([-0.04985, 0.03539], WL[w]) )
-    return Aon * NO2col
+    Pn = np.where( WaveLgt < 625.,
+        np.polyval([-42.635, 96.615, -86.136, 37.821, -8.1829, 0.69773], WL),
+        np.polyval([-0.04985, 0.03539], WL) )
+    # Ver. 0.9.7: the factor corrects the reference coefficients (it was
+    # returned alone, giving a flat optical depth equal to the column)
+    Aon = AoTrn * np.maximum( 0, 1. + (Ten - 243.2) * Pn )
+
+    Tau_NO2 = Aon * NO2col
+    return Tau_NO2[0] if Scalar else Tau_NO2
 
 # Ver. 0.9.5: introducing wv_MTau
-def wv_MTau(WaveLgt, Height, Pres=0, Season=2 ):
+def wv_MTau(WaveLgt, Height, Pres=0, Season=2, Zang=None, WVcol=999,\
+            Lat=45., AMF=None, Slit=None ):
     """
     Estimate the Optical Depth due to the water vapour (WV) absorption bands.
     Most of the algorithm is based on the SUNRAD.pack (ver. 0.94) implementation
     of the Gueymard (2001) formulas describing the WV optical depth dependence
     on wavelength and atmospheric pressure.
 
+    The function has no internal state: arrays of **Zang** (or **AMF**),
+    **WVcol** and **Pres** give one row per spectrum, so that it can be
+    called on batches or from a process pool.
+
     Parameters
     ----------
     WaveLgt : ndarray
         Full set of spectrometer's wavelengths, in [nanometers]
     Height : float
         Elevation of the measurement site, in [meters] above mean sea level.
-    Pres : float, optional
+    Pres : float or array_like, optional
         Atmospheric pressure in [bar], measured at the observating site or
         estimated according to the Standard Atmosphere value (if Pres=0)
-    Season : integer, optional
+    Season : integer or array_like, optional
         Though optional, it is **highly recommended**. The code represents the
         actual season of measurement, and is given by the stdatm function:
           0 is the northern hemisphere "Winter" (from October to March)
           1 is the northern hemisphere "Summer" (from April to September)
           2 if the input Date was not in a valid format (std. atmosphere used)
+        An array gives one code per spectrum.
+    Zang : float or array_like, optional
+        Solar Zenith Angle(s), e.g. from the sunPosition function. Needed
+        only if **AMF** is not given.
+    WVcol : float or array_like, optional
+        Precipitable water vapour column in [cm]. The **default** (999) is
+        the seasonal value selected by **Season**.
+    Lat : float, optional
+        Latitude of the measurement site, in [N degrees]. Default: 45 deg.
+    AMF : float or array_like, optional
+        Air mass factor(s) already computed with the airmass function, to be
+        shared with the other optical depth terms.
+    Slit : slitconv.SlitMatrix, optional
+        Slit convolution of the instrument (on WaveLgt): the Gueymard
+        coefficients are convolved instead of interpolated (gueymard_coeff)
     Returns
     -------
-    Tau_NO2 : ndarray
-        Ozone absorption contribution to the total atmospheric Optical Depth
+    MTau_WV : ndarray
+        Water vapour contribution to the total atmospheric Optical Depth,
+        multiplied by the air mass. Shape is (N_wavelengths,) for scalar
+        inputs, otherwise (N_spectra, N_wavelengths).
     """
-    global Site, Zang
-    if Pres == 0:
-        Pres = stdatm(0, Height)[1] # Standard atmospheric value in [bar]
+    if AMF is None:
+        if Zang is None:
+            raise ValueError('wv_MTau: either Zang or AMF must be given')
+        AMF = airmass(np.asarray(Zang, dtype=float), Lat=Lat)
+    Scalar = np.ndim(AMF) == 0 and np.ndim(WVcol) == 0 and np.ndim(Pres) == 0 \
+             and np.ndim(Season) == 0
+    # Ver. 0.9.7: one row per spectrum, broadcasting over the wavelengths
+    AMF   = np.atleast_1d( np.asarray(AMF,   dtype=float) )[:,None]
+    WVcol = np.atleast_1d( np.asarray(WVcol, dtype=float) )[:,None]
+    Pres  = np.atleast_1d( np.asarray(Pres,  dtype=float) )[:,None]
+
+    # Standard atmospheric value in [bar] where not measured
+    Pres = np.where( Pres == 0, stdatm(0, Height)[1], Pres )
     # Air pressure ratio: actual / standard (p0 = 1 atm)
     P = Pres / 1.01325
+    WaveLgt = np.asarray(WaveLgt, dtype=float)
     WVL = WaveLgt / 1.0e3  # Convert Wvlt in microns
 
     # Read reference WV absorption coefficient values
-    Gueymard_table = np.loadtxt('gueymard_crsec_table.dat')
-    Guey_wvl = Gueymard_table[:,0] # Original Gueymard's wvl grid
-    AoWv_gm = Gueymard_table[:,2] # Original Ao values from Gueymard's table
-    AoWv = np.interp(WaveLgt, Guey_wvl, AoWv_gm)
-
-    # Estimate the WV path length in [atm-cm]
-    if Season == 0: # Winter: use MLW values
-        WVcol = 2.9816 * np.exp(-0.552e-3 * Height)
-    elif Season == 1: # Summer: use MLS values
-        WVcol = 0.9108 * np.exp(-0.529e-3 * Height)
-#    else : # Season == 2 or any other undefined season: use USSA+avg. values
-#        WVcol = 1.419 * np.exp( )
+    AoWv = gueymard_coeff(WaveLgt, 2, Slit)
+
+    # Estimate the WV path length in [cm], for the season of each record
+    Season = seasonindex(Season)
+    WVcol = np.where( WVcol == 999, SEASON_WVCOL[Season] * \
+                      np.exp(-SEASON_WVSCAL[Season] * Height), WVcol )
 
     IRwvl = WVL > 0.67
-    kw = np.ones(len(WVL))
+    kw = np.ones( (max(len(AMF), len(WVcol), len(P)), len(WVL)) )
     Q  = -0.02454 + 0.037533 * WVL[IRwvl]
-    kw[IRwvl] = (0.98449 + 0.023889 * WVL[IRwvl]) * WVcol**Q
+    kw[:,IRwvl] = (0.98449 + 0.023889 * WVL[IRwvl]) * WVcol**Q
     fw = kw * ( 0.394 - 0.26946 * WVL + (0.46478 + 0.23757 * WVL) * P )
     n  = 0.88631 + 0.025274 * WVL - 3.5949 * np.exp(-4.5445 * WVL)
     c  = 0.53851 + 0.003262 * WVL + 1.5244 * np.exp(-4.2892 * WVL)
 
-    h  = (0.525 + 0.246 * AoWv * WVcol)**0.45
-    h[AoWv<0.01] = 0.624 * AoWv[AoWv<0.01] * WVcol[AoWv<0.01]**0.457
+    h  = np.where( AoWv < 0.01, 0.624 * AoWv * WVcol**0.457, \
+                   (0.525 + 0.246 * AoWv * WVcol)**0.45 )
 
-    AMF = airmass(Zang, Lat=Site[0])
     Bwv = h * np.exp(0.1916 - 0.0785 * AMF + 4.706e-4 * AMF**2)
-    return ( (AMF*WVcol)**1.05 * fw**n * Bwv * AoWv )**c
+    MTau_WV = ( (AMF*WVcol)**1.05 * fw**n * Bwv * AoWv )**c
+    return MTau_WV[0] if Scalar else MTau_WV
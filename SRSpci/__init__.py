@@ -6,4 +6,10 @@ Created on Mon Apr 16 14:53:38 2018
 
 """
 # Explicit index of SRSpci packages that can be imported with * operations
-__all__ = [ 'SRStools', 'operateSRS', 'skyradtools', 'avaspecSRS', 'cfg' ]
+__all__ = [ 'SRStools', 'operateSRS', 'skyradtools', 'avaspecSRS', 'cfg',
+            'opticaldepth', 'srsfiles', 'retrieval',
+            'langley', 'angstrom', 'airmasstables', 'atmstate',
+            'slitconv', 'pipeline', 'cloudscreen',
+            'reprocess', 'precision', 'nonlinearity', 'straylight',
+            'archiveindex', 'collocation', 'predefiles', 'wlshift',
+            'totalozone', 'watervapour', 'uncertainty' ]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed air mass tables, as a replacement of the SRStools.airmass and
+SRStools.Guyairmass functions for large batches of zenith angles.
+
+Tables cover Solar Zenith Angles from 0 to 90 degrees on a uniform grid,
+for the Kasten and Young (1989) formula, the Komhyr (1989) ozone-layer
+formula (built for the latitude of the site) and the four Gueymard (2001)
+per-constituent formulas. Values are obtained by linear interpolation on the
+uniform grid: the grid index of each angle is computed once and shared by
+all the tables requested (see AirMassTable.airmasses).
+
+Maximum relative error of the linear interpolation with the default grid
+step (0.01 deg), with respect to the analytic formulas:
+    - KY (Kasten-Young): 2.2e-7 up to 80 deg, 1.7e-6 up to 88, 2.5e-6 to 90
+    - O3 (Komhyr): 6e-7 on the whole range
+    - G1, G4 (Gueymard Rayleigh, WV/aerosols): 6.5e-5 and 1.7e-5, reached
+      close to the zenith, where the zang**0.07 (0.1) term is steepest
+    - G2 (Gueymard NO2): 1e-6 on the whole range
+    - G3 (Gueymard O3): 2.4e-7 up to 80 deg, 4.6e-6 up to 88, 2.1e-4 to 90
+The error scales with the square of **Step**; the actual bound of any table
+can be measured with AirMassTable.maxerror.
+
+Measured gain (benchmark, 100000 angles, desktop CPU): a single table is
+only 1.0-1.7 times faster than its formula (Komhyr about 1.0, Gueymard up
+to 1.7), all the six tables by AirMassTable.airmasses about 2-2.3 times:
+the tables pay off when several air masses are needed for the same angles.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import time
+import numpy as np
+from . import SRStools as srt
+#%%---------------------------------------------------------------------------
+class AirMassTable(object):
+    """
+    Air mass lookup tables for one measurement site.
+
+    Parameters
+    ----------
+    Lat : float, optional
+        Latitude of the site, in [N degrees], used by the ozone air mass.
+        Default: 45 deg.
+    Step : float, optional
+        Grid step of the tables, in degrees. Default: 0.01
+    """
+    # Table keys: Kasten and Young, Komhyr (O3) and Gueymard components 1-4
+    KEYS = ( 'KY', 'O3', 'G1', 'G2', 'G3', 'G4' )
+
+    def __init__( self, Lat=45., Step=0.01 ):
+        self.Lat  = float(Lat)
+        self.Step = float(Step)
+        self.Zgrid = np.linspace( 0., 90., int(round(90. / self.Step)) + 1 )
+        self.Step = self.Zgrid[1] - self.Zgrid[0]
+        self.Tables = dict( (K, self.analytic(self.Zgrid, K)) for K in self.KEYS )
+
+    def analytic( self, Zang, Key ):
+        """Air mass from the analytic formulas of the SRStools module."""
+        if Key == 'KY': return srt.airmass( Zang )
+        if Key == 'O3': return srt.airmass( Zang, O3=True, Lat=self.Lat )
+        return srt.Guyairmass( Zang, int(Key[1]) )
+
+    def index( self, Zang ):
+        """
+        Grid index and interpolation weight of each zenith angle. Angles
+        outside 0-90 deg, and NaN angles (e.g. masked records), get a NaN
+        weight, hence a NaN air mass.
+        """
+        X = np.asarray( Zang, dtype=float ) / self.Step
+        Ok = ( X >= 0. ) & ( X <= len(self.Zgrid) - 1 )
+        All = Ok.all()
+        # Angles out of range (NaN included) are masked before the cast
+        if not All: X = np.where( Ok, X, 0. )
+        I = np.minimum( X.astype(np.intp), len(self.Zgrid) - 2 )
+        F = X - I
+        if not All: F = np.where( Ok, F, np.nan )
+        return I, F
+
+    def lookup( self, Zang, Key, Index=None ):
+        """
+        Interpolated air mass of the **Key** table (see KEYS) for an array
+        of Solar Zenith Angles. **Index** can be given, as returned by the
+        index method, to skip its calculation.
+        """
+        I, F = self.index( Zang ) if Index is None else Index
+        T = self.Tables[Key]
+        AMF = T[I]
+        AMF += F * ( T[I+1] - AMF )
+        return AMF
+
+    def airmasses( self, Zang, Keys=KEYS ):
+        """
+        Air masses of several tables for the same zenith angles, sharing the
+        index calculation. Returns a dictionary keyed as **Keys**.
+        """
+        Index = self.index( np.atleast_1d(Zang) )
+        return dict( (K, self.lookup(None, K, Index)) for K in Keys )
+
+    def airmass( self, Zang, O3=False ):
+        """Same as SRStools.airmass, for the latitude of the table."""
+        return self.lookup( Zang, 'O3' if O3 else 'KY' )
+
+    def Guyairmass( self, Zang, C ):
+        """Same as SRStools.Guyairmass (C from 1 to 4)."""
+        return self.lookup( Zang, 'G%d' % C )
+
+    def maxerror( self, Key, Zmax=90. ):
+        """
+        Maximum relative error of the **Key** table with respect to the
+        analytic formula, evaluated at the midpoints of the grid (where
+        linear interpolation is worst) up to **Zmax** degrees.
+        """
+        Zmid = self.Zgrid[:-1] + self.Step / 2.
+        Zmid = Zmid[ Zmid <= Zmax ]
+        Exact = self.analytic( Zmid, Key )
+        return np.max( np.abs( self.lookup(Zmid, Key) / Exact - 1. ) )
+
+def benchmark( N=100000, Repeat=5, Lat=45. ):
+    """
+    Compare timing of the tables against the analytic formulas, for a batch
+    of N random zenith angles (best of **Repeat** runs).
+
+    Returns
+    -------
+    Timing : dictionary
+        For each key: (analytic time, lookup time) in seconds; the 'ALL' key
+        compares all the formulas against a single AirMassTable.airmasses
+    """
+    Table = AirMassTable( Lat=Lat )
+    Zang = np.random.uniform( 0., 85., N )
+    Timing = {}
+    for K in Table.KEYS:
+        Ta = Tl = np.inf
+        for r in range(Repeat):
+            t0 = time.perf_counter();   Table.analytic( Zang, K )
+            t1 = time.perf_counter();   Table.lookup( Zang, K )
+            t2 = time.perf_counter()
+            Ta = min( Ta, t1 - t0 );    Tl = min( Tl, t2 - t1 )
+        Timing[K] = ( Ta, Tl )
+    Ta = Tl = np.inf
+    for r in range(Repeat):
+        t0 = time.perf_counter();   [ Table.analytic( Zang, K ) for K in Table.KEYS ]
+        t1 = time.perf_counter();   Table.airmasses( Zang )
+        t2 = time.perf_counter()
+        Ta = min( Ta, t1 - t0 );    Tl = min( Tl, t2 - t1 )
+    Timing['ALL'] = ( Ta, Tl )
+    return Timing
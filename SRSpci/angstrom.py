@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Angstrom exponent (α), turbidity coefficient (β) and spectral curvature of
+the retrieved AOD spectra, from log-log least squares:
+
+    ln τ(λ) = ln β - α ln λ                      (first order)
+    ln τ(λ) = a0 + a1 ln λ + a2 (ln λ)²          (second order, curvature a2)
+
+with λ in [micrometers], as in the SUNRAD OPT products read by
+skyradtools.importsunrad. All the spectra of a batch are fitted at once.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+#%%---------------------------------------------------------------------------
+def logfit( LogWL, LogAOD, W, Order=1 ):
+    """
+    Weighted polynomial fit of LogAOD against LogWL, for all the spectra at
+    once, by solving the batched normal equations.
+
+    Parameters
+    ----------
+    LogWL : ndarray
+        ln(λ) of the pixels used, shape (N_wavelengths,)
+    LogAOD : ndarray
+        ln(AOD), shape (N_spectra, N_wavelengths); non-finite values must
+        have zero weight
+    W : ndarray
+        Weights, shape (N_spectra, N_wavelengths)
+    Order : integer, optional
+        Polynomial order (1 or 2). Default: 1
+
+    Returns
+    -------
+    Coeffs : ndarray
+        Coefficients in increasing order (a0, a1, ...), (N_spectra, Order+1).
+        NaN where the spectrum has not enough valid points.
+    """
+    X = LogWL[:,None] ** np.arange(Order + 1)          # Design matrix
+    Y = np.where( W > 0, LogAOD, 0. )
+    K = Order + 1
+    # X^T W X and X^T W y of every spectrum, as two matrix products
+    G = ( W @ (X[:,:,None] * X[:,None,:]).reshape(len(X), K*K) ).reshape(-1, K, K)
+    R = ( W * Y ) @ X
+    Ok = (W > 0).sum(1) > Order
+    Coeffs = np.full( (len(W), K), np.nan )
+    if Ok.any():
+        Coeffs[Ok] = np.linalg.solve( G[Ok], R[Ok][...,None] )[...,0]
+    return Coeffs
+
+def angstrom( WaveLgt, AOD, Windows=((440., 870.),), Mask=None, Curvature=True ):
+    """
+    Angstrom α and β (and curvature) of a batch of AOD spectra, for one or
+    more wavelength windows.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Wavelengths of the AOD spectra, in [nanometers]
+    AOD : ndarray
+        Aerosol optical depth, shape (N_spectra, N_wavelengths) or
+        (N_wavelengths,) for a single spectrum
+    Windows : list of tuples, optional
+        (min, max) wavelength ranges, in [nanometers], where the fit is made.
+        Default: one window, 440-870 nm
+    Mask : ndarray, optional
+        Quality mask or weights, same shape of AOD. Pixels with zero weight
+        (or False) are excluded. Default: all the valid (positive) values.
+    Curvature : boolean, optional
+        Also make the second order fit. Default: True
+
+    Returns
+    -------
+    Alpha : ndarray
+        Angstrom exponent, shape (N_spectra, N_windows)
+    Beta : ndarray
+        Angstrom turbidity coefficient (AOD at 1 µm), (N_spectra, N_windows)
+    Gamma : ndarray
+        Second order coefficient a2 (spectral curvature), with the same
+        shape; only if **Curvature** is True.
+    """
+    WaveLgt = np.asarray(WaveLgt, dtype=float)
+    AOD = np.atleast_2d(AOD)
+    if Mask is None: Mask = np.ones(AOD.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        LogAOD = np.log(AOD)
+    W = np.where( np.isfinite(LogAOD), np.asarray(Mask, dtype=float), 0. )
+    LogWL = np.log( WaveLgt / 1.0e3 )
+
+    Nw = len(Windows)
+    Alpha, Beta, Gamma = np.full( (3, len(AOD), Nw), np.nan )
+    for k, (Lo, Hi) in enumerate(Windows):
+        Win = (WaveLgt >= Lo) & (WaveLgt <= Hi)
+        C = logfit( LogWL[Win], LogAOD[:,Win], W[:,Win], Order=1 )
+        Alpha[:,k] = - C[:,1];     Beta[:,k] = np.exp( C[:,0] )
+        if Curvature:
+            Gamma[:,k] = logfit( LogWL[Win], LogAOD[:,Win], W[:,Win], Order=2 )[:,2]
+    if Curvature:
+        return Alpha, Beta, Gamma
+    return Alpha, Beta
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Cached index of the SKYRAD (PAR, VOL) and SUNRAD (DT2, OPT) product files.
+
+Each product file is parsed once by the skyradtools importers and saved as
+a columnar cache file (.npz: timestamps as datetime64, data as a regular
+float array). An index of all the files (path, modification time, size,
+product type, number of records, first and last timestamp) is kept in the
+cache directory: files whose modification time or size changed are parsed
+again, new files are parsed in a process pool. Time-range queries only
+read the cache files of the products overlapping the range.
+
+Example
+-------
+>>> Index = ArchiveIndex('/data/prede/', CacheDir='/data/prede_cache/')
+>>> Index.scan()
+>>> Opt = Index.query('opt', '2018-06-01', '2018-07-01')
+>>> Opt['Date'], Opt['Data'][:,:len(Opt['Wvlgt'])]     # AOD columns
+
+To see versions and changelog, open the __init__.py
+
+"""
+import os
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from . import skyradtools as sky
+#%%---------------------------------------------------------------------------
+# Product types, by file extension
+KINDS = ( 'dt2', 'opt', 'par', 'vol' )
+INDEX = 'index.npz'
+
+def parsefile( Path ):
+    """
+    Parse a SKYRAD/SUNRAD product file into a dictionary of arrays:
+    'Date' (datetime64[s]), 'Data' (float, first axis along the records),
+    'Wvlgt' (SUNRAD wavelengths, [micrometers]) and 'Error' (SKYRAD).
+    """
+    Kind = Path[-3:].lower()
+    if Kind in ( 'dt2', 'opt' ):
+        Wvlgt, Date, Data = sky.importsunrad( Path )
+        Error = np.array([])
+    else:
+        Date, Error, Data = sky.importskyrad( Path )
+        Wvlgt = []
+    return { 'Date':  np.array( Date, dtype='datetime64[s]' ),
+             'Data':  np.asarray( Data, dtype=float ),
+             'Wvlgt': np.array( Wvlgt, dtype=float ),
+             'Error': np.asarray( Error, dtype=float ) }
+
+def cachefile( Path, CacheDir ):
+    """Name of the cache file of a product file."""
+    Key = hashlib.sha1( os.path.abspath(Path).encode() ).hexdigest()[:16]
+    return os.path.join( CacheDir, Key + '.npz' )
+
+def buildentry( Path, CacheDir ):
+    """
+    Parse a product file and save its cache file (written under a temporary
+    name, then renamed). Returns the index entry of the file.
+    """
+    St = os.stat( Path )
+    Arrays = parsefile( Path )
+    File = cachefile( Path, CacheDir )
+    Tmp = File[:-4] + '.tmp%d.npz' % os.getpid()
+    np.savez( Tmp, **Arrays )
+    os.replace( Tmp, File )
+    Date = Arrays['Date']
+    NaT = np.datetime64('NaT', 's')
+    return ( Path, Path[-3:].lower(), St.st_mtime, St.st_size, len(Date),\
+             Date.min() if len(Date) else NaT, Date.max() if len(Date) else NaT )
+
+class ArchiveIndex(object):
+    """
+    Index of the product files below a directory.
+
+    Parameters
+    ----------
+    Root : string
+        Root directory of the SKYRAD/SUNRAD products
+    CacheDir : string, optional
+        Directory of the cache files and of the index.
+        Default: '.srscache' in Root
+    Processes : integer, optional
+        Worker processes for the parsing of new files. Default: number of CPUs
+    """
+    FIELDS = ( 'Path', 'Kind', 'Mtime', 'Size', 'N', 'Tmin', 'Tmax' )
+
+    def __init__( self, Root, CacheDir=None, Processes=None ):
+        self.Root = Root
+        self.CacheDir = CacheDir if CacheDir is not None else \
+                        os.path.join( Root, '.srscache' )
+        self.Processes = Processes
+        self.Entries = {}
+        self._Loaded = {}
+        File = os.path.join( self.CacheDir, INDEX )
+        if os.path.exists( File ):
+            with np.load( File ) as Ix:
+                Cols = [ Ix[F] for F in self.FIELDS ]
+            for Row in zip( *Cols ):
+                self.Entries[ str(Row[0]) ] = ( str(Row[0]), str(Row[1]),\
+                    float(Row[2]), int(Row[3]), int(Row[4]), Row[5], Row[6] )
+        self.table()
+
+    def table( self ):
+        """Support function: columnar arrays of the entries, for queries."""
+        Rows = sorted( self.Entries.values(), key=lambda E: E[0] )
+        Cols = list( zip(*Rows) ) if Rows else [ [] ] * len(self.FIELDS)
+        Types = ( str, str, float, int, int, 'datetime64[s]', 'datetime64[s]' )
+        self.Table = dict( (F, np.array(C, dtype=T)) for F, C, T in \
+                           zip(self.FIELDS, Cols, Types) )
+
+    def scan( self ):
+        """
+        Look for new or modified product files below Root, parse them (in
+        parallel) and save the index. Entries of removed files are dropped.
+        Returns the number of files parsed.
+        """
+        Found = {}
+        for Dir, Sub, Names in os.walk( self.Root ):
+            if os.path.abspath(Dir).startswith( os.path.abspath(self.CacheDir) ):
+                continue
+            for N in Names:
+                if N[-3:].lower() in KINDS:
+                    P = os.path.join( Dir, N );   St = os.stat( P )
+                    Found[P] = ( St.st_mtime, St.st_size )
+        Stale = [ P for P in sorted(Found) if P not in self.Entries or \
+                  self.Entries[P][2:4] != Found[P] ]
+        for P in list( self.Entries ):
+            if P not in Found:
+                del self.Entries[P];   self._Loaded.pop( P, None )
+                if os.path.exists( cachefile(P, self.CacheDir) ):
+                    os.remove( cachefile(P, self.CacheDir) )
+        if Stale:
+            if not os.path.isdir(self.CacheDir): os.makedirs(self.CacheDir)
+            if len(Stale) == 1 or self.Processes == 1:
+                New = [ buildentry( P, self.CacheDir ) for P in Stale ]
+            else:
+                with ProcessPoolExecutor( max_workers=self.Processes ) as Pool:
+                    New = list( Pool.map( buildentry, Stale,\
+                                          [self.CacheDir] * len(Stale) ) )
+            for E in New:
+                self.Entries[E[0]] = E;   self._Loaded.pop( E[0], None )
+        self.table()
+        self.save()
+        return len(Stale)
+
+    def save( self ):
+        """Save the index in the cache directory."""
+        if not os.path.isdir(self.CacheDir): os.makedirs(self.CacheDir)
+        File = os.path.join( self.CacheDir, INDEX )
+        Tmp = File[:-4] + '.tmp.npz'
+        np.savez( Tmp, **self.Table )
+        os.replace( Tmp, File )
+
+    def files( self, Kind, Start=None, End=None ):
+        """Product files of type **Kind** with records from Start to End."""
+        T = self.Table
+        Sel = ( T['Kind'] == Kind.lower() ) & ( T['N'] > 0 )
+        if Start is not None: Sel &= T['Tmax'] >= np.datetime64(Start, 's')
+        if End   is not None: Sel &= T['Tmin'] <= np.datetime64(End, 's')
+        Order = np.argsort( T['Tmin'][Sel], kind='stable' )
+        return T['Path'][Sel][Order].tolist()
+
+    def load( self, Path ):
+        """Cached arrays of a product file (kept in memory after the first use)."""
+        if Path not in self._Loaded:
+            with np.load( cachefile(Path, self.CacheDir) ) as F:
+                self._Loaded[Path] = dict( (K, F[K]) for K in F.files )
+        return self._Loaded[Path]
+
+    def query( self, Kind, Start=None, End=None ):
+        """
+        All the records of type **Kind** ('dt2', 'opt', 'par', 'vol') from
+        **Start** to **End** (datetime64, datetime or ISO string, both
+        included), sorted by time.
+
+        Returns
+        -------
+        Out : dictionary of ndarrays
+            'Date', 'Data', 'Error' (SKYRAD only) as in parsefile, and
+            'Wvlgt' of the first file. Files with a different number of data
+            columns in the range raise ValueError.
+        """
+        Parts = [ self.load(P) for P in self.files(Kind, Start, End) ]
+        if not Parts:
+            return { 'Date': np.array([], 'datetime64[s]'), 'Data': np.empty((0, 0)),\
+                     'Error': np.array([]), 'Wvlgt': np.array([]) }
+        Shapes = set( P['Data'].shape[1:] for P in Parts )
+        if len(Shapes) > 1:
+            raise ValueError('query: %s files with different data columns '\
+                             'in the range: %s' % (Kind, sorted(Shapes)))
+        Date = np.concatenate( [ P['Date'] for P in Parts ] )
+        Sel = np.ones( len(Date), bool )
+        if Start is not None: Sel &= Date >= np.datetime64(Start, 's')
+        if End   is not None: Sel &= Date <= np.datetime64(End, 's')
+        Sel = np.flatnonzero( Sel )
+        Sel = Sel[ np.argsort( Date[Sel], kind='stable' ) ]
+        Out = { 'Date': Date[Sel],
+                'Data': np.concatenate( [ P['Data'] for P in Parts ] )[Sel],
+                'Wvlgt': Parts[0]['Wvlgt'] }
+        Out['Error'] = np.concatenate( [ P['Error'] for P in Parts ] )[Sel] \
+                       if Kind.lower() in ( 'par', 'vol' ) else np.array([])
+        return Out
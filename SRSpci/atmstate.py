@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Per-record atmospheric state: season code, pressure, temperature and
+effective gas temperatures for every spectrum, as columnar arrays.
+
+Season-dependent values are taken from the SEASON_* tables of the SRStools
+module by array indexing, so the optical depth functions (and the
+OpticalDepthEngine) can be fed with one season code per record.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from . import SRStools as srt
+#%%---------------------------------------------------------------------------
+def todatetime64( Date ):
+    """
+    Support function: turn a datetime, a list of datetime objects or an
+    array of datetime64 into a datetime64[us] array.
+    """
+    return np.atleast_1d( np.asarray( Date, dtype='datetime64[us]' ) )
+
+def onrecords( Series, Date, Default ):
+    """
+    Support function: bring a measured series onto the records.
+
+    Series can be None (use Default), an array with one value per record, or
+    a tuple (Times, Values) of a series measured at its own times, which is
+    linearly interpolated at the record timestamps. Missing values (NaN)
+    are replaced by Default.
+    """
+    if Series is None:
+        return np.array( np.broadcast_to(Default, Date.shape), dtype=float )
+    if isinstance(Series, tuple):
+        Times, Values = Series
+        T0 = Date[0]
+        Values = np.interp( (Date - T0) / np.timedelta64(1, 's'),
+                    (todatetime64(Times) - T0) / np.timedelta64(1, 's'),
+                    np.asarray(Values, dtype=float) )
+    else:
+        Values = np.array( np.broadcast_to(Series, Date.shape), dtype=float )
+    return np.where( np.isnan(Values), Default, Values )
+
+def atmstate( Date, Height, Pres=None, Tamb=None ):
+    """
+    Build the atmospheric state of every record.
+
+    Parameters
+    ----------
+    Date : datetime, list of datetime objects or datetime64 array
+        UTC timestamps of the records
+    Height : float
+        Elevation of the measurement site, in [meters] above mean sea level.
+    Pres : array_like or tuple, optional
+        Measured pressure in [bar]: one value per record, or a (Times, Values)
+        series interpolated on the records. Default: seasonal standard value
+    Tamb : array_like or tuple, optional
+        Measured ambient temperature in [Celsius], as for **Pres**.
+        Default: not measured (999), i.e. standard effective temperatures
+
+    Returns
+    -------
+    State : dictionary of ndarrays, one element per record
+        'Date'    : timestamps as datetime64[us]
+        'Season'  : season code (see SRStools.stdatm)
+        'Pres'    : pressure [bar], measured or standard
+        'Tamb'    : ambient temperature [Celsius], 999 if not measured
+        'Teff'    : effective temperature of the O3 and NO2 layers [K]
+        'O3col', 'NO2col' : seasonal default columns [atm-cm]
+        'WVcol'   : seasonal default water vapour column [cm]
+
+    Example
+    -------
+    >>> St = atmstate(Dates, 570., Tamb=(MeteoTimes, MeteoTemps))
+    >>> OD = Engine.compute(St['Date'], Pres=St['Pres'], Tamb=St['Tamb'],
+    ...                     Season=St['Season'])
+    """
+    Date = todatetime64( Date )
+    Season, Pstd = srt.stdatm( Date, Height )
+    Pres = onrecords( Pres, Date, Pstd )
+    Tamb = onrecords( Tamb, Date, 999. )
+    H = Height / 1000.
+    return { 'Date': Date, 'Season': Season, 'Pres': Pres, 'Tamb': Tamb,
+             'Teff': srt.efftemp( Tamb, Height, Season ),
+             'O3col':  srt.SEASON_O3COL[Season] * (1. - 8.98e-3 * H),
+             'NO2col': srt.SEASON_NO2COL[Season],
+             'WVcol':  srt.SEASON_WVCOL[Season] * \
+                       np.exp( -srt.SEASON_WVSCAL[Season] * Height ) }
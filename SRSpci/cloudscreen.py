@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Cloud screening of direct-sun AOD time series, following the criteria of
+the AERONET cloud screening (Smirnov et al., 2000):
+
+    - triplet: the AOD at the reference wavelength of the last three records,
+      measured within a short time, must not vary more than
+      max( 0.02, 0.03 * mean AOD ); records without such a triplet (slow
+      acquisition cadence, first records after a gap) are not tested
+    - smoothness: the rms rate of change of the AOD over a sliding window of
+      records must stay below 0.01 per minute
+    - Angstrom range: the Angstrom exponent must be within a plausible
+      range for aerosols (clouds give values around zero or below)
+
+The filter works online: each new record updates ring buffers of fixed
+length, at a constant cost, so it can screen the records as they are
+measured. Batch screening of a day or of an archive runs the same update
+over the records in time order (CloudScreen.screen, or as the Screen
+function of pipeline.aodpipeline).
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from . import angstrom as ang
+#%%---------------------------------------------------------------------------
+# Screening codes, combined bitwise: 0 means cloud-free
+CLEAR    = 0
+INVALID  = 1      # no valid AOD at the reference wavelength
+TRIPLET  = 2      # triplet variability above threshold
+SMOOTH   = 4      # AOD rate of change above threshold
+ALPHA    = 8      # Angstrom exponent out of range
+
+class RingBuffer(object):
+    """
+    Fixed-size circular buffer of floats, keeping a running sum.
+
+    Parameters
+    ----------
+    Size : integer
+        Number of values kept
+    """
+    def __init__( self, Size ):
+        self.Data = np.zeros( int(Size) )
+        self.reset()
+
+    def reset( self ):
+        self.Head = 0;   self.Count = 0;   self.Sum = 0.
+
+    def push( self, Value ):
+        """Add a value, dropping the oldest one when the buffer is full."""
+        if self.Count == len(self.Data): self.Sum -= self.Data[self.Head]
+        else: self.Count += 1
+        self.Data[self.Head] = Value
+        self.Sum += Value
+        self.Head = ( self.Head + 1 ) % len(self.Data)
+
+    def last( self, k=0 ):
+        """Value pushed k steps ago (0: the last one)."""
+        return self.Data[ (self.Head - 1 - k) % len(self.Data) ]
+
+    def mean( self ):
+        return self.Sum / self.Count if self.Count else np.nan
+
+class CloudScreen(object):
+    """
+    Online cloud screening filter for the AOD spectra of one instrument.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Wavelength grid of the AOD spectra, in [nanometers]
+    RefWvl : float, optional
+        Reference wavelength of the triplet and smoothness checks. The AOD
+        is averaged over the pixels within **Band** nm. Default: 500 nm
+    Band : float, optional
+        Half-width of the averaging band, in [nanometers]. Default: 2 nm
+    AlphaWindow : tuple, optional
+        Wavelength window of the Angstrom exponent. Default: (440., 870.)
+    AlphaRange : tuple, optional
+        Accepted range of the Angstrom exponent. Default: (-0.5, 3.)
+    TripletTime : float, optional
+        Longest duration of a triplet, in [seconds]. Default: 180 s. It must
+        span at least two acquisition intervals: when the last three records
+        are longer apart the triplet check is skipped, not failed
+    TripletAbs, TripletRel : float, optional
+        Absolute and relative triplet thresholds. Default: 0.02, 0.03
+    Window : integer, optional
+        Number of rates of change in the smoothness window. Default: 10
+    MaxRate : float, optional
+        Largest rms rate of change of the AOD, per minute. Default: 0.01
+    MaxGap : float, optional
+        Gap between records, in [seconds], after which the sliding windows
+        start again. Default: 600 s
+
+    Example
+    -------
+    >>> Screen = CloudScreen(WaveLgt)
+    >>> Code = Screen.update(Date, AOD)                 # one record, online
+    >>> Codes = Screen.screen(Dates, AODs)              # batch
+    >>> Chain = pipeline.aodpipeline(Files, V0, Engine, Screen=Screen)
+    """
+    def __init__( self, WaveLgt, RefWvl=500., Band=2., AlphaWindow=(440., 870.),\
+                  AlphaRange=(-0.5, 3.), TripletTime=180., TripletAbs=0.02,\
+                  TripletRel=0.03, Window=10, MaxRate=0.01, MaxGap=600. ):
+        self.WaveLgt = np.asarray( WaveLgt, dtype=float )
+        self.Ref = np.flatnonzero( np.abs(self.WaveLgt - RefWvl) <= Band )
+        if len(self.Ref) == 0:
+            self.Ref = np.array([ np.argmin(np.abs(self.WaveLgt - RefWvl)) ])
+        self.AlphaWindow = tuple(AlphaWindow)
+        self.AlphaRange = AlphaRange
+        self.TripletTime, self.TripletAbs, self.TripletRel = \
+            float(TripletTime), TripletAbs, TripletRel
+        self.MaxRate, self.MaxGap = MaxRate, float(MaxGap)
+        self.Times = RingBuffer( 3 )       # last three valid records
+        self.Taus  = RingBuffer( 3 )
+        self.Rates = RingBuffer( Window )  # squared rates of change
+        self.File = None
+
+    def reset( self ):
+        """Empty the sliding windows (e.g. at the start of a new day)."""
+        for B in ( self.Times, self.Taus, self.Rates ): B.reset()
+
+    def reduce( self, AOD ):
+        """
+        AOD at the reference wavelength and Angstrom exponent of a batch of
+        spectra, shape (N_spectra, N_wavelengths).
+        """
+        AOD = np.atleast_2d( AOD )
+        with np.errstate(invalid='ignore'):
+            Tau = np.nanmean( AOD[:,self.Ref], axis=1 ) \
+                  if len(self.Ref) > 1 else AOD[:,self.Ref[0]]
+            Alpha = ang.angstrom( self.WaveLgt, AOD, Windows=(self.AlphaWindow,),\
+                                  Curvature=False )[0][:,0]
+        return Tau, Alpha
+
+    def update( self, Time, Tau, Alpha ):
+        """
+        Screen one record, at constant cost.
+
+        Parameters
+        ----------
+        Time : float or datetime64
+            Time of the record, in [seconds] (any origin) or as datetime64
+        Tau : float
+            AOD at the reference wavelength (see reduce)
+        Alpha : float
+            Angstrom exponent
+
+        Returns
+        -------
+        Code : integer
+            Screening code, CLEAR (0) or a combination of INVALID, TRIPLET,
+            SMOOTH and ALPHA flags.
+        """
+        if isinstance(Time, np.datetime64):
+            Time = ( Time - np.datetime64(0, 's') ) / np.timedelta64(1, 's')
+        if not np.isfinite(Tau): return INVALID
+        Code = CLEAR
+        if not ( self.AlphaRange[0] <= Alpha <= self.AlphaRange[1] ):
+            Code |= ALPHA
+
+        if self.Times.Count and Time - self.Times.last() > self.MaxGap:
+            self.reset()
+        if self.Times.Count:
+            Dt = max( Time - self.Times.last(), 1. ) / 60.
+            self.Rates.push( ( (Tau - self.Taus.last()) / Dt )**2 )
+        self.Times.push( Time );   self.Taus.push( Tau )
+
+        # Triplet: the last three records, within TripletTime (not tested
+        # when there is no such triplet)
+        if self.Times.Count == 3 and Time - self.Times.last(2) <= self.TripletTime:
+            T = self.Taus.Data
+            if T.max() - T.min() > max( self.TripletAbs,\
+                                        self.TripletRel * self.Taus.mean() ):
+                Code |= TRIPLET
+        # Smoothness: rms rate of change over the window
+        if self.Rates.Count and \
+           np.sqrt( max(self.Rates.mean(), 0.) ) > self.MaxRate:
+            Code |= SMOOTH
+        return Code
+
+    def screen( self, Date, AOD ):
+        """
+        Screen a batch of records in time order, continuing from the records
+        already seen. Returns the screening code of each record.
+        """
+        Date = np.atleast_1d( np.asarray(Date, dtype='datetime64[us]') )
+        Time = ( Date - np.datetime64(0, 'us') ) / np.timedelta64(1, 's')
+        Tau, Alpha = self.reduce( AOD )
+        return np.array( [ self.update(Time[k], Tau[k], Alpha[k]) \
+                           for k in range(len(Time)) ], dtype=int )
+
+    def __call__( self, Block ):
+        """
+        Screen function for pipeline.aodpipeline: True for the cloud-free
+        records of a block. The windows start again with each new file.
+        """
+        if Block.get('File') != self.File:
+            self.File = Block.get('File');   self.reset()
+        Block['Cloud'] = self.screen( Block['Date'], Block['AOD'] )
+        return Block['Cloud'] == CLEAR
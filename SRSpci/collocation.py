@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Time-matched comparison of the SRS AOD against reference retrievals of the
+Prede POM (SUNRAD OPT or SKYRAD PAR products, see skyradtools and
+archiveindex).
+
+Each SRS spectrum is paired with the nearest reference retrieval within a
+time tolerance (as-of join on sorted datetime64 arrays, by searchsorted),
+the SRS AOD is interpolated at the reference wavelengths, and bias, RMSE
+and linear regression statistics are computed for each wavelength. All the
+steps are whole-array operations: cost grows linearly with the number of
+records (plus the sorting).
+
+Example
+-------
+>>> Opt = Index.query('opt', Start, End)
+>>> Wvl = Opt['Wvlgt'] * 1e3                      # [micrometers] -> [nm]
+>>> C = collocate(Date, WaveLgt, AOD, Opt['Date'], Wvl,
+...               Opt['Data'][:,:len(Wvl)])
+>>> C['Bias'], C['RMSE'], C['Slope']
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+#%%---------------------------------------------------------------------------
+def asofjoin( Date, RefDate, Tol=np.timedelta64(60, 's') ):
+    """
+    Index of the nearest reference time for each time of **Date**.
+
+    Parameters
+    ----------
+    Date : datetime64 array
+        Times to be matched (any order)
+    RefDate : datetime64 array
+        Reference times (any order)
+    Tol : timedelta64, optional
+        Largest accepted time difference. Default: 60 s
+
+    Returns
+    -------
+    Idx : ndarray
+        Index into RefDate of the match of each element of Date, -1 if
+        there is no reference time within Tol
+    """
+    Date = np.asarray( Date, dtype='datetime64[us]' )
+    RefDate = np.asarray( RefDate, dtype='datetime64[us]' )
+    Idx = np.full( len(Date), -1 )
+    if len(RefDate) == 0 or len(Date) == 0: return Idx
+    Order = np.argsort( RefDate, kind='stable' )
+    Ref = RefDate[Order]
+    # Candidates: the reference times just before and just after
+    After = np.clip( np.searchsorted( Ref, Date ), 0, len(Ref) - 1 )
+    Before = np.clip( After - 1, 0, len(Ref) - 1 )
+    DtA = np.abs( Ref[After] - Date );   DtB = np.abs( Date - Ref[Before] )
+    Best = np.where( DtB <= DtA, Before, After )
+    Dt = np.minimum( DtA, DtB )
+    Ok = Dt <= Tol
+    Idx[Ok] = Order[ Best[Ok] ]
+    return Idx
+
+def interpwl( WaveLgt, AOD, RefWvl ):
+    """
+    Linear interpolation of AOD spectra (N_spectra, N_pixels) at the
+    wavelengths **RefWvl** (same units of WaveLgt). Wavelengths outside the
+    grid give NaN.
+    """
+    WaveLgt = np.asarray( WaveLgt, dtype=float )
+    RefWvl = np.atleast_1d( np.asarray(RefWvl, dtype=float) )
+    AOD = np.atleast_2d( AOD )
+    J = np.clip( np.searchsorted( WaveLgt, RefWvl ) - 1, 0, len(WaveLgt) - 2 )
+    W = ( RefWvl - WaveLgt[J] ) / ( WaveLgt[J+1] - WaveLgt[J] )
+    Out = AOD[:,J] * (1. - W) + AOD[:,J+1] * W
+    Out[ :, (RefWvl < WaveLgt[0]) | (RefWvl > WaveLgt[-1]) ] = np.nan
+    return Out
+
+def stats( X, Y ):
+    """
+    Comparison statistics of Y (e.g. SRS) against X (reference), column by
+    column, over the pairs where both are finite.
+
+    Returns
+    -------
+    Stats : dictionary of ndarrays, one value per column
+        'N', 'Bias' (mean Y - X), 'RMSE', 'Slope', 'Intercept' (least
+        squares Y = Slope X + Intercept) and 'R' (correlation coefficient)
+    """
+    X = np.atleast_2d( X );   Y = np.atleast_2d( Y )
+    Ok = np.isfinite(X) & np.isfinite(Y)
+    N = Ok.sum(0)
+    X = np.where( Ok, X, 0. );   Y = np.where( Ok, Y, 0. )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Mx = X.sum(0) / N;   My = Y.sum(0) / N
+        D = Y - X
+        Bias = D.sum(0) / N
+        RMSE = np.sqrt( (D**2).sum(0) / N )
+        # Centred sums, pairs outside Ok contribute zero
+        Xc = np.where( Ok, X - Mx, 0. );   Yc = np.where( Ok, Y - My, 0. )
+        Sxx = (Xc**2).sum(0);   Syy = (Yc**2).sum(0);   Sxy = (Xc*Yc).sum(0)
+        Slope = Sxy / Sxx
+        R = Sxy / np.sqrt( Sxx * Syy )
+    return { 'N': N, 'Bias': Bias, 'RMSE': RMSE, 'Slope': Slope,
+             'Intercept': My - Slope * Mx, 'R': R }
+
+def collocate( Date, WaveLgt, AOD, RefDate, RefWvl, RefAOD,\
+               Tol=np.timedelta64(60, 's'), Clear=None ):
+    """
+    Pair SRS spectra with reference retrievals and compare their AOD.
+
+    Parameters
+    ----------
+    Date : datetime64 array
+        Timestamps of the SRS spectra
+    WaveLgt : ndarray
+        SRS wavelength grid, in [nanometers]
+    AOD : ndarray
+        SRS AOD, shape (N_spectra, N_pixels)
+    RefDate : datetime64 array
+        Timestamps of the reference retrievals
+    RefWvl : ndarray
+        Reference wavelengths, in [nanometers]
+    RefAOD : ndarray
+        Reference AOD, shape (N_retrievals, N_refwavelengths)
+    Tol : timedelta64, optional
+        Largest time difference of a pair. Default: 60 s
+    Clear : ndarray of bool, optional
+        SRS records to be used (e.g. cloud screening). Default: all
+
+    Returns
+    -------
+    Out : dictionary
+        'Idx' (SRS index of each pair), 'RefIdx' (reference index),
+        'Srs', 'Ref' (paired AOD at RefWvl, (N_pairs, N_refwavelengths)),
+        'Wvl' and the statistics of stats(Ref, Srs)
+    """
+    Match = asofjoin( Date, RefDate, Tol )
+    Ok = Match >= 0
+    if Clear is not None: Ok &= np.asarray( Clear, dtype=bool )
+    Idx = np.flatnonzero( Ok )
+    RefIdx = Match[Idx]
+    Srs = interpwl( WaveLgt, np.atleast_2d(AOD)[Idx], RefWvl )
+    Ref = np.atleast_2d( RefAOD )[RefIdx]
+    Out = { 'Idx': Idx, 'RefIdx': RefIdx, 'Srs': Srs, 'Ref': Ref,
+            'Wvl': np.atleast_1d( np.asarray(RefWvl, dtype=float) ) }
+    Out.update( stats( Ref, Srs ) )
+    return Out
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Langley-plot calibration of the SRS: the calibration constant V0(λ) is the
+extrapolation to zero air mass of the linear fit
+
+    ln( V(λ) * R² ) = ln( V0(λ) ) - m * τ(λ)
+
+made over a clear, stable morning or afternoon. The fit is made for every
+pixel at once, as a batched least-squares problem with iterative rejection
+of the outliers.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from . import SRStools as srt
+from . import srsfiles
+from .retrieval import darkcorrect
+#%%---------------------------------------------------------------------------
+def linfit( X, Y, W ):
+    """
+    Weighted linear least squares Y = A + B * X, solved in closed form for
+    all the columns of Y at once.
+
+    Parameters
+    ----------
+    X : ndarray
+        Abscissa (air mass), shape (N,)
+    Y : ndarray
+        Ordinates, shape (N, N_pixels)
+    W : ndarray
+        Weights (0/1 for masked points), shape (N, N_pixels)
+
+    Returns
+    -------
+    A, B : ndarray
+        Intercept and slope of each column
+    sA, sB : ndarray
+        Standard errors of the intercept and slope
+    Res : ndarray
+        Residuals Y - A - B * X, shape (N, N_pixels)
+    """
+    X = X[:,None]
+    Sw  = W.sum(0);           Sx  = (W * X).sum(0)
+    Sy  = (W * Y).sum(0);     Sxx = (W * X**2).sum(0)
+    Sxy = (W * X * Y).sum(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Det = Sw * Sxx - Sx**2
+        B = ( Sw * Sxy - Sx * Sy ) / Det
+        A = ( Sy - B * Sx ) / Sw
+        Res = Y - A - B * X
+        # Residual variance, with 2 degrees of freedom used by the fit
+        S2 = ( W * Res**2 ).sum(0) / ( Sw - 2. )
+        sA = np.sqrt( S2 * Sxx / Det )
+        sB = np.sqrt( S2 * Sw / Det )
+    return A, B, sA, sB, Res
+
+def langley( Signal, Zang, SunR, MinAMF=2., MaxAMF=5., Nsigma=2.5,\
+             MaxIter=10, C=None, Lat=45. ):
+    """
+    Langley calibration of all the pixels, from a half-day of spectra.
+
+    Parameters
+    ----------
+    Signal : ndarray
+        Dark-corrected spectra, shape (N_spectra, N_pixels), e.g. in
+        [counts/ms] as given by retrieval.darkcorrect
+    Zang : ndarray
+        Solar Zenith Angle of each spectrum, in degrees
+    SunR : ndarray
+        Sun-Earth distance of each spectrum, in AU
+    MinAMF, MaxAMF : float, optional
+        Air mass range used by the fit. Default: from 2 to 5
+    Nsigma : float, optional
+        Points farther than Nsigma standard deviations from the fitted line
+        are rejected, and the fit repeated. Default: 2.5
+    MaxIter : integer, optional
+        Maximum number of rejection iterations. Default: 10
+    C : integer, optional
+        If given, use the Gueymard air mass of that component (see the
+        Guyairmass function) instead of the Kasten and Young one.
+    Lat : float, optional
+        Latitude of the site (used only by the ozone air mass). Default: 45
+
+    Returns
+    -------
+    V0 : ndarray
+        Calibration constant at 1 AU, in the same units of Signal
+    sV0 : ndarray
+        Standard error of V0
+    Stats : dictionary of ndarrays
+        Per-pixel statistics of the day: 'Tau' (slope, total optical depth),
+        'sTau', 'Npts' (points kept by the fit), 'Rms' (residual standard
+        deviation of ln V) and 'Iter' (number of iterations made).
+    """
+    Zang = np.asarray(Zang, dtype=float)
+    if C is None: AMF = srt.airmass(Zang, Lat=Lat)
+    else: AMF = srt.Guyairmass(Zang, C)
+
+    Sel = (AMF >= MinAMF) & (AMF <= MaxAMF)
+    X = AMF[Sel]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Y = np.log( Signal[Sel] * np.asarray(SunR)[Sel,None]**2 )
+    W = np.isfinite(Y).astype(float)
+    Y[W == 0] = 0.
+
+    for k in range(MaxIter):
+        A, B, sA, sB, Res = linfit( X, Y, W )
+        with np.errstate(invalid='ignore'):
+            Rms = np.sqrt( (W * Res**2).sum(0) / np.maximum(W.sum(0) - 2., 1.) )
+            Wnew = W * ( np.abs(Res) <= Nsigma * Rms )
+        if np.array_equal( Wnew, W ): break
+        W = Wnew
+    A, B, sA, sB, Res = linfit( X, Y, W )
+
+    V0 = np.exp(A)
+    Stats = { 'Tau': -B, 'sTau': sB, 'Npts': W.sum(0).astype(int),
+              'Rms': np.sqrt( (W * Res**2).sum(0) / np.maximum(W.sum(0) - 2., 1.) ),
+              'Iter': k + 1 }
+    return V0, V0 * sA, Stats
+
+def langleyday( File, Site, Half='am', **kwargs ):
+    """
+    Langley calibration from a daily SRS data file.
+
+    Parameters
+    ----------
+    File : string
+        Daily SRS data file (see the srsfiles module)
+    Site : list of floats (3)
+        North latitude, East longitude [degrees] and elevation [meters asl]
+    Half : string, optional
+        'am' for the morning, 'pm' for the afternoon. Default: 'am'
+    **kwargs : optional
+        Other arguments for the langley function.
+
+    Returns
+    -------
+    V0, sV0, Stats : see the langley function
+    """
+    Signal, Date = [], []
+    Dark = None
+    for Records in srsfiles.iterrecords( File ):
+        S, Sel, Dark = darkcorrect( Records, Dark )
+        Signal.append(S);   Date.append( Records['Date'][Sel] )
+    Signal = np.vstack(Signal);   Date = np.concatenate(Date)
+
+    Zang, Azim, SunR = srt.sunPosition( list(Date.astype('datetime64[us]')\
+                       .astype(object)), Site[:2], Height=Site[2] )
+    # Morning: the Sun is East of the local meridian
+    Sel = (Azim < 180.) if Half == 'am' else (Azim >= 180.)
+    kwargs.setdefault( 'Lat', Site[0] )
+    return langley( Signal[Sel], Zang[Sel], SunR[Sel], **kwargs )
+
+def langleymean( Files, Site, Half='am', Processes=None, **kwargs ):
+    """
+    Mean calibration constant from several Langley days, each fitted in its
+    own process.
+
+    Parameters
+    ----------
+    Files : list of strings
+        Daily SRS data files selected as Langley days
+    Site : list of floats (3)
+        North latitude, East longitude [degrees] and elevation [meters asl]
+    Half : string, optional
+        'am' or 'pm', as in langleyday. Default: 'am'
+    Processes : integer, optional
+        Number of worker processes. Default: one per CPU
+    **kwargs : optional
+        Other arguments for the langley function.
+
+    Returns
+    -------
+    V0 : ndarray
+        Inverse-variance weighted mean of the daily V0
+    sV0 : ndarray
+        Standard deviation of the daily V0 values (day-to-day variability)
+    Days : list of tuples
+        (V0, sV0, Stats) of each day, in the order of **Files**
+    """
+    with ProcessPoolExecutor( max_workers=Processes ) as Pool:
+        Futures = [ Pool.submit( langleyday, F, Site, Half, **kwargs ) \
+                    for F in Files ]
+        Days = [ F.result() for F in Futures ]
+
+    V0s = np.array( [ D[0] for D in Days ] )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        W = 1. / np.array( [ D[1] for D in Days ] )**2
+        W[ ~np.isfinite(W) | ~np.isfinite(V0s) ] = 0.
+        V0 = np.nansum( W * V0s, axis=0 ) / W.sum(0)
+    return V0, np.nanstd( V0s, axis=0 ), Days
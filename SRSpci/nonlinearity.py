@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Detector nonlinearity correction, with the coefficients stored in the
+spectrometer EEPROM (DeviceConfigType: m_Detector_m_NLEnable,
+m_Detector_m_aNLCorrect, m_Detector_m_aLowNLCounts, m_Detector_m_aHighNLCounts).
+
+The dark-corrected counts C of each pixel are divided by the response
+factor given by the 8-term polynomial:
+
+    f(C) = a0 + a1 C + a2 C² + ... + a7 C⁷
+
+evaluated with C clipped to the valid range [LowNLCounts, HighNLCounts], so
+that the polynomial is never extrapolated. Coefficients and range share the
+ADC units of the EEPROM: counts of a different ADC resolution are scaled to
+those units (Scale) before clipping.
+
+A correction object keeps its work buffers: the single-scan path
+(correctscan) reuses them for every scan, while batches of spectra
+(apply) are corrected with a few whole-array operations. operateSRS keeps
+writing the raw counts to the daily files, so that the archive can always
+be reprocessed: the correction is applied when the files are processed
+(retrieval.darkcorrect, pipeline, reprocess).
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from .avaspecSRS import NPIXEL
+#%%---------------------------------------------------------------------------
+_ConfigCache = {}
+
+class NLCorrection(object):
+    """
+    Nonlinearity correction for one spectrometer.
+
+    Parameters
+    ----------
+    Coeffs : list of floats (8)
+        Polynomial coefficients a0 ... a7, in increasing order
+    Low, High : float, optional
+        Valid range of the counts for the polynomial. Default: no limit
+    Enable : bool, optional
+        False gives an identity correction (NLEnable flag). Default: True
+    Scale : float, optional
+        Counts are divided by Scale before clipping to [Low, High] and
+        evaluating the polynomial, for coefficients measured with a
+        different ADC resolution (e.g. 4 for 14-bit coefficients with the
+        16-bit ADC). Default: 1
+    Npix : integer, optional
+        Number of pixels of a scan, for the live buffers. Default: NPIXEL
+    Dtype : data type, optional
+        Precision of the buffers and results. Default: float
+
+    Example
+    -------
+    >>> NL = NLCorrection.fromconfig(params)     # live, params from Initialization
+    >>> Corr = NL.correctscan(Spectrum, Dark)
+    >>> Signal = NL.apply(Counts - Darks)         # batch
+    """
+    def __init__( self, Coeffs, Low=-np.inf, High=np.inf, Enable=True,\
+                  Scale=1., Npix=NPIXEL, Dtype=float ):
+        self.Coeffs = np.asarray( Coeffs, dtype=float )
+        self.Low, self.High = float(Low), float(High)
+        self.Enable = bool(Enable)
+        self.Scale = float(Scale)
+        self.Dtype = np.dtype(Dtype)
+        # Work buffers of the live path: difference, clipped counts, factor
+        self.Diff, self.Clip, self.Fact = np.empty( (3, Npix), self.Dtype )
+
+    @classmethod
+    def fromconfig( cls, Params, **kwargs ):
+        """
+        Correction from the device configuration (AVS_GetParameter). Objects
+        are cached by coefficients, so repeated calls return the same one.
+        """
+        Key = ( tuple(Params.m_Detector_m_aNLCorrect),\
+                float(Params.m_Detector_m_aLowNLCounts),\
+                float(Params.m_Detector_m_aHighNLCounts),\
+                bool(Params.m_Detector_m_NLEnable) )
+        Key += tuple( sorted(kwargs.items()) )
+        if Key not in _ConfigCache:
+            _ConfigCache[Key] = cls( *Key[:4], **kwargs )
+        return _ConfigCache[Key]
+
+    def factor( self, Counts, X=None, F=None ):
+        """
+        Response factor f(C) of dark-corrected counts, any shape. Buffers
+        for the clipped counts (X) and for the result (F) can be given.
+        """
+        # Low/High are in the ADC units of the coefficients: scale first
+        if X is None: X = np.empty( np.shape(Counts), self.Dtype )
+        np.divide( Counts, self.Scale, out=X )
+        np.clip( X, self.Low, self.High, out=X )
+        if F is None: F = np.empty_like( X )
+        # Horner scheme, in place
+        F.fill( self.Coeffs[-1] )
+        for a in self.Coeffs[-2::-1]:
+            F *= X;   F += a
+        return F
+
+    def apply( self, Counts, Out=None ):
+        """
+        Correct a batch of dark-corrected spectra, shape (N_spectra,
+        N_pixels). With Out=Counts the correction is made in place.
+        """
+        Counts = np.asarray( Counts, dtype=self.Dtype )
+        if Out is None: Out = Counts.copy()
+        elif Out is not Counts: Out[...] = Counts
+        if self.Enable:
+            Out /= self.factor( Counts )
+        return Out
+
+    def correctscan( self, Spectrum, Dark=None ):
+        """
+        Live path: correct one raw scan (e.g. the data from AVS_GetScopeData)
+        after subtracting the **Dark** scan, in the internal buffers without
+        new allocations. The returned array is overwritten by the next call:
+        copy it to keep it.
+        """
+        D = self.Diff
+        D[...] = Spectrum
+        if Dark is not None: D -= Dark
+        if self.Enable:
+            D /= self.factor( D, self.Clip, self.Fact )
+        return D
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Batched calculation of the atmospheric optical depths (Rayleigh, O3, NO2 and
+water vapour) and of the matching air masses, for a whole set of spectra
+measured on the same wavelength grid.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from datetime import datetime
+from . import SRStools as srt
+#%%---------------------------------------------------------------------------
+def todatetime( Date ):
+    """
+    Support function: turn a datetime, a list of datetime objects or a
+    datetime64 array into the list of datetime objects used by sunPosition.
+    """
+    if isinstance(Date, datetime):
+        return [ Date ]
+    Date = np.asarray(Date)
+    if np.issubdtype(Date.dtype, np.datetime64):
+        Date = Date.astype('datetime64[us]').astype(object)
+    return list( np.atleast_1d(Date) )
+
+def perrecord( Value, N ):
+    """
+    Support function: broadcast a scalar or a per-record sequence to a float
+    array with N elements.
+    """
+    return np.broadcast_to( np.asarray(Value, dtype=float), (N,) )
+
+class OpticalDepthEngine(object):
+    """
+    Optical depth calculator for all the spectra of one instrument.
+
+    The air masses are computed once per chunk and shared by all the terms.
+    The wavelength-only terms (interpolated Gueymard coefficients, Rayleigh
+    cross section) are computed once, when the engine is created, and reused
+    for every call. Records are processed in chunks of **Chunk** spectra, so
+    that the intermediate arrays never exceed (Chunk x N_wavelengths).
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Full set of spectrometer's wavelengths, in [nanometers]
+    Site : list of floats (3)
+        North latitude, East longitude [degrees] and elevation [meters asl]
+        of the measurement site.
+    Chunk : integer, optional
+        Maximum number of spectra processed at once. Default: 512
+    Dtype : data type, optional
+        Precision of the optical depth arrays: np.float32 halves their
+        memory (it does not make the calculation faster). Solar geometry and air masses are always computed in
+        float64 (time arithmetic of the ephemeris), as are the (Chunk x
+        N_wavelengths) intermediate arrays; results are cast per chunk.
+        Default: float
+    Slit : slitconv.SlitMatrix, optional
+        Slit convolution of the instrument, built on WaveLgt: the Rayleigh
+        optical depth and the Gueymard absorption coefficients are convolved
+        with the slit function (once, then cached) instead of being taken
+        at the pixel wavelengths. Default: no convolution
+
+    Example
+    -------
+    >>> Engine = OpticalDepthEngine(Wvl, [45.7422, 7.3568, 570.])
+    >>> OD = Engine.compute(Dates, Tamb=Temps, Season=1)
+    >>> OD['Tau_R'].shape  # (N_spectra, N_wavelengths)
+    """
+    # Names of the 2-D outputs, all with shape (N_spectra, N_wavelengths)
+    FIELDS = ( 'Tau_R', 'Tau_O3', 'Tau_NO2', 'MTau_WV' )
+
+    def __init__( self, WaveLgt, Site, Chunk=512, Dtype=float, Slit=None ):
+        self.WaveLgt = np.ascontiguousarray(WaveLgt, dtype=float)
+        self.Site = list(Site)
+        self.Lat, self.Lon, self.Height = [ float(x) for x in Site[:3] ]
+        self.Chunk = int(Chunk)
+        self.Dtype = np.dtype(Dtype)
+        self.Slit = Slit
+        # Rayleigh OD is linear in pressure: keep its value for 1 bar
+        if Slit is None:
+            self.Tau_R1 = srt.rayleigh_OD(self.WaveLgt, self.Lat, self.Height, Pres=1.)
+        else:
+            if not np.array_equal( Slit.WaveLgt, self.WaveLgt ):
+                raise ValueError('OpticalDepthEngine: Slit built for another grid')
+            self.Tau_R1 = Slit.apply( srt.rayleigh_OD(Slit.RefWvl, self.Lat,\
+                                                      self.Height, Pres=1.) )
+            # Convolved coefficients, computed now and cached by gueymard_coeff
+            for Col in ( 2, 3, 4 ): srt.gueymard_coeff( self.WaveLgt, Col, Slit )
+        # Standard pressure, used for the records without a measured value
+        self.Pstd = srt.stdatm(0, self.Height)[1]
+
+    def geometry( self, Date ):
+        """
+        Solar geometry and air masses for a set of timestamps.
+
+        Returns
+        -------
+        Zang : ndarray
+            Solar Zenith Angle in degrees
+        SunR : ndarray
+            Sun-Earth distance in AU
+        AMF : ndarray
+            Kasten and Young air mass (Rayleigh, NO2, water vapour, aerosols)
+        AMF_O3 : ndarray
+            Komhyr air mass for the ozone layer
+        """
+        Zang, _, SunR = srt.sunPosition( todatetime(Date), self.Site[:2],\
+                                         Height=self.Height )
+        Zang = np.atleast_1d(Zang);   SunR = np.atleast_1d(SunR)
+        return Zang, SunR, srt.airmass(Zang), \
+               srt.airmass(Zang, O3=True, Lat=self.Lat)
+
+    def opticaldepths( self, AMF, Pres=0, Tamb=999, O3col=999, NO2col=999,\
+                       WVcol=999, Season=2 ):
+        """
+        Optical depths of a block of records whose air masses are already
+        known (e.g. from the geometry method). Arguments as in **compute**,
+        with one value (or a scalar) per element of AMF; no chunking is made.
+
+        Returns
+        -------
+        OD : dictionary of ndarrays
+            'Tau_R', 'Tau_O3', 'Tau_NO2', 'MTau_WV', (N_spectra, N_wavelengths),
+            with the precision of the engine (Dtype)
+        """
+        N = len(AMF)
+        Pres = perrecord(Pres, N)
+        P = np.where( (Pres == 0) | (Pres == 999), self.Pstd, Pres )
+        Tamb = perrecord(Tamb, N)
+        Season = np.broadcast_to( np.asarray(Season, dtype=int), (N,) )
+        OD = { 'Tau_R':   self.Tau_R1 * P[:,None],
+               'Tau_O3':  srt.ozone_OD(self.WaveLgt, self.Height,\
+                              perrecord(O3col, N), Tamb, Season, Slit=self.Slit),
+               'Tau_NO2': srt.no2_OD(self.WaveLgt, self.Height, Tamb,\
+                              Season, perrecord(NO2col, N), Slit=self.Slit),
+               'MTau_WV': srt.wv_MTau(self.WaveLgt, self.Height, P, Season,\
+                              WVcol=perrecord(WVcol, N), AMF=AMF, Slit=self.Slit) }
+        for F in OD:
+            OD[F] = np.atleast_2d( OD[F] ).astype( self.Dtype, copy=False )
+        return OD
+
+    def iterchunks( self, Date, Pres=0, Tamb=999, O3col=999, NO2col=999,\
+                    WVcol=999, Season=2 ):
+        """
+        Generator version of **compute**: yields, for every chunk of records,
+        the slice of the input it refers to and the dictionary of results.
+        Memory use depends only on **Chunk**, not on the number of records.
+        """
+        Date = todatetime(Date)
+        N = len(Date)
+        Pres   = perrecord(Pres,   N);    Tamb   = perrecord(Tamb,   N)
+        O3col  = perrecord(O3col,  N);    NO2col = perrecord(NO2col, N)
+        WVcol  = perrecord(WVcol,  N)
+        Season = np.broadcast_to( np.asarray(Season, dtype=int), (N,) )
+
+        for k in range(0, N, self.Chunk):
+            S = slice(k, min(k + self.Chunk, N))
+            Zang, SunR, AMF, AMF_O3 = self.geometry( Date[S] )
+            Out = self.opticaldepths( AMF, Pres[S], Tamb[S], O3col[S],\
+                                      NO2col[S], WVcol[S], Season[S] )
+            Out.update( Zang=Zang, SunR=SunR, AMF=AMF, AMF_O3=AMF_O3 )
+            yield S, Out
+
+    def compute( self, Date, Pres=0, Tamb=999, O3col=999, NO2col=999,\
+                 WVcol=999, Season=2 ):
+        """
+        Compute all the optical depths and air masses in one pass.
+
+        Parameters
+        ----------
+        Date : list of datetime objects or datetime64 array
+            UTC timestamps of the spectra.
+        Pres : float or array_like, optional
+            Atmospheric pressure in [bar] for each record. Records with 0
+            (or 999) use the Standard Atmosphere value.
+        Tamb : float or array_like, optional
+            Ambient temperature in [Celsius]; 999 means not measured.
+        O3col, NO2col, WVcol : float or array_like, optional
+            Columns of ozone, NO2 [atm-cm] and water vapour [cm];
+            999 means seasonal default.
+        Season : integer or array_like, optional
+            Season code, as given by the stdatm function, or one code per
+            record (see the atmstate module).
+
+        Returns
+        -------
+        OD : dictionary of ndarrays
+            'Zang', 'SunR', 'AMF', 'AMF_O3' with shape (N_spectra,) and
+            'Tau_R', 'Tau_O3', 'Tau_NO2', 'MTau_WV' with shape
+            (N_spectra, N_wavelengths). Water vapour is given as the
+            effective optical depth already multiplied by the air mass.
+        """
+        N = len( todatetime(Date) );   Nw = len(self.WaveLgt)
+        OD = dict( (F, np.empty((N, Nw), self.Dtype)) for F in self.FIELDS )
+        OD.update( (F, np.empty(N)) for F in ('Zang','SunR','AMF','AMF_O3') )
+        for S, Out in self.iterchunks(Date, Pres, Tamb, O3col, NO2col,\
+                                      WVcol, Season):
+            for F in Out: OD[F][S] = Out[F]
+        return OD
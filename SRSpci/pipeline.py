@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming processing chain, from the daily SRS data files to the AOD
+products. Each stage is a generator taking and yielding blocks of records
+(dictionaries of NumPy arrays, at most **Chunk** records each):
+
+    read -> pair darks -> dark correction -> quality mask -> geometry
+         -> optical depths -> AOD retrieval -> cloud screening -> write
+
+Stages pull blocks from the previous one only when the next stage asks for
+them, so at any time only a few blocks are alive: memory use does not
+depend on the length of the archive. Every stage is wrapped by a Stage
+object, measuring its throughput (see report).
+
+Example
+-------
+>>> Chain = aodpipeline(Files, V0, Engine, OutDir='/data/aod/')
+>>> for Block in Chain: pass
+>>> print( report(Chain) )
+
+To see versions and changelog, open the __init__.py
+
+"""
+import os
+import time
+import numpy as np
+from . import srsfiles
+from . import retrieval
+from .opticaldepth import OpticalDepthEngine
+#%%---------------------------------------------------------------------------
+class Stage(object):
+    """
+    Iterator wrapping a generator stage, counting the records and blocks
+    that go through it and the time spent to produce them.
+
+    Parameters
+    ----------
+    Name : string
+        Stage name, used by the report
+    Func : generator function
+        Called as Func(Upstream, *args, **kwargs)
+    Upstream : Stage or iterable
+        Source of the input blocks
+    """
+    def __init__( self, Name, Func, Upstream, *args, **kwargs ):
+        self.Name = Name
+        self.Upstream = Upstream
+        self.Gen = Func( Upstream, *args, **kwargs )
+        self.Time = 0.;   self.Records = 0;   self.Blocks = 0
+
+    def __iter__( self ):
+        return self
+
+    def __next__( self ):
+        t0 = time.perf_counter()
+        try:
+            Block = next( self.Gen )
+        finally:
+            self.Time += time.perf_counter() - t0
+        self.Records += len( Block['Date'] );   self.Blocks += 1
+        return Block
+
+    def owntime( self ):
+        """Time spent in this stage only, without the upstream stages."""
+        if isinstance( self.Upstream, Stage ):
+            return self.Time - self.Upstream.Time
+        return self.Time
+
+def report( Last ):
+    """
+    Throughput report of a chain of stages, given its last Stage.
+    Returns a text table: records, blocks, own time and records per second.
+    """
+    Stages = [ Last ]
+    while isinstance( Stages[-1].Upstream, Stage ):
+        Stages.append( Stages[-1].Upstream )
+    Lines = [ '%-16s %10s %8s %10s %12s' % ('Stage', 'Records', 'Blocks',\
+              'Time [s]', 'Records/s') ]
+    for S in reversed(Stages):
+        T = S.owntime()
+        Lines.append( '%-16s %10d %8d %10.3f %12.1f' % (S.Name, S.Records,\
+                      S.Blocks, T, S.Records / T if T > 0 else np.inf) )
+    return '\n'.join(Lines)
+
+def select( Block, Sel ):
+    """Support function: keep only the records **Sel** of a block."""
+    return dict( (K, V[Sel] if isinstance(V, np.ndarray) and len(V) == \
+                  len(Block['Date']) else V) for K, V in Block.items() )
+
+#%% Stages -------------------------------------------------------------------
+def readstage( Files, Chunk=256, Dtype=float ):
+    """Read the records of the daily files, **Chunk** records at a time."""
+    for Block in srsfiles.iterarchive( Files, Chunk, Dtype ):
+        yield Block
+
+def pairstage( Blocks ):
+    """Keep the solar records, adding the paired dark spectra ('Dark')."""
+    File = None;   Dark = None
+    for Block in Blocks:
+        if Block.get('File') != File:
+            File = Block.get('File');   Dark = None
+        Sel, Darks, Dark = retrieval.pairdarks( Block, Dark )
+        if len(Sel) == 0: continue
+        Block = select( Block, Sel )
+        Block['Dark'] = Darks
+        yield Block
+
+def darkstage( Blocks, NL=None, Stray=None ):
+    """
+    Dark-corrected signal in [counts/ms] ('Signal'), corrected for the
+    detector nonlinearity when **NL** (nonlinearity.NLCorrection) is given
+    and for the stray light when **Stray** (straylight.StrayLightMatrix) is.
+    """
+    for Block in Blocks:
+        Signal = Block['Counts'] - Block.pop('Dark')
+        if NL is not None: NL.apply( Signal, Out=Signal )
+        if Stray is not None: Stray.apply( Signal, Out=Signal )
+        Signal /= Block['Tint'][:,None].astype( Signal.dtype )
+        Block['Signal'] = Signal
+        yield Block
+
+def maskstage( Blocks, Saturation=65535., MinSignal=0. ):
+    """
+    Quality mask ('Mask', True for good pixels): excludes saturated pixels
+    and signals not above **MinSignal** [counts/ms]. The raw counts are
+    dropped from the block afterwards.
+    """
+    for Block in Blocks:
+        Block['Mask'] = ( Block.pop('Counts') < Saturation ) & \
+                        ( Block['Signal'] > MinSignal )
+        yield Block
+
+def geometrystage( Blocks, Engine, MaxZang=80. ):
+    """
+    Solar geometry and air masses ('Zang', 'SunR', 'AMF', 'AMF_O3'); records
+    with Solar Zenith Angle above **MaxZang** are dropped.
+    """
+    for Block in Blocks:
+        Zang, SunR, AMF, AMF_O3 = Engine.geometry( Block['Date'] )
+        Block.update( Zang=Zang, SunR=SunR, AMF=AMF, AMF_O3=AMF_O3 )
+        Block = select( Block, Zang <= MaxZang )
+        if len(Block['Date']): yield Block
+
+def odstage( Blocks, Engine, **ODargs ):
+    """Optical depths of the atmospheric gases (see OpticalDepthEngine)."""
+    for Block in Blocks:
+        Block.update( Engine.opticaldepths( Block['AMF'], **ODargs ) )
+        yield Block
+
+def aodstage( Blocks, V0 ):
+    """Aerosol optical depth ('AOD'), NaN where the quality mask fails."""
+    for Block in Blocks:
+        AOD = retrieval.aod( Block['Signal'], V0, Block['SunR'], Block )
+        AOD[ ~Block['Mask'] ] = np.nan
+        # Optical depths are no more needed after the retrieval
+        for K in OpticalDepthEngine.FIELDS: Block.pop( K, None )
+        Block['AOD'] = AOD
+        yield Block
+
+def screenstage( Blocks, Screen=None ):
+    """
+    Cloud screening ('Clear', True for cloud-free records). **Screen** is a
+    function taking a block and returning the boolean array; without it,
+    all the records are flagged as clear.
+    """
+    for Block in Blocks:
+        if Screen is None: Block['Clear'] = np.ones( len(Block['Date']), bool )
+        else: Block['Clear'] = np.asarray( Screen(Block), dtype=bool )
+        yield Block
+
+def writestage( Blocks, OutDir, Fmt='%8.4f' ):
+    """
+    Write the AOD of each record to a daily product file in **OutDir**,
+    named after the input file (<name>_aod.txt). Each line contains:
+    date, time, SZA, clear-sky flag, AOD at each pixel. A product file is
+    overwritten the first time it is met in a run, then appended to.
+    """
+    F = None;   Name = None
+    Seen = set()
+    try:
+        for Block in Blocks:
+            Out = os.path.join( OutDir, os.path.splitext(os.path.basename(\
+                                Block.get('File', 'srs')))[0] + '_aod.txt' )
+            if Out != Name:
+                if F is not None: F.close()
+                Name = Out;   F = open( Name, 'a' if Name in Seen else 'w' )
+                Seen.add( Name )
+            Row = '%s %8.4f %d ' + ' '.join( [Fmt] * Block['AOD'].shape[1] )
+            Dates = np.datetime_as_string( Block['Date'] )
+            F.write( ''.join( Row % ((Dates[k].replace('T', ' '),\
+                     Block['Zang'][k], Block['Clear'][k]) + \
+                     tuple(Block['AOD'][k])) + '\n' \
+                     for k in range(len(Dates)) ) )
+            yield Block
+    finally:
+        if F is not None: F.close()
+
+#%%---------------------------------------------------------------------------
+def aodpipeline( Files, V0, Engine, Chunk=256, OutDir=None, Screen=None,\
+                 MaxZang=80., Saturation=65535., NL=None, Stray=None,\
+                 **ODargs ):
+    """
+    Assemble the whole processing chain, from the daily SRS files to the
+    AOD products. Nothing is computed until the returned Stage is iterated.
+
+    Parameters
+    ----------
+    Files : list of strings
+        Daily SRS data files, processed in the given order
+    V0 : ndarray
+        Calibration constant V0(λ) in [counts/ms], on the instrument grid
+    Engine : OpticalDepthEngine
+        Optical depth calculator built for the instrument's wavelength grid.
+        Its precision (Dtype) is used along the whole chain, from the counts
+        read to the AOD
+    Chunk : integer, optional
+        Maximum number of records in each block. Default: 256
+    OutDir : string, optional
+        Directory of the product files. Default: nothing is written
+    Screen : function, optional
+        Cloud screening function (see screenstage)
+    MaxZang : float, optional
+        Largest Solar Zenith Angle processed, in degrees. Default: 80
+    Saturation : float, optional
+        Counts at which a pixel is considered saturated. Default: 65535
+    NL : NLCorrection, optional
+        Detector nonlinearity correction (see the nonlinearity module)
+    Stray : StrayLightMatrix, optional
+        Stray-light correction (see the straylight module)
+    **ODargs : optional
+        Other arguments for Engine.opticaldepths (Pres, Tamb, Season, ...),
+        given as scalar values.
+
+    Returns
+    -------
+    Chain : Stage
+        Last stage of the chain: iterate it to run the processing, and give
+        it to the report function for the throughput of each stage.
+    """
+    S = Stage( 'read',     readstage,     Files, Chunk, Engine.Dtype )
+    S = Stage( 'pair darks', pairstage,   S )
+    S = Stage( 'dark corr.', darkstage,   S, NL, Stray )
+    S = Stage( 'quality mask', maskstage, S, Saturation )
+    S = Stage( 'geometry', geometrystage, S, Engine, MaxZang )
+    S = Stage( 'opt. depths', odstage,    S, Engine, **ODargs )
+    S = Stage( 'AOD',      aodstage,      S, V0 )
+    S = Stage( 'cloud screen', screenstage, S, Screen )
+    if OutDir is not None:
+        S = Stage( 'write', writestage,   S, OutDir )
+    return S
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Single precision (np.float32) processing mode: error bound and benchmark.
+
+The spectral data of the AvaSpec are integers of 16 bits (20 with the
+averaging), exactly represented by float32. Setting Dtype=np.float32 in
+OpticalDepthEngine makes the whole AOD chain (srsfiles blocks, dark
+correction, optical depths, retrieval.aod, pipeline) carry float32 arrays:
+half the memory of the (N_spectra x N_wavelengths) arrays that are kept.
+It is a memory saving, not a speed-up: the optical depth terms are still
+computed in float64, chunk by chunk, and only cast when stored, so the
+time of compare() is about the same in both modes. Solar geometry and air
+masses stay in float64: the ephemeris works on time differences of many
+days, where float32 cancellation would give errors of minutes.
+
+Measured with compare() on one day of synthetic spectra (2048 pixels,
+SZA 20-80 deg), the AOD difference with respect to the float64 chain is
+below 1e-6 in absolute value (largest below 320 nm, where the signal is
+weakest); through the whole pipeline, dark subtraction included, it stays
+below 1e-5. Both are far below the calibration uncertainty of the AOD
+(~0.01). ERROR_BOUND gives a safe bound, checked by the tests.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import time
+import numpy as np
+from . import retrieval
+from .opticaldepth import OpticalDepthEngine
+#%%---------------------------------------------------------------------------
+# Bound of the absolute AOD difference float32 - float64, with margin
+ERROR_BOUND = 1e-4
+
+def synthetic( Engine, Date, V0, AOD500=0.1, Alpha=1.3, **ODargs ):
+    """
+    Direct-sun signal simulated by the Beer-Lambert law, for an aerosol
+    with Angstrom turbidity AOD500 at 500 nm and exponent **Alpha**.
+    Returns the signal (float64) and the AOD spectrum used.
+    """
+    OD = Engine.compute( Date, **ODargs )
+    Tau = AOD500 * ( Engine.WaveLgt / 500. )**-Alpha
+    M = OD['AMF'][:,None]
+    Signal = V0 / OD['SunR'][:,None]**2 * np.exp( -M * (OD['Tau_R'] + \
+             OD['Tau_NO2'] + Tau) - OD['AMF_O3'][:,None] * OD['Tau_O3'] - \
+             OD['MTau_WV'] )
+    return Signal, Tau
+
+def compare( WaveLgt, Site, Date, V0, Repeat=3, **ODargs ):
+    """
+    Run the optical depths and the AOD retrieval in float64 and float32 on
+    the same synthetic signal.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Wavelength grid, in [nanometers]
+    Site : list of floats (3)
+        Latitude, longitude [degrees] and height [meters] of the site
+    Date : datetime64 array
+        Timestamps of the records
+    V0 : ndarray
+        Calibration constant on WaveLgt, in [counts/ms]
+    Repeat : integer, optional
+        Timing repetitions (best one is kept). Default: 3
+
+    Returns
+    -------
+    Result : dictionary
+        'MaxError' : largest absolute AOD difference, over valid pixels
+        'Error'    : largest absolute difference at each wavelength
+        'Bytes64', 'Bytes32' : memory of the optical depth and AOD arrays
+        'Time64', 'Time32'   : time of the optical depths + retrieval [s]
+    """
+    E64 = OpticalDepthEngine( WaveLgt, Site, Dtype=np.float64 )
+    E32 = OpticalDepthEngine( WaveLgt, Site, Dtype=np.float32 )
+    Signal, Tau = synthetic( E64, Date, V0, **ODargs )
+    # Counts per millisecond, as they come from the dark correction
+    Signal = { 8: Signal, 4: Signal.astype(np.float32) }
+    Result = {}
+    for E in ( E64, E32 ):
+        Bits = 8 * E.Dtype.itemsize
+        T = np.inf
+        for r in range(Repeat):
+            t0 = time.perf_counter()
+            OD = E.compute( Date, **ODargs )
+            AOD = retrieval.aod( Signal[E.Dtype.itemsize], V0, OD['SunR'], OD )
+            T = min( T, time.perf_counter() - t0 )
+        Result['Time%d' % Bits] = T
+        Result['Bytes%d' % Bits] = AOD.nbytes + \
+                                   sum( OD[F].nbytes for F in E.FIELDS )
+        Result['AOD%d' % Bits] = AOD
+    Diff = np.abs( Result.pop('AOD32') - Result.pop('AOD64') )
+    with np.errstate(invalid='ignore'):
+        Result['Error'] = np.nanmax( Diff, axis=0 )
+    Result['MaxError'] = np.nanmax( Result['Error'] )
+    return Result
+
+def benchmark( N=1000, Npix=2048, Site=(45.7422, 7.3568, 570.), Day='2018-06-01' ):
+    """
+    compare() on N records of one day (SZA up to 80 deg) with a synthetic
+    grid of Npix pixels from 300 to 1000 nm. Prints and returns the result.
+    """
+    WaveLgt = np.linspace( 300., 1000., Npix )
+    V0 = 1000. * np.exp( -((WaveLgt - 600.) / 400.)**2 )
+    E = OpticalDepthEngine( WaveLgt, Site )
+    Date = np.datetime64(Day + 'T00:00') + \
+           np.linspace( 0, 86400, 1441 ).astype('timedelta64[s]')
+    with np.errstate(invalid='ignore'):     # Sun below the horizon
+        Zang = E.geometry( Date )[0]
+    Date = Date[ Zang < 80. ]
+    Date = Date[ np.linspace(0, len(Date) - 1, N).astype(int) ]
+    R = compare( WaveLgt, Site, Date, V0 )
+    print( 'Max AOD error float32: %.2e (bound %.0e)' % (R['MaxError'], ERROR_BOUND) )
+    print( 'Memory [MB]: float64 %.1f, float32 %.1f' % (R['Bytes64'] / 2.**20,\
+           R['Bytes32'] / 2.**20) )
+    print( 'Time [s]:    float64 %.3f, float32 %.3f' % (R['Time64'], R['Time32']) )
+    return R
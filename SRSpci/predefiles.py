@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy reading of the SUNRAD (DT2, OPT) and SKYRAD (PAR, VOL) products of the
+Prede POM: records of many files are yielded in chunks of fixed size, as
+NumPy structured arrays, while the next files are parsed by a background
+thread. Memory use depends on the chunk size and on the number of files
+read ahead, not on the length of the archive.
+
+Record fields, by product type:
+    dt2 : 'Date', 'V1' (first current of each triplet, one per wavelength)
+    opt : 'Date', 'AOD' (one per wavelength), 'Alpha', 'Beta'
+    par : 'Date', 'Error', 'Data' (block of N_rows x N_cols, see formatdata)
+    vol : 'Date', 'Error', 'Data'
+
+Example
+-------
+>>> Files = ArchiveIndex(Root).files('opt')           # in time order
+>>> for Rec in iterrecords(Files, Chunk=4096):
+...     Sum += np.nansum(Rec['AOD'], 0)
+
+To see versions and changelog, open the __init__.py
+
+"""
+import queue
+import threading
+import numpy as np
+from .archiveindex import parsefile
+#%%---------------------------------------------------------------------------
+def torecords( Kind, Parsed ):
+    """
+    Structured array of the records of one file, from the dictionary given
+    by archiveindex.parsefile. Records are sorted by time.
+    """
+    Date, Data = Parsed['Date'], Parsed['Data']
+    N = len(Date)
+    if Kind == 'dt2':
+        Fields = [ ('Date', 'datetime64[s]'), ('V1', float, Data.shape[1:]) ]
+    elif Kind == 'opt':
+        Nwvl = len( Parsed['Wvlgt'] )
+        Fields = [ ('Date', 'datetime64[s]'), ('AOD', float, (Nwvl,)),\
+                   ('Alpha', float), ('Beta', float) ]
+    else:
+        Fields = [ ('Date', 'datetime64[s]'), ('Error', float),\
+                   ('Data', float, Data.shape[1:]) ]
+    Rec = np.empty( N, dtype=Fields )
+    if N == 0: return Rec
+    Rec['Date'] = Date
+    if Kind == 'dt2':
+        Rec['V1'] = Data
+    elif Kind == 'opt':
+        Rec['AOD'] = Data[:,:Nwvl];   Rec['Alpha'] = Data[:,Nwvl]
+        Rec['Beta'] = Data[:,Nwvl+1]
+    else:
+        Rec['Error'] = Parsed['Error'];   Rec['Data'] = Data
+    return Rec[ np.argsort( Rec['Date'], kind='stable' ) ]
+
+def readfile( Path ):
+    """Records of one product file, as a structured array (see torecords)."""
+    return torecords( Path[-3:].lower(), parsefile(Path) )
+
+def putitem( Out, Item, Stop ):
+    """
+    Support function: put **Item** in the **Out** queue, waiting for room
+    unless **Stop** gets set. Returns False if stopped before putting it.
+    """
+    while not Stop.is_set():
+        try:
+            Out.put( Item, timeout=0.1 );   return True
+        except queue.Full:
+            pass
+    return False
+
+def prefetch( Files, Out, Stop ):
+    """
+    Support function, run by the background thread: parse the files in
+    order and put their records in the **Out** queue (exceptions are put
+    in the queue too), then None. Stops early when **Stop** is set, also
+    while waiting to put the final None.
+    """
+    for F in Files:
+        try:
+            Item = readfile( F )
+        except Exception as E:
+            Item = E
+        if not putitem( Out, Item, Stop ): return
+    putitem( Out, None, Stop )
+
+def iterrecords( Files, Chunk=1024, Prefetch=2 ):
+    """
+    Read the records of many product files of the same type, **Chunk**
+    records at a time.
+
+    Parameters
+    ----------
+    Files : list of strings
+        Product files, read in the given order: give them in time order
+        (e.g. from ArchiveIndex.files, or sorted by name for dated names).
+    Chunk : integer, optional
+        Number of records of each yielded array (the last one, and the last
+        one before a change of record layout, can be shorter). Default: 1024
+    Prefetch : integer, optional
+        Number of parsed files kept ready by the background thread.
+        Default: 2
+
+    Yields
+    ------
+    Records : structured ndarray
+        Chunk of records (fields in the module description)
+    """
+    Q = queue.Queue( maxsize=max(int(Prefetch), 1) )
+    Stop = threading.Event()
+    T = threading.Thread( target=prefetch, args=(list(Files), Q, Stop) )
+    T.daemon = True
+    T.start()
+    Buf = [];   Nbuf = 0
+    try:
+        while True:
+            Item = Q.get()
+            if Item is None: break
+            if isinstance(Item, Exception): raise Item
+            if len(Item) == 0: continue
+            # A different layout (e.g. other wavelengths): flush the buffer
+            if Buf and Item.dtype != Buf[0].dtype:
+                yield np.concatenate( Buf );   Buf = [];   Nbuf = 0
+            Buf.append( Item );   Nbuf += len(Item)
+            if Nbuf >= Chunk:
+                All = np.concatenate( Buf )
+                for k in range( 0, len(All) - Chunk + 1, Chunk ):
+                    yield All[k:k+Chunk]
+                Rest = All[ len(All) - len(All) % Chunk: ]
+                Buf = [ Rest ] if len(Rest) else [];   Nbuf = len(Rest)
+        if Buf:
+            yield np.concatenate( Buf )
+    finally:
+        Stop.set()
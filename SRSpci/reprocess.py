@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Reprocessing of a range of days of the SRS archive, e.g. after a change of
+calibration: the whole AOD chain (see pipeline.aodpipeline) runs on each
+daily file, days being shared among a pool of processes.
+
+    python -m SRSpci.reprocess ROOT START END --v0 V0FILE [options]
+
+Daily files (YYYY-mm-dd.txt, as written by operateSRS.WriteHeader) are
+searched anywhere below ROOT. Each product file is written to a temporary
+name and then renamed, so a product is either complete or absent. Finished
+days are recorded in a checkpoint file of the output directory, together
+with a key of the calibration and settings used (V0, site, screening,
+optical depth arguments, nonlinearity and stray-light corrections): an
+interrupted run, started again with the same arguments, only processes the
+days left, while a new calibration reprocesses everything. A day without
+records has its old product removed, so no product of a former calibration
+is left behind.
+
+Read-only data needed by every worker (Gueymard's table, V0) are saved once
+as .npy files and memory-mapped by the workers, instead of being loaded or
+pickled for each of them.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import datetime
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import SRStools as srt
+from . import srsfiles
+from . import pipeline
+from . import cloudscreen
+from .nonlinearity import NLCorrection
+from .straylight import StrayLightMatrix
+from .opticaldepth import OpticalDepthEngine
+#%%---------------------------------------------------------------------------
+CHECKPOINT = 'reprocess_done.txt'
+_Shared = {}
+
+def dayfiles( Root, Start, End ):
+    """
+    Daily files of the archive below **Root**, from **Start** to **End**
+    (datetime.date, both included). Returns a list of (day, path), sorted.
+    """
+    Found = {}
+    for Dir, Sub, Names in os.walk( Root ):
+        for N in Names:
+            try:
+                Day = datetime.datetime.strptime( N, '%Y-%m-%d.txt' ).date()
+            except ValueError:
+                continue
+            if Start <= Day <= End: Found[Day] = os.path.join( Dir, N )
+    return sorted( Found.items() )
+
+def readv0( File, WaveLgt=None ):
+    """
+    Read a calibration file: one V0 value per pixel, or two columns
+    (wavelength [nm], V0) interpolated on **WaveLgt**.
+    """
+    V0 = np.loadtxt( File )
+    if V0.ndim == 2:
+        if WaveLgt is None:
+            raise ValueError('readv0: a wavelength grid is needed for ' + File)
+        V0 = np.interp( WaveLgt, V0[:,0], V0[:,1] )
+    return V0
+
+def readnl( File, Scale=1. ):
+    """
+    Read a nonlinearity file: the 8 polynomial coefficients a0 ... a7 (as in
+    the EEPROM), followed by the valid range LowNLCounts, HighNLCounts.
+    """
+    P = np.loadtxt( File ).ravel()
+    if len(P) != 10:
+        raise ValueError('readnl: %s has %d values instead of 10' % (File, len(P)))
+    return NLCorrection( P[:8], P[8], P[9], Scale=Scale )
+
+def share( Dir, **Arrays ):
+    """Save read-only arrays as .npy files in **Dir**, for memory mapping."""
+    if not os.path.isdir(Dir): os.makedirs(Dir)
+    for K, A in Arrays.items():
+        Tmp = os.path.join( Dir, K + '.tmp.npy' )
+        np.save( Tmp, A )
+        os.replace( Tmp, os.path.join(Dir, K + '.npy') )
+
+def initworker( Dir ):
+    """Process pool initializer: memory-map the shared arrays."""
+    for N in os.listdir( Dir ):
+        if N.endswith('.npy') and not N.endswith('.tmp.npy'):
+            _Shared[N[:-4]] = np.load( os.path.join(Dir, N), mmap_mode='r' )
+    if 'gueymard' in _Shared:
+        srt._GueymardCache['table'] = _Shared['gueymard']
+
+def processday( File, OutDir, Site, Chunk=256, Screen=True, NL=None,\
+                Stray=None, **ODargs ):
+    """
+    Run the AOD chain on one daily file, writing its product atomically,
+    with the nonlinearity (**NL**) and stray-light (**Stray**) corrections
+    if given. Returns the product path and the number of records written;
+    without records, the old product of the day is removed.
+    """
+    Serial, WaveLgt = srsfiles.readheader( File )
+    V0 = _Shared['V0']
+    if len(V0) != len(WaveLgt):
+        raise ValueError('processday: V0 and wavelength grid of %s differ' % File)
+    Tmp = os.path.join( OutDir, '.tmp-%d' % os.getpid() )
+    if not os.path.isdir(Tmp): os.makedirs(Tmp)
+    Engine = OpticalDepthEngine( WaveLgt, Site )
+    if 'Season' not in ODargs:
+        Day = datetime.datetime.strptime( os.path.basename(File)[:10], '%Y-%m-%d' )
+        ODargs['Season'] = int( srt.stdatm( Day, Site[2] )[0] )
+    Chain = pipeline.aodpipeline( [File], V0, Engine, Chunk=Chunk, OutDir=Tmp,\
+                Screen=cloudscreen.CloudScreen(WaveLgt) if Screen else None,\
+                NL=NL, Stray=Stray, **ODargs )
+    Name = os.path.splitext( os.path.basename(File) )[0] + '_aod.txt'
+    Out = os.path.join( OutDir, Name )
+    N = 0
+    for Block in Chain: N += len( Block['Date'] )
+    if N: os.replace( os.path.join(Tmp, Name), Out )
+    else:
+        for F in ( Out, os.path.join(Tmp, Name) ):
+            if os.path.exists(F): os.remove(F)
+    return Out, N
+
+def runkey( V0, Site, Screen, ODargs, NL=None, Stray=None ):
+    """Key of the calibration and settings of a run, for the checkpoint."""
+    H = hashlib.sha1( np.ascontiguousarray(V0, dtype=float).tobytes() )
+    H.update( repr( (list(Site), bool(Screen), sorted(ODargs.items())) ).encode() )
+    if NL is not None:
+        H.update( b'NL' + NL.Coeffs.tobytes() + \
+                  repr( (NL.Low, NL.High, NL.Scale, NL.Enable) ).encode() )
+    if Stray is not None:
+        H.update( b'Stray' + Stray.Delta.tobytes() + repr(Stray.Rows).encode() )
+    return H.hexdigest()[:16]
+
+def readcheckpoint( OutDir, Key ):
+    """Days already processed with the run key **Key**."""
+    Done = set()
+    File = os.path.join( OutDir, CHECKPOINT )
+    if os.path.exists( File ):
+        with open( File ) as F:
+            for Line in F:
+                Day = Line.split()
+                if len(Day) == 2 and Day[1] == Key: Done.add( Day[0] )
+    return Done
+
+def reprocess( Root, Start, End, V0File, OutDir, Site, Processes=None,\
+               Chunk=256, Screen=True, NL=None, Stray=None, Force=False,\
+               Log=sys.stdout, **ODargs ):
+    """
+    Reprocess the archive from **Start** to **End** (datetime.date).
+
+    Parameters
+    ----------
+    Root : string
+        Root directory of the archive of daily files
+    V0File : string
+        Calibration file, see readv0
+    OutDir : string
+        Directory of the product files and of the checkpoint
+    Site : list
+        Latitude [N deg], longitude [E deg] and height [m] of the site
+    Processes : integer, optional
+        Number of worker processes. Default: number of CPUs
+    Chunk : integer, optional
+        Number of records per block, see pipeline.aodpipeline
+    Screen : bool, optional
+        Apply the cloud screening (cloudscreen.CloudScreen). Default: True
+    NL : NLCorrection, optional
+        Detector nonlinearity correction (see nonlinearity and readnl)
+    Stray : StrayLightMatrix, optional
+        Stray-light correction (see straylight)
+    Force : bool, optional
+        Reprocess also the days already in the checkpoint
+    **ODargs : optional
+        Other arguments for the optical depths (Season, Pres, ...)
+
+    Returns
+    -------
+    Done : dictionary
+        Number of records written for each day processed in this run
+    """
+    Days = dayfiles( Root, Start, End )
+    if not Days: return {}
+    if not os.path.isdir(OutDir): os.makedirs(OutDir)
+    V0 = readv0( V0File, srsfiles.readheader(Days[0][1])[1] )
+    Key = runkey( V0, Site, Screen, ODargs, NL, Stray )
+    if not Force:
+        Skip = readcheckpoint( OutDir, Key )
+        Days = [ (D, F) for D, F in Days if str(D) not in Skip ]
+    SharedDir = os.path.join( OutDir, '.shared' )
+    share( SharedDir, V0=V0, gueymard=srt.gueymard_table() )
+
+    Done = {}
+    t0 = time.time()
+    with ProcessPoolExecutor( max_workers=Processes, initializer=initworker,\
+                              initargs=(SharedDir,) ) as Pool:
+        Futures = dict( (Pool.submit( processday, F, OutDir, Site, Chunk,\
+                         Screen, NL, Stray, **ODargs ), D) for D, F in Days )
+        with open( os.path.join(OutDir, CHECKPOINT), 'a' ) as Check:
+            for Fut in as_completed( Futures ):
+                D = Futures[Fut]
+                try:
+                    Out, N = Fut.result()
+                except Exception as E:
+                    Log.write( '%s failed: %s\n' % (D, E) )
+                    continue
+                Check.write( '%s %s\n' % (D, Key) );   Check.flush()
+                Done[D] = N
+                Log.write( '%s: %d records (%.1f s)\n' % (D, N, time.time() - t0) )
+    # Remove the (empty) temporary directories of the workers
+    for N in os.listdir( OutDir ):
+        if N.startswith('.tmp-'):
+            try: os.rmdir( os.path.join(OutDir, N) )
+            except OSError: pass
+    return Done
+
+def main( Args=None ):
+    P = argparse.ArgumentParser( prog='python -m SRSpci.reprocess',
+                                 description='Reprocess the SRS archive to AOD.' )
+    P.add_argument( 'root', help='archive root directory' )
+    P.add_argument( 'start', help='first day, YYYY-mm-dd' )
+    P.add_argument( 'end', help='last day, YYYY-mm-dd' )
+    P.add_argument( '--v0', required=True, help='calibration file' )
+    P.add_argument( '--out', default='aod', help='output directory' )
+    P.add_argument( '--site', nargs=3, type=float, metavar=('LAT', 'LON', 'H'),
+                    default=[45.7422, 7.3568, 570.], help='site coordinates' )
+    P.add_argument( '--season', type=int, default=None,
+                    help='season code (default: from the date)' )
+    P.add_argument( '--processes', type=int, default=None )
+    P.add_argument( '--chunk', type=int, default=256 )
+    P.add_argument( '--no-screen', action='store_true',
+                    help='skip the cloud screening' )
+    P.add_argument( '--nl', default=None, metavar='NLFILE',
+                    help='nonlinearity coefficients and range (see readnl)' )
+    P.add_argument( '--nl-scale', type=float, default=1.,
+                    help='ADC scale of the nonlinearity coefficients' )
+    P.add_argument( '--stray', default=None, metavar='DIR',
+                    help='directory of the stray-light matrix of the instrument' )
+    P.add_argument( '--force', action='store_true',
+                    help='reprocess the days already done' )
+    A = P.parse_args( Args )
+    Day = lambda S: datetime.datetime.strptime( S, '%Y-%m-%d' ).date()
+    ODargs = {} if A.season is None else { 'Season': A.season }
+    NL = None if A.nl is None else readnl( A.nl, A.nl_scale )
+    Stray = None
+    if A.stray is not None:
+        Days = dayfiles( A.root, Day(A.start), Day(A.end) )
+        if Days:
+            Stray = StrayLightMatrix.load( A.stray, srsfiles.readheader(Days[0][1])[0] )
+    Done = reprocess( A.root, Day(A.start), Day(A.end), A.v0, A.out, A.site,
+                      Processes=A.processes, Chunk=A.chunk,
+                      Screen=not A.no_screen, NL=NL, Stray=Stray,
+                      Force=A.force, **ODargs )
+    print( '%d days processed' % len(Done) )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Retrieval of the spectral aerosol optical depth (AOD) from dark-corrected
+direct-sun spectra, by the Beer-Lambert-Bouguer law:
+
+    V(λ) = V0(λ) / R² * exp( - Σ m_i τ_i(λ) - m_a τ_a(λ) )
+
+where V0 is the calibration constant (signal at 1 AU out of the atmosphere),
+R the Sun-Earth distance in AU and m_i, τ_i the air masses and optical depths
+of Rayleigh scattering, O3, NO2 and water vapour absorption.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from . import srsfiles
+#%%---------------------------------------------------------------------------
+def aod( Counts, V0, SunR, OD ):
+    """
+    Retrieve the spectral AOD for a batch of spectra.
+
+    Parameters
+    ----------
+    Counts : ndarray
+        Dark-corrected signal, shape (N_spectra, N_wavelengths), in the same
+        units of V0 (e.g. counts per millisecond of integration time).
+    V0 : ndarray
+        Calibration constant V0(λ), shape (N_wavelengths,)
+    SunR : ndarray
+        Sun-Earth distance in AU for each spectrum, as given by sunPosition
+    OD : dictionary of ndarrays
+        Air masses and optical depths of each spectrum, as given by
+        OpticalDepthEngine.compute (keys 'AMF', 'AMF_O3', 'Tau_R', 'Tau_O3',
+        'Tau_NO2', 'MTau_WV').
+
+    Returns
+    -------
+    AOD : ndarray
+        Aerosol optical depth, shape (N_spectra, N_wavelengths). Pixels with
+        non-positive signal are set to NaN. The AOD has the same precision
+        of Counts (np.float32 or np.float64).
+    """
+    Counts = np.atleast_2d(Counts)
+    if not np.issubdtype(Counts.dtype, np.floating): Counts = Counts.astype(float)
+    Dt = Counts.dtype
+    M = np.asarray( OD['AMF'], dtype=Dt )[:,None]
+    # Total (slant) optical depth along the line of sight
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Slant = np.log( np.asarray(V0, dtype=Dt) / \
+                        (Counts * np.asarray(SunR, dtype=Dt)[:,None]**2) )
+    Slant[ ~(Counts > 0) ] = np.nan
+    # Subtract the molecular and gaseous contributions
+    Slant -= M * ( OD['Tau_R'] + OD['Tau_NO2'] )
+    Slant -= np.asarray( OD['AMF_O3'], dtype=Dt )[:,None] * OD['Tau_O3']
+    Slant -= OD['MTau_WV']
+    # Aerosols share the Kasten and Young air mass (SUNRAD convention)
+    Slant /= M
+    return Slant
+
+def pairdarks( Records, Dark=None ):
+    """
+    Pair each solar spectrum with the last dark spectrum measured before it.
+
+    Parameters
+    ----------
+    Records : dictionary of ndarrays
+        A block of records, as given by srsfiles.iterrecords
+    Dark : ndarray, optional
+        Last dark spectrum of the previous block of the same file, if any.
+
+    Returns
+    -------
+    Sel : ndarray
+        Indices, within the block, of the solar records having a dark
+    Darks : ndarray
+        Dark spectrum paired with each selected record, (N_solar, N_pixels)
+    Dark : ndarray
+        Last dark spectrum of this block, to be given to the next call
+    """
+    Counts = Records['Counts']
+    N = len(Counts)
+    IsDark = Records['Type'] == 'dark'
+    # Index of the last dark record at or before each record (-1: none)
+    Last = np.maximum.accumulate( np.where(IsDark, np.arange(N), -1) )
+    Sel = np.flatnonzero( (Records['Type'] == 'solar') & \
+                          ((Last >= 0) | (Dark is not None)) )
+    if Dark is not None:
+        Darks = np.vstack( (Counts, Dark[None,:]) )
+        Last = np.where( Last < 0, N, Last )
+    else:
+        Darks = Counts
+    Darks = Darks[ Last[Sel] ]
+    if IsDark.any():
+        Dark = Counts[ np.flatnonzero(IsDark)[-1] ].copy()
+    return Sel, Darks, Dark
+
+def darkcorrect( Records, Dark=None, NL=None, Stray=None ):
+    """
+    Subtract from each solar spectrum the last dark spectrum measured before
+    it (see pairdarks), correct the detector nonlinearity and the stray
+    light if **NL** and **Stray** are given (see nonlinearity.NLCorrection
+    and straylight.StrayLightMatrix) and normalize by the integration time.
+
+    Returns
+    -------
+    Signal : ndarray
+        Dark-corrected solar spectra in [counts/ms], (N_solar, N_pixels)
+    Sel : ndarray
+        Indices, within the block, of the solar records in Signal
+    Dark : ndarray
+        Last dark spectrum of this block, to be given to the next call
+    """
+    Sel, Darks, Dark = pairdarks( Records, Dark )
+    Signal = Records['Counts'][Sel] - Darks
+    if NL is not None: NL.apply( Signal, Out=Signal )
+    if Stray is not None: Stray.apply( Signal, Out=Signal )
+    Signal /= Records['Tint'][Sel,None].astype( Signal.dtype )
+    return Signal, Sel, Dark
+
+def iteraod( Files, V0, Engine, Chunk=256, **ODargs ):
+    """
+    Stream the AOD retrieval over a set of daily SRS files, in blocks of
+    **Chunk** records: memory use stays the same for any length of the
+    record.
+
+    Parameters
+    ----------
+    Files : list of strings
+        Daily SRS data files, processed in the given order
+    V0 : ndarray
+        Calibration constant V0(λ) in [counts/ms], on the instrument grid
+    Engine : OpticalDepthEngine
+        Optical depth calculator built for the instrument's wavelength grid
+    Chunk : integer, optional
+        Number of records read at once. Default: 256. Counts are read with
+        the precision of the engine (Engine.Dtype)
+    **ODargs : optional
+        Other arguments for Engine.compute (Pres, Tamb, Season, ...), given
+        as scalar values.
+
+    Yields
+    ------
+    Date : ndarray
+        Timestamps (datetime64) of the solar spectra in the block
+    Zang : ndarray
+        Solar Zenith Angle of each spectrum
+    AOD : ndarray
+        Aerosol optical depth, shape (N_spectra, N_wavelengths)
+    """
+    for File in Files:
+        Dark = None
+        for Records in srsfiles.iterrecords( File, Chunk, Engine.Dtype ):
+            Signal, Sel, Dark = darkcorrect( Records, Dark )
+            if len(Sel) == 0: continue
+            Date = Records['Date'][Sel]
+            OD = Engine.compute( Date, **ODargs )
+            yield Date, OD['Zang'], aod( Signal, V0, OD['SunR'], OD )
@@ -6,6 +6,7 @@ Tools for importing into a Python workspace Skyrad and Sunrad datasets.
 
 @author: valerio
 """
+import itertools
 import numpy as np
 from datetime import datetime, timedelta
 #%%---------------------------------------------------------------------------
@@ -19,10 +20,35 @@ def dateconvert( Date ):
     Minutes[4] = np.round( Date[3]%1*60. ).astype(int)
     return datetime( *Date.astype(int) ) + timedelta( *Minutes )
 
+def dateconvert64( Date ):
+    """
+    Array version of dateconvert: take a [Nx4] array of floats (Year, Month,
+    Day, Hour) and convert it to DATETIME64 values, rounded to the minute.
+    """
+    Date = np.atleast_2d( Date )
+    Y, M, D = Date[:,:3].astype(int).T
+    Minutes = np.floor( Date[:,3] ).astype(int) * 60 + \
+              np.round( Date[:,3] % 1 * 60. ).astype(int)
+    return ymdtodatetime64( Y, M, D ) + Minutes.astype('timedelta64[m]')
+
+def ymdtodatetime64( Y, M, D ):
+    """
+    Support function: arrays of integer year, month and day to datetime64[D]
+    """
+    return ( (np.asarray(Y) - 1970).astype('datetime64[Y]') + \
+             (np.asarray(M) - 1).astype('timedelta64[M]') ).astype('datetime64[D]') \
+           + (np.asarray(D) - 1).astype('timedelta64[D]')
+
+# Ver. 0.9.7: single-pass parser, returns regular 3-D arrays
 def importskyrad( File ):
     """
     Import some of the SKYRAD.pack data products into the workspace.
 
+    The file is read at once; Tag lines (the ones with a ')') are found on
+    the whole set of lines, and all the data lines are tokenized together
+    into one array of floats. A file with Tag lines but no data lines gives
+    empty data blocks; data that do not fill the blocks raise ValueError.
+
     Parameters
     ----------
     File : string
@@ -37,38 +63,45 @@ def importskyrad( File ):
         Date/time list of each retrieval, extracted from the Tag line.
     Error : ndarray
         Observation error
-    Data  : list of ndarrays
-        Contains lists with extracted content depending on the product type.
+    Data  : ndarray
+        Data block of each retrieval, shape (N_retrievals, N_rows, N_cols),
+        depending on the product type (see formatdata).
     """
-    Date, Data, Error = [ [], [], [] ];   # l = 0
-    infile = open( File, 'r' )
-    if not infile.read():
-        pass
-    else:
-        infile.seek(0)
-        for line in infile:
-            Tag = line.count( ')' )
-            S = line.split()
-            if Tag > 0:
-                Y = int( S[1] );   M =   int( S[2] )
-                D = int( S[3] );   H = float( S[4] )
-                Date.append( np.array( (Y,M,D,H) ) )
-                Error.append( float( S[12] ) )
-                # Update retrieval counter when a TAG line is read
-                # l += 1
-
-            # Determine from FILE extension the product type (PAR/VOL)
-            elif ( Tag == 0 ) & ( File.endswith('par') | File.endswith('vol') ):
-                Data.append( [ float(x) for x in S ] )
-
-        # Slice the DATA list in N chunks, where N is the # of retrievals
-        L = len(Data)/len(Date)
-        Data = [ Data[ i:i+L ] for i in range(0, len(Data), L) ]
-        Date = [ dateconvert( Date[k] ) for k in range( len(Date) ) ]
-
-    infile.close()
-    return Date, Error, Data
-
+    with open( File, 'rb' ) as F:
+        Lines = np.array( F.read().splitlines() )
+    IsTag = np.char.find( Lines, b')' ) >= 0 if len(Lines) else np.array([], bool)
+    Tags = Lines[IsTag];   N = len(Tags)
+    if N == 0:
+        return [], np.array([]), np.empty( (0, 0, 0) )
+
+    # Tag fields: counter, year, month, day, decimal hour, ..., error (13th)
+    Split = [ T.split() for T in Tags ]
+    Count = set( map(len, Split) )
+    if min( Count ) < 13:
+        raise ValueError('importskyrad: %s, Tag line with less than 13 fields'\
+                         % File)
+    # Same fields on every Tag line: one array; otherwise the first 13
+    Tok = np.array( Split if len(Count) == 1 else [ T[:13] for T in Split ] )
+    YMDH  = Tok[:,1:5].astype(float)
+    Error = Tok[:,12].astype(float)
+    Date  = dateconvert64( YMDH ).astype('datetime64[us]').astype(object).tolist()
+
+    # Determine from FILE extension the product type (PAR/VOL)
+    if not ( File.endswith('par') | File.endswith('vol') ):
+        return Date, Error, np.empty( (N, 0, 0) )
+    # Blank lines give no tokens: only the column count needs a filled row
+    Rows = Lines[~IsTag]
+    First = next( ( R for R in Rows if R.strip() ), None )
+    if First is None:
+        return Date, Error, np.empty( (N, 0, 0) )
+    Ncol = len( First.split() )
+    Data = np.array( b' '.join(Rows).split(), dtype=float )
+    if Data.size % ( N * Ncol ):
+        raise ValueError('importskyrad: %s, %d values do not fill %d blocks of'\
+                         ' %d columns' % (File, Data.size, N, Ncol))
+    return Date, Error, Data.reshape( N, -1, Ncol )
+
+# Ver. 0.9.7: data blocks as views (column slices) of the 3-D data array
 def formatdata( Data, product='par' ):
     """
     Function designed to give a standard format (data blocks) to SKYRAD data
@@ -76,8 +109,10 @@ def formatdata( Data, product='par' ):
 
     Parameters
     ----------
-    Data  : list of ndarrays
-        Contains lists with extracted content depending on the product type.
+    Data  : ndarray
+        Data blocks, shape (N_retrievals, N_rows, N_cols), as given by
+        importskyrad. A list of lists with the same structure is accepted
+        (then the blocks are copies).
     product : string, optional
         SKYRAD product type: 'par' or 'vol'
 
@@ -89,42 +124,19 @@ def formatdata( Data, product='par' ):
      complex refractive index (CRI), wavelengths (WL) in nanometers
     *vol: particle size distribution (PSD) and relative size classes
 
+    AOD, SSA, CRI and PSD are views of Data (no copy): modifying them
+    modifies Data.
     """
+    Data = np.asarray( Data, dtype=float )
     if product == 'par':
-        # Initialize the lists to be filled in the loops
-        Block1, Block2, Block3 = [ [], [], [] ]
-        AOD,    SSA,    RefIdx = [ [], [], [] ]
-
-        for j in range( len(Data) ):
-            # Use the number of Wavelengths output by the SKYRAD analysis
-            for k in range( len(Data[0]) ):
-                Block1.append( Data[j][k][1] )
-                Block2.append( Data[j][k][3] )
-                Block3.append( [ Data[j][k][l] for l in (4,5) ] )
-            # Turn each data block (L rows<->L wavelengths) into an ARRAY
-            AOD.append( np.array( Block1 ) )
-            SSA.append( np.array( Block2 ) )
-            RefIdx.append( np.array( Block3 ) )
-            Block1, Block2, Block3 = [ [], [], [] ]
-        # Express wavelengths in nanometers
-        WL = [ int( Data[0][l][0]*1e3 ) for l in range( len( Data[0] ) ) ]
-        # Give as output ARRAYS
-        return np.array(AOD), np.array(SSA), np.array(RefIdx), WL
+        # Columns: wavelength [um], AOD, -, SSA, real and imaginary CRI
+        WL = [ int( w*1e3 ) for w in Data[0,:,0] ]
+        return Data[:,:,1], Data[:,:,3], Data[:,:,4:6], WL
 
     elif product == 'vol':
-        # Initialize the lists to be filled in the loops
-        Block = [];     VolDist = []
-        for j in range( len(Data) ):
-            # Use the number of Wavelengths output by the SKYRAD analysis
-            for k in range( len(Data[0]) ):
-                Block.append( Data[j][k][0] )
-
-            VolDist.append( np.array( Block ) )
-            Block = []
-
-        Sizes = [ Data[0][l][0] for l in range( len( Data[0] ) ) ]
-        return np.array(VolDist), np.array(Sizes)
+        return Data[:,:,0], Data[0,:,0].copy()
 
+# Ver. 0.9.7: single read of the file, vectorized timestamps (datetime64)
 def importsunrad( File ):
     """
     Import to the workspace the SUNRAD.pack data products, raw (DT2) or retri-
@@ -135,6 +147,11 @@ def importsunrad( File ):
      - From the OPT retrievals timestamps, AOD(WL), ALF(VIS) and BET(VIS) are
      extracted
 
+    The file is read once; each column needed is converted to floats in one
+    step, and dates and times are parsed as integer fields of all the rows.
+    A data line with a number of fields different from the first one (e.g.
+    a truncated line) raises ValueError, with the file and the line number.
+
     Please consult the SUNRAD.pack documentation for further details.
 
     Parameters
@@ -150,10 +167,11 @@ def importsunrad( File ):
     Wvlgt : list of floats
         Wavelength channels of the instrument (DT2 file) or subset used for the
         SUNRAD inversion (OPT file), expressed in [micrometers]
-    Date : list of datetime objects
-        Date/time list of each retrieval, extracted from the Tag line.
+    Date : ndarray of datetime64[s]
+        Timestamp of each data line (empty list if there are no data).
     Vout : ndarray
-        Depending on the product type, each line contains data of:
+        Contiguous array with one row per data line (empty list if there are
+        no data). Depending on the product type, each row contains:
          - DT2: measured currents (in Ampere) at the Prede POM photodiode.
          - OPT: estimated AOD at each wavelength (**Wvlgt**) and Angstrom
          Alpha and Beta parameters (interpolated from the VIS channels)
@@ -161,39 +179,58 @@ def importsunrad( File ):
     # Determine product type by the file extension
     Ftype = File[-3:]
 
-    # Load the file header to get some info on what the data file contains
-    F = open( File, 'r' )
-    Header = F.readline().split();        Header = Header[2:]
+    with open( File, 'r' ) as F:
+        Lines = F.read().splitlines()
+    # The file header tells what the data file contains
+    Header = Lines[0].split()[2:] if Lines else []
 
-    # Header info and timestamp formats are different between the two products
+    # Header info and timestamp formats are different between the two
+    # products. Cols are the indices of the blank-separated fields, the
+    # date and the time being the first two.
     if Ftype.lower() == 'dt2':
-        DFMT = '%y%m%d %H:%M:%S';      Del = ' ' # Column separator: 1 blank
         Nwvl = len(Header);           Step = 3
-        Cols = np.arange(2, len(Header), 3)
+        Cols = np.arange(2, len(Header), 3).tolist()
     elif Ftype.lower() == 'opt':
-        DFMT = '%d/%m/%y %H:%M:%S';    Del = '   ' # Column separator: 3 blanks
         Nwvl =  len(Header) - 7;      Step = 1
-        Cols = np.arange(1, 1+Nwvl).tolist() + [ Nwvl+4, Nwvl+5 ]
+        Cols = np.arange(2, 2+Nwvl).tolist() + [ Nwvl+5, Nwvl+6 ]
 
     # Return the actual Wavelength set, expressed in [micrometers]
     Wvlgt = [ float( Header[l][-6:-1] ) for l in range(0,Nwvl,Step) ]
 
     # Return empty variables if the data product is empty (DT2)
-    if not F.readline():
-        Date, Vout = [ [], [] ]
-        F.close()
+    Nums = [ k for k in range(1, len(Lines)) if Lines[k].strip() ]
+    if not Nums:
+        return Wvlgt, [], []
+
+    N = len(Nums)
+    Split = [ Lines[k].split() for k in Nums ]
+    # All the data rows must have the fields of the first one
+    Count = np.fromiter( map(len, Split), dtype=int, count=N )
+    Ncol = Count[0]
+    Bad = np.flatnonzero( Count != Ncol )
+    if len(Bad):
+        k = Nums[ Bad[0] ]
+        raise ValueError('importsunrad: %s, line %d has %d fields instead of %d'\
+                         ' (%d bad lines): %r' % (File, k + 1, Count[Bad[0]], Ncol,\
+                         len(Bad), Lines[k][:80]))
+    Tok = list( itertools.chain.from_iterable( Split ) )
+    # Timestamps: DT2 yymmdd HH:MM:SS, OPT dd/mm/yy HH:MM:SS
+    if Ftype.lower() == 'dt2':
+        YMD = np.array( Tok[0::Ncol], dtype=int )
+        Y, M, D = YMD // 10000, YMD // 100 % 100, YMD % 100
     else:
-        # Load date/time data as strings, then convert to datetime format
-        mdate, mtime = np.loadtxt( File, delimiter=' ', skiprows=1, \
-                usecols={0,1}, unpack=True, dtype='string' )
-        if isinstance( mdate, np.ndarray ):
-            Date = [ datetime.strptime(mdate[l] + ' ' + mtime[l],  DFMT) \
-                    for l in range(len(mdate)) ]
-        elif isinstance( mdate, str ):
-            Date = [ datetime.strptime(mdate + ' ' + mtime,  DFMT) ]
-
-        # Load Vout data, using only the first measurement of the triplets
-        Vout = np.loadtxt( File, delimiter=Del, skiprows=1, usecols=Cols,\
-                unpack=False, dtype='float' )
+        D, M, Y = np.array( ' '.join(Tok[0::Ncol]).replace('/', ' ').split(),\
+                            dtype=int ).reshape(N, 3).T
+    # Two-digit years as for strptime (%y): 69-99 -> 1900s, 00-68 -> 2000s
+    Y = Y + np.where( Y < 69, 2000, 1900 )
+    HMS = np.array( ' '.join(Tok[1::Ncol]).replace(':', ' ').split(),\
+                    dtype=int ).reshape(N, 3)
+    Date = ymdtodatetime64( Y, M, D ).astype('datetime64[s]') + \
+           ( HMS @ np.array([3600, 60, 1]) ).astype('timedelta64[s]')
+
+    # Load Vout data, using only the first measurement of the triplets
+    Vout = np.empty( (N, len(Cols)) )
+    for k, c in enumerate(Cols):
+        Vout[:,k] = np.array( Tok[c::Ncol], dtype=float )
 
     return Wvlgt, Date, Vout
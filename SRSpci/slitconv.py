@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Convolution of reference spectra (Gueymard's extraterrestrial spectrum and
+absorption coefficients, on their 1 nm grid) with the slit function of the
+spectrometer, onto the instrument's wavelength grid.
+
+The convolution is stored as a banded sparse matrix (pixels x reference
+wavelengths): for each pixel, the index of the first reference wavelength
+and the weights of the following ones. It is built once per instrument and
+slit model, optionally cached on disk, and applied to any reference
+spectrum (or batch of spectra) by a single gather and weighted sum.
+Given to OpticalDepthEngine (Slit argument), it convolves the Rayleigh
+optical depth and the Gueymard absorption coefficients used for the AOD.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import os
+import hashlib
+import numpy as np
+from . import SRStools as srt
+#%%---------------------------------------------------------------------------
+def slitfunction( Delta, FWHM, Shape='gauss' ):
+    """
+    Slit function (not normalized) at distance **Delta** [nm] from the pixel
+    central wavelength.
+
+    Parameters
+    ----------
+    Delta : ndarray
+        Wavelength offset from the centre, in [nanometers]
+    FWHM : ndarray
+        Full width at half maximum of the slit, in [nanometers], broadcast
+        against Delta
+    Shape : string, optional
+        'gauss' (default) or 'triangle'
+    """
+    if Shape == 'gauss':
+        return np.exp( -4. * np.log(2.) * (Delta / FWHM)**2 )
+    elif Shape == 'triangle':
+        return np.maximum( 0., 1. - np.abs(Delta) / FWHM )
+    raise ValueError('slitfunction: unknown slit shape ' + str(Shape))
+
+class SlitMatrix(object):
+    """
+    Banded convolution matrix from a reference wavelength grid to the
+    instrument's pixels.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Wavelength grid of the spectrometer, in [nanometers], e.g. from
+        GetLambda or srsfiles.readheader
+    FWHM : float or list of floats, optional
+        Slit FWHM in [nanometers]: a constant, or polynomial coefficients in
+        the wavelength (highest degree first, as for np.polyval).
+        Default: 1.4 nm
+    Shape : string, optional
+        Slit shape, see slitfunction. Default: 'gauss'
+    RefWvl : ndarray, optional
+        Reference wavelength grid. Default: Gueymard's table grid
+    Width : float, optional
+        Half-width of the slit window, in FWHM units. Default: 3
+    Step : float, optional
+        Integration step of the convolution, in [nanometers]; the reference
+        spectrum is linearly interpolated in between its points. Default: 0.1
+    CacheDir : string, optional
+        Directory where the matrix is saved and looked for, keyed by the
+        grid, the slit parameters and **Serial**. Default: no disk cache
+    Serial : string, optional
+        Instrument serial number, used in the cache file name
+    """
+    def __init__( self, WaveLgt, FWHM=1.4, Shape='gauss', RefWvl=None,\
+                  Width=3., Step=0.1, CacheDir=None, Serial='' ):
+        self.WaveLgt = np.ascontiguousarray( WaveLgt, dtype=float )
+        if RefWvl is None: RefWvl = srt.gueymard_table()[:,0]
+        self.RefWvl = np.ascontiguousarray( RefWvl, dtype=float )
+        self.FWHM   = np.atleast_1d( np.asarray(FWHM, dtype=float) )
+        self.Shape, self.Width, self.Step = Shape, float(Width), float(Step)
+
+        File = None
+        if CacheDir is not None:
+            File = os.path.join( CacheDir, 'slit_%s_%s.npz' % (Serial, self.key()) )
+        if File is not None and os.path.exists(File):
+            with np.load(File) as Cache:
+                self.Start, self.Weight = Cache['Start'], Cache['Weight']
+        else:
+            self.Start, self.Weight = self.build()
+            if File is not None:
+                if not os.path.isdir(CacheDir): os.makedirs(CacheDir)
+                # Write to a temporary name first (one per process, as
+                # several workers can build the same matrix): readers never
+                # see a partially written file
+                Tmp = File[:-4] + '.tmp%d.npz' % os.getpid()
+                np.savez( Tmp, Start=self.Start, Weight=self.Weight )
+                os.replace( Tmp, File )
+        self.Index = np.minimum( self.Start[:,None] + \
+                     np.arange(self.Weight.shape[1]), len(self.RefWvl) - 1 )
+
+    def key( self ):
+        """Hash of the grids and slit parameters, used to name the cache."""
+        H = hashlib.sha1()
+        for A in ( self.WaveLgt, self.RefWvl, self.FWHM,\
+                   np.array([self.Width, self.Step]) ):
+            H.update( A.tobytes() )
+        H.update( self.Shape.encode() )
+        return H.hexdigest()[:16]
+
+    def build( self ):
+        """
+        Compute the banded matrix.
+
+        Returns
+        -------
+        Start : ndarray
+            Index of the first reference wavelength used by each pixel
+        Weight : ndarray
+            Weights of the reference wavelengths Start, Start+1, ... for
+            each pixel, shape (N_pixels, Band); each row sums to 1
+        """
+        Ref = self.RefWvl
+        F = np.polyval( self.FWHM, self.WaveLgt )                 # (Npix,)
+        K = int( np.ceil( 2. * self.Width * F.max() / self.Step ) ) + 1
+        # Integration points: same number for every pixel, evenly spaced
+        Delta = np.linspace( -1., 1., K )[None,:] * self.Width * F[:,None]
+        X = self.WaveLgt[:,None] + Delta                          # (Npix, K)
+        S = slitfunction( Delta, F[:,None], self.Shape )
+        S /= S.sum(1)[:,None]
+
+        # Linear interpolation of the reference grid at the points X
+        J = np.clip( np.searchsorted(Ref, X) - 1, 0, len(Ref) - 2 )
+        T = np.clip( (X - Ref[J]) / (Ref[J+1] - Ref[J]), 0., 1. )
+
+        # Collect the weights into a band starting at the first index used
+        Start = J.min(1)
+        Band  = int( (J.max(1) - Start).max() ) + 2
+        Weight = np.zeros( (len(X), Band) )
+        Rows = np.repeat( np.arange(len(X)), K )
+        Off  = (J - Start[:,None]).ravel()
+        np.add.at( Weight, (Rows, Off),     (S * (1. - T)).ravel() )
+        np.add.at( Weight, (Rows, Off + 1), (S * T).ravel() )
+        return Start, Weight
+
+    def apply( self, Ref ):
+        """
+        Convolve reference spectra onto the instrument's grid.
+
+        Parameters
+        ----------
+        Ref : ndarray
+            Spectrum on the reference grid, shape (N_ref,) or a batch with
+            shape (N_spectra, N_ref)
+
+        Returns
+        -------
+        Conv : ndarray
+            Convolved spectrum, shape (N_pixels,) or (N_spectra, N_pixels)
+        """
+        Ref = np.asarray( Ref, dtype=float )
+        return ( Ref[...,self.Index] * self.Weight ).sum(-1)
+
+    def coeff( self, Col ):
+        """
+        Column **Col** of Gueymard's table (see SRStools.gueymard_coeff),
+        convolved with the slit function. Needs the default RefWvl.
+        """
+        return self.apply( srt.gueymard_table()[:,Col] )
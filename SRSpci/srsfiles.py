@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Tools for reading back the daily SRS data files, as written by the
+WriteHeader and WriteData functions of the operateSRS module.
+
+Records are read in fixed-size chunks, so that memory use does not depend
+on the length of the file.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+#%%---------------------------------------------------------------------------
+def readheader( File ):
+    """
+    Read the header of a daily SRS data file.
+
+    Parameters
+    ----------
+    File : string
+        Filename string, expressed as a relative or absolute path.
+
+    Returns
+    -------
+    Serial : string
+        Instrument ID (spectrometer serial number)
+    Wvl : ndarray
+        Wavelength grid of the spectrometer, in [nanometers]
+    """
+    Serial = '';   Wvl = np.array([])
+    with open( File, 'r' ) as F:
+        for line in F:
+            if line.startswith('# Instrument ID:'):
+                Serial = line.split(':', 1)[1].strip()
+            elif line.startswith('# Date_Time'):
+                break
+            elif not line.startswith('#'):
+                # The wavelength grid is the only header line without '#'
+                Wvl = np.array( line.split(), dtype=float )
+    return Serial, Wvl
+
+def parselines( Lines, Npix, Dtype=float ):
+    """
+    Support function for iterrecords: turn a list of data lines into a
+    dictionary of arrays (see iterrecords for the keys).
+    The spectral data are written with a fixed width of 8 characters, so
+    they are taken from the end of each line; the TEC temperature is the
+    8-character field just before them.
+    """
+    N = len(Lines)
+    Date = np.empty( N, dtype='datetime64[s]' )
+    Tint, Temp = np.empty( (2, N) )
+    Avg  = np.empty( N, dtype=int )
+    Type = np.empty( N, dtype='U8' )
+    Spec = []
+    for l, line in enumerate(Lines):
+        line = line.rstrip('\n')
+        Date[l] = line[:10] + 'T' + line[11:19]
+        S = line[20:].split(None, 2)
+        Tint[l] = float(S[0]);    Type[l] = S[1]
+        Spec.append( S[2][-8*Npix:] )
+        AvgTemp = S[2][:-8*Npix]
+        Avg[l]  = int( AvgTemp[:-8] );   Temp[l] = float( AvgTemp[-8:] )
+    Counts = np.array( ' '.join(Spec).split(), dtype=Dtype ).reshape(N, Npix)
+    return { 'Date': Date, 'Tint': Tint, 'Type': Type, 'Avg': Avg,
+             'Temp': Temp, 'Counts': Counts }
+
+def iterrecords( File, Chunk=256, Dtype=float ):
+    """
+    Read the records of a daily SRS data file, **Chunk** lines at a time.
+
+    Parameters
+    ----------
+    File : string
+        Filename string, expressed as a relative or absolute path.
+    Chunk : integer, optional
+        Maximum number of records in each yielded block. Default: 256
+    Dtype : data type, optional
+        Type of the spectral data array. Counts up to 2**24 are exact also
+        in np.float32, which halves the memory of the blocks. Default: float
+
+    Yields
+    ------
+    Records : dictionary of ndarrays
+        'Date'   : timestamps (UTC) as datetime64[s]
+        'Tint'   : integration time in [ms]
+        'Type'   : measurement type ('dark', 'solar', 'labtest')
+        'Avg'    : number of averaged scans
+        'Temp'   : TEC temperature in [Celsius]
+        'Counts' : spectral data, shape (N_records, N_pixels)
+    """
+    Npix = len( readheader(File)[1] )
+    with open( File, 'r' ) as F:
+        Lines = []
+        for line in F:
+            # Skip header lines (also when repeated after a restart in the
+            # same day): comments and the wavelength grid, which starts
+            # with blanks
+            if line[:1] in ('#', ' ', '\n', ''): continue
+            Lines.append(line)
+            if len(Lines) == Chunk:
+                yield parselines( Lines, Npix, Dtype )
+                Lines = []
+        if Lines:
+            yield parselines( Lines, Npix, Dtype )
+
+def iterarchive( Files, Chunk=256, Dtype=float ):
+    """
+    Read the records of several daily files, in the given order.
+    Each yielded block belongs to a single file: the file name is added to
+    the dictionary with the 'File' key.
+    """
+    for File in Files:
+        for Records in iterrecords( File, Chunk, Dtype ):
+            Records['File'] = File
+            yield Records
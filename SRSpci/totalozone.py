@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Retrieval of the total ozone column from the Huggins band (310-340 nm) of
+the direct solar spectra.
+
+After removing the Rayleigh and NO2 contributions, the slant optical depth
+divided by the ozone air mass is linear in the ozone column X:
+
+    ln(V0 / (S R^2)) / m_O3 - (m/m_O3) (τ_R + τ_NO2) = X Ao(λ) + P(λ)
+
+with Ao the Gueymard (2001) ozone absorption coefficients, corrected for
+the effective ozone temperature as in SRStools.ozone_OD, and P a low order
+polynomial in λ for the aerosols (the ratio m/m_O3 of each record is
+absorbed by its coefficients). The design matrix [Ao, 1, λ, ...] depends
+only on the wavelength grid and on the season (and temperature) of the
+records: its pseudo-inverse is computed once and a batch of spectra is
+solved by one matrix product.
+
+The retrieved columns ([atm-cm]) can be given to the O3col argument of
+OpticalDepthEngine.compute (or opticaldepths).
+
+Example
+-------
+>>> Engine = OpticalDepthEngine(Wvl, Site)
+>>> O3 = ozonecolumns(Engine, Dates, Signal, V0, Season=1)['O3col']
+>>> OD = Engine.compute(Dates, O3col=O3, Season=1)
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from . import SRStools as srt
+#%%---------------------------------------------------------------------------
+class OzoneRetrieval(object):
+    """
+    Linear least-squares ozone column retrieval on one wavelength grid.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Full set of spectrometer's wavelengths, in [nanometers]
+    Height : float
+        Elevation of the measurement site, in [meters] above mean sea level
+    Window : tuple of floats, optional
+        Wavelength range of the fit, in [nanometers]. Default: (310, 340)
+    Order : integer, optional
+        Order of the aerosol polynomial. Default: 1
+    """
+    def __init__( self, WaveLgt, Height, Window=(310., 340.), Order=1 ):
+        self.WaveLgt = np.ascontiguousarray( WaveLgt, dtype=float )
+        self.Height = float(Height)
+        self.Sel = np.flatnonzero( (self.WaveLgt >= Window[0]) & \
+                                   (self.WaveLgt <= Window[1]) )
+        if len(self.Sel) < Order + 3:
+            raise ValueError('OzoneRetrieval: %d pixels in the window %s' % \
+                             (len(self.Sel), Window))
+        Wl = self.WaveLgt[self.Sel]
+        X = ( Wl - Wl.mean() ) / ( Wl.max() - Wl.min() )
+        self.Poly = X[:,None] ** np.arange(Order + 1)
+        # Pseudo-inverses, by (Season, Tamb)
+        self._Pinv = {}
+
+    def design( self, Season=2, Tamb=999 ):
+        """
+        Design matrix (N_pixels_window, 2 + Order): ozone coefficients at
+        the effective temperature of the season (and of Tamb), then the
+        polynomial terms.
+        """
+        Ao = srt.ozone_OD( self.WaveLgt[self.Sel], self.Height, 1., Tamb, Season )
+        return np.hstack( [ Ao[:,None], self.Poly ] )
+
+    def pinv( self, Season=2, Tamb=999 ):
+        """Support function: cached pseudo-inverse of the design matrix."""
+        Key = ( int(Season), float(Tamb) )
+        if Key not in self._Pinv:
+            self._Pinv[Key] = np.linalg.pinv( self.design(*Key) )
+        return self._Pinv[Key]
+
+    def retrieve( self, Signal, V0, OD, Tamb=999, Season=2 ):
+        """
+        Ozone column of a batch of spectra.
+
+        Parameters
+        ----------
+        Signal : ndarray
+            Dark-corrected signal, shape (N_spectra, N_wavelengths), in the
+            same units of V0
+        V0 : ndarray
+            Calibration constant V0(λ), shape (N_wavelengths,)
+        OD : dictionary of ndarrays
+            Air masses and optical depths of the spectra, as given by
+            OpticalDepthEngine.compute or iterchunks (keys 'SunR', 'AMF',
+            'AMF_O3', 'Tau_R', 'Tau_NO2'; 'MTau_WV' if present)
+        Tamb : float or array_like, optional
+            Ambient temperature in [Celsius]; 999 means not measured.
+            Measured values are rounded to 1 degree: the design matrix is
+            computed once per distinct (Season, Tamb).
+        Season : integer or array_like, optional
+            Season code, or one code per record
+
+        Returns
+        -------
+        Out : dictionary of ndarrays
+            'O3col' : ozone column [atm-cm], (N_spectra,), NaN for records
+                      with non-positive signal in the window
+            'Coef'  : all the fitted coefficients, (N_spectra, 2 + Order)
+            'RMS'   : RMS residual of the fit (optical depth / m_O3)
+        """
+        Signal = np.atleast_2d( Signal )
+        N = len(Signal);   S = self.Sel
+        M = np.asarray( OD['AMF'], dtype=float )[:,None]
+        Mo = np.asarray( OD['AMF_O3'], dtype=float )[:,None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Y = np.log( np.asarray(V0, dtype=float)[S] / \
+                ( Signal[:,S] * np.asarray(OD['SunR'], dtype=float)[:,None]**2 ) )
+        Y[ ~(Signal[:,S] > 0) ] = np.nan
+        Y -= M * ( OD['Tau_R'][:,S] + OD['Tau_NO2'][:,S] )
+        if 'MTau_WV' in OD: Y -= OD['MTau_WV'][:,S]
+        Y /= Mo
+
+        Tamb = np.broadcast_to( np.asarray(Tamb, dtype=float), (N,) )
+        Tamb = np.where( Tamb == 999, 999., np.round(Tamb) )
+        Season = np.broadcast_to( np.asarray(Season, dtype=int), (N,) )
+        Coef = np.empty( (N, self.Poly.shape[1] + 1) )
+        Fit = np.empty_like( Y )
+        Keys = np.stack( [Season, Tamb], axis=1 )
+        Uniq, Inv = np.unique( Keys, axis=0, return_inverse=True )
+        Inv = np.ravel(Inv)
+        for k, (Sn, Ta) in enumerate( Uniq ):
+            R = np.flatnonzero( Inv == k )
+            Coef[R] = Y[R] @ self.pinv( Sn, Ta ).T
+            Fit[R] = Coef[R] @ self.design( Sn, Ta ).T
+        with np.errstate(invalid='ignore'):
+            RMS = np.sqrt( np.mean( (Y - Fit)**2, axis=1 ) )
+        return { 'O3col': Coef[:,0], 'Coef': Coef, 'RMS': RMS }
+
+def ozonecolumns( Engine, Date, Signal, V0, Pres=0, Tamb=999, NO2col=999,\
+                  Season=2, **kw ):
+    """
+    Ozone column of every spectrum, processed in the chunks of the optical
+    depth engine (air masses, Rayleigh and NO2 from OpticalDepthEngine).
+
+    Parameters
+    ----------
+    Engine : OpticalDepthEngine
+        Engine of the instrument
+    Date : list of datetime objects or datetime64 array
+        UTC timestamps of the spectra
+    Signal : ndarray
+        Dark-corrected signal, shape (N_spectra, N_wavelengths)
+    V0 : ndarray
+        Calibration constant V0(λ), shape (N_wavelengths,)
+    Pres, Tamb, NO2col, Season : optional
+        As in OpticalDepthEngine.compute
+    **kw :
+        Window and Order of OzoneRetrieval
+
+    Returns
+    -------
+    Out : dictionary of ndarrays
+        'O3col' [atm-cm] and 'RMS', (N_spectra,): O3col is ready for the
+        O3col argument of Engine.compute
+    """
+    Ret = OzoneRetrieval( Engine.WaveLgt, Engine.Height, **kw )
+    N = len(Signal)
+    Tamb = np.broadcast_to( np.asarray(Tamb, dtype=float), (N,) )
+    Season = np.broadcast_to( np.asarray(Season, dtype=int), (N,) )
+    Out = { 'O3col': np.empty(N), 'RMS': np.empty(N) }
+    for S, OD in Engine.iterchunks( Date, Pres, Tamb, 999, NO2col, 999, Season ):
+        R = Ret.retrieve( Signal[S], V0, OD, Tamb[S], Season[S] )
+        Out['O3col'][S] = R['O3col'];   Out['RMS'][S] = R['RMS']
+    return Out
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Uncertainty of the AOD, by Monte Carlo propagation of the errors of the
+inputs through the batched optical depth chain (OpticalDepthEngine and
+retrieval.aod), or by linearized propagation with the Jacobians of the AOD.
+
+Errors considered (standard deviations, see SIGMA):
+    CountsRel, CountsAbs : noise of the signal, relative and absolute (in
+                           the units of the signal), independent per pixel
+    V0Rel   : relative error of the calibration, independent per pixel but
+              common to all the spectra of a Monte Carlo sample
+    O3Rel, NO2Rel : relative error of the ozone and NO2 columns
+    PresRel : relative error of the pressure (Rayleigh optical depth)
+    Zang    : error of the solar zenith angle from the ephemeris, [degrees]
+              (air masses; water vapour term to first order in the air mass)
+
+The perturbed inputs of a block of records are drawn at once, with shape
+(Samples x N_spectra x N_wavelengths), and the Beer-Lambert inversion of
+retrieval.aod is evaluated in place on them: a block keeps two such work
+arrays (plus boolean masks), and blocks of records are sized so that
+together they hold at most **MaxElements** values. Blocks can be spread
+over a pool of processes; the random streams are spawned per block from
+one seed, so results do not depend on the number of processes.
+
+Example
+-------
+>>> Engine = OpticalDepthEngine(Wvl, Site)
+>>> U = montecarlo(Engine, Dates, Signal, V0, Samples=200, Processes=4,
+...                Sigma={'V0Rel': 0.005}, Season=1)
+>>> U['Std']                              # (N_spectra, N_wavelengths)
+>>> L = linearized(Engine, Dates, Signal, V0, Season=1)
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from . import SRStools as srt
+from .retrieval import aod
+from .opticaldepth import perrecord
+#%%---------------------------------------------------------------------------
+# Default standard deviations of the inputs
+SIGMA = { 'CountsRel': 0.002, 'CountsAbs': 0., 'V0Rel': 0.01, 'O3Rel': 0.03,
+          'NO2Rel': 0.3, 'PresRel': 0.005, 'Zang': 0.01 }
+
+def sigmas( Sigma=None ):
+    """Support function: the defaults of SIGMA updated with **Sigma**."""
+    Out = dict( SIGMA )
+    if Sigma: Out.update( Sigma )
+    Bad = set( Out ) - set( SIGMA )
+    if Bad: raise ValueError('uncertainty: unknown inputs %s' % sorted(Bad))
+    return Out
+
+def baseline( Engine, Date, Pres=0, Tamb=999, O3col=999, NO2col=999,\
+              WVcol=999, Season=2 ):
+    """
+    Support function: optical depths of the unperturbed records, with the
+    per-record pressure (Standard Atmosphere where not measured), water
+    vapour column and season needed to compute the water vapour term again,
+    and its derivative with respect to the air mass ('DWV').
+    """
+    OD = Engine.compute( Date, Pres, Tamb, O3col, NO2col, WVcol, Season )
+    N = len( OD['Zang'] )
+    P = perrecord( Pres, N )
+    OD['Pres'] = np.where( (P == 0) | (P == 999), Engine.Pstd, P )
+    OD['WVcol'] = np.array( perrecord( WVcol, N ) )
+    OD['Season'] = np.broadcast_to( np.asarray(Season, dtype=int), (N,) ).copy()
+    AMF, _, MTau = perturbed( Engine, OD, OD['Zang'][None,:] + \
+                              np.array([-0.01, 0.01])[:,None] )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        OD['DWV'] = ( MTau[1] - MTau[0] ) / ( AMF[1] - AMF[0] )[:,None]
+    return OD
+
+def perturbed( Engine, OD, Zang ):
+    """
+    Support function: air masses and water vapour term of the records of
+    **OD** at the solar zenith angles **Zang** (any shape, with the records
+    along the last axis).
+    """
+    Shape = Zang.shape
+    AMF = srt.airmass( Zang )
+    AMF_O3 = srt.airmass( Zang, O3=True, Lat=Engine.Lat )
+    Rows = lambda X: np.broadcast_to( X, Shape ).ravel()
+    MTau = srt.wv_MTau( Engine.WaveLgt, Engine.Height, Rows(OD['Pres']),\
+                        Rows(OD['Season']), WVcol=Rows(OD['WVcol']),\
+                        AMF=AMF.ravel() )
+    return AMF, AMF_O3, MTau.reshape( Shape + (-1,) )
+
+# Work arrays of shape (Samples, N_block, N_wavelengths) alive in mcblock
+LIVE = 2
+
+def mcblock( Args ):
+    """
+    Support function, run by the workers: Monte Carlo samples of the AOD of
+    one block of records. Returns the slice of the block, the mean and the
+    standard deviation over the samples, (N_block, N_wavelengths).
+
+    The AOD is computed as in retrieval.aod, in place in the array of the
+    perturbed signal (A), with one scratch array (T) for the noise and the
+    optical depth terms: the other inputs are perturbed by factors of
+    shape (Samples, N_block, 1) or (Samples, 1, N_wavelengths).
+    """
+    Engine, S, OD, Signal, V0, dV0, Sig, Seed = Args
+    Rng = np.random.default_rng( Seed )
+    Ns = len(dV0);   n, Nw = Signal.shape
+    # Perturbed signal
+    A = Rng.standard_normal( (Ns, n, Nw) )
+    A *= Sig['CountsRel'];   A += 1.;   A *= Signal
+    T = np.empty_like( A )
+    if Sig['CountsAbs'] > 0:
+        Rng.standard_normal( out=T );   T *= Sig['CountsAbs'];   A += T
+    Zang = OD['Zang'] + Sig['Zang'] * Rng.standard_normal( (Ns, n) )
+    AMF = srt.airmass( Zang );   AMF_O3 = srt.airmass( Zang, O3=True, Lat=Engine.Lat )
+    Fact = lambda Rel: 1. + Rel * Rng.standard_normal( (Ns, n) )
+    FR = Fact( Sig['PresRel'] );   FO = Fact( Sig['O3Rel'] );   FN = Fact( Sig['NO2Rel'] )
+    # Slant optical depth, NaN where the signal is not positive
+    Bad = ~( A > 0 )
+    A *= ( OD['SunR']**2 )[:,None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide( ( V0 * (1. + dV0) )[:,None,:], A, out=A )
+        np.log( A, out=A )
+    A[Bad] = np.nan
+    # Molecular and gaseous terms, with their perturbed factors
+    for Tau, F in ( (OD['Tau_R'], AMF * FR), (OD['Tau_NO2'], AMF * FN),\
+                    (OD['Tau_O3'], AMF_O3 * FO) ):
+        np.multiply( Tau, F[...,None], out=T );   A -= T
+    # Water vapour term to first order in the change of air mass
+    np.multiply( OD['DWV'], ( AMF - OD['AMF'] )[...,None], out=T )
+    T += OD['MTau_WV'];   A -= T
+    A /= AMF[...,None]
+    # Mean and standard deviation over the valid samples
+    np.isnan( A, out=Bad )
+    A[Bad] = 0.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Count = Ns - Bad.sum( 0 )
+        Mean = A.sum( 0 ) / Count
+        np.subtract( A, Mean, out=T );   T[Bad] = 0.;   T *= T
+        Std = np.sqrt( T.sum( 0 ) / Count )
+    return S, Mean, Std
+
+def montecarlo( Engine, Date, Signal, V0, Samples=200, Sigma=None,\
+                MaxElements=2**24, Processes=1, Seed=None, **ODargs ):
+    """
+    Monte Carlo uncertainty of the AOD of a batch of spectra.
+
+    Parameters
+    ----------
+    Engine : OpticalDepthEngine
+        Engine of the instrument
+    Date : list of datetime objects or datetime64 array
+        UTC timestamps of the spectra
+    Signal : ndarray
+        Dark-corrected signal, shape (N_spectra, N_wavelengths), in the same
+        units of V0
+    V0 : ndarray
+        Calibration constant V0(λ), shape (N_wavelengths,)
+    Samples : integer, optional
+        Number of Monte Carlo samples. Default: 200
+    Sigma : dictionary, optional
+        Standard deviations of the inputs, replacing those of SIGMA
+    MaxElements : integer, optional
+        Largest number of values held at once by the work arrays of a block
+        (LIVE arrays of Samples x block records x N_wavelengths, plus
+        boolean masks). Default: 2**24 (128 MB in float64)
+    Processes : integer, optional
+        Worker processes (None: number of CPUs). Default: 1
+    Seed : integer, optional
+        Seed of the random streams, for reproducible results
+    **ODargs :
+        Pres, Tamb, O3col, NO2col, WVcol and Season, as in
+        OpticalDepthEngine.compute
+
+    Returns
+    -------
+    Out : dictionary of ndarrays, shape (N_spectra, N_wavelengths)
+        'AOD' (unperturbed), 'Mean' and 'Std' of the samples
+    """
+    Sig = sigmas( Sigma )
+    Signal = np.atleast_2d( np.asarray(Signal, dtype=float) )
+    V0 = np.asarray( V0, dtype=float )
+    N, Nw = Signal.shape
+    OD = baseline( Engine, Date, **ODargs )
+    Root = np.random.SeedSequence( Seed )
+    Rng = np.random.default_rng( Root.spawn(1)[0] )
+    dV0 = Sig['V0Rel'] * Rng.standard_normal( (Samples, Nw) )
+
+    Block = max( 1, int( MaxElements // (LIVE * Samples * Nw) ) )
+    Slices = [ slice(k, min(k + Block, N)) for k in range(0, N, Block) ]
+    Seeds = Root.spawn( len(Slices) )
+    Keys = ( 'Zang', 'SunR', 'AMF', 'Tau_R', 'Tau_O3', 'Tau_NO2', 'MTau_WV', 'DWV' )
+    Tasks = ( ( Engine, S, dict( (K, OD[K][S]) for K in Keys ), Signal[S], V0,\
+                dV0, Sig, Seeds[k] ) for k, S in enumerate(Slices) )
+    Out = { 'AOD': aod( Signal, V0, OD['SunR'], OD ),
+            'Mean': np.empty( (N, Nw) ), 'Std': np.empty( (N, Nw) ) }
+    if Processes == 1 or len(Slices) == 1:
+        Results = map( mcblock, Tasks )
+    else:
+        Pool = ProcessPoolExecutor( max_workers=Processes )
+        Results = Pool.map( mcblock, Tasks )
+    try:
+        for S, Mean, Std in Results:
+            Out['Mean'][S] = Mean;   Out['Std'][S] = Std
+    finally:
+        if Processes != 1 and len(Slices) > 1: Pool.shutdown()
+    return Out
+
+def jacobians( Engine, Signal, V0, OD, Step=0.01 ):
+    """
+    Derivatives of the AOD (N_spectra, N_wavelengths) with respect to the
+    inputs of SIGMA: relative changes for the *Rel inputs, absolute
+    signal units for CountsAbs, degrees for Zang (central differences of
+    the air masses and of the water vapour term, with **Step** degrees).
+    """
+    M = OD['AMF'][:,None];   Mo = OD['AMF_O3'][:,None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        J = { 'CountsRel': -1. / M * np.ones_like(Signal),
+              'CountsAbs': -1. / ( M * Signal ),
+              'V0Rel': 1. / M * np.ones_like(Signal),
+              'O3Rel': -Mo * OD['Tau_O3'] / M,
+              'NO2Rel': -OD['Tau_NO2'],
+              'PresRel': -OD['Tau_R'] }
+    # Solar zenith angle: AOD = (L - M τ - Mo τ_O3 - MTau_WV) / M, with
+    # L = ln(V0 / (S R^2)) fixed
+    Zang = OD['Zang'][None,:] + np.array( [-Step, Step] )[:,None]
+    AMF, AMF_O3, MTau = perturbed( Engine, OD, Zang )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        L = np.log( V0 / (Signal * OD['SunR'][:,None]**2) )
+        AODz = ( L - AMF[:,:,None] * (OD['Tau_R'] + OD['Tau_NO2'])\
+                 - AMF_O3[:,:,None] * OD['Tau_O3'] - MTau ) / AMF[:,:,None]
+    J['Zang'] = ( AODz[1] - AODz[0] ) / ( 2. * Step )
+    return J
+
+def linearized( Engine, Date, Signal, V0, Sigma=None, Step=0.01, **ODargs ):
+    """
+    Linearized uncertainty of the AOD: the Jacobians of jacobians combined
+    with the standard deviations of the inputs, taken as independent.
+    Arguments as in montecarlo.
+
+    Returns
+    -------
+    Out : dictionary of ndarrays, shape (N_spectra, N_wavelengths)
+        'AOD', 'Std' and the contribution of each input ('Std_' + name)
+    """
+    Sig = sigmas( Sigma )
+    Signal = np.atleast_2d( np.asarray(Signal, dtype=float) )
+    V0 = np.asarray( V0, dtype=float )
+    OD = baseline( Engine, Date, **ODargs )
+    J = jacobians( Engine, Signal, V0, OD, Step )
+    Out = { 'AOD': aod( Signal, V0, OD['SunR'], OD ) }
+    Var = 0.
+    for K in SIGMA:
+        Out['Std_' + K] = np.abs( J[K] ) * Sig[K]
+        Var = Var + Out['Std_' + K]**2
+    Out['Std'] = np.sqrt( Var )
+    return Out
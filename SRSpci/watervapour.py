@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Retrieval of the precipitable water vapour column from the 940 nm
+absorption band of the direct solar spectra.
+
+A lookup table of the band transmittance (average of exp(-m τ_WV) over the
+band pixels, weighted by V0) is computed once, for a grid of water vapour
+columns and air masses, with the formulation of SRStools.wv_MTau (Gueymard
+Awλ coefficients). The measured band transmittance of each spectrum is the
+ratio of its signal to V0 over the band, after removing Rayleigh, ozone,
+NO2 and aerosols (AOD interpolated in log-log from two windows outside the
+band). The table is interpolated at the air mass of each record and
+inverted along the column axis (the transmittance decreases with the
+column) for all the records at once: there is no per-record fitting.
+
+The retrieved columns ([cm]) can be given to the WVcol argument of
+OpticalDepthEngine.compute (or opticaldepths).
+
+Example
+-------
+>>> Engine = OpticalDepthEngine(Wvl, Site)
+>>> WV = wvcolumns(Engine, Dates, Signal, V0, Season=1)['WVcol']
+>>> OD = Engine.compute(Dates, WVcol=WV, Season=1)
+
+To see versions and changelog, open the __init__.py
+
+"""
+import numpy as np
+from . import SRStools as srt
+#%%---------------------------------------------------------------------------
+class WaterVapourLUT(object):
+    """
+    Band transmittance table and its inversion for one instrument.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Full set of spectrometer's wavelengths, in [nanometers]
+    Height : float
+        Elevation of the measurement site, in [meters] above mean sea level
+    V0 : ndarray
+        Calibration constant V0(λ), shape (N_wavelengths,): weights of the
+        band pixels
+    Band : tuple of floats, optional
+        Absorption band, in [nanometers]. Default: (925, 955)
+    Windows : tuple of (min, max) wavelengths, optional
+        Ranges without strong absorption, for the aerosol interpolation.
+        Default: ((860, 880), (985, 1000))
+    Columns : ndarray, optional
+        Water vapour columns of the table, in [cm]. Default: 200 values
+        from 0.01 to 8 cm, logarithmically spaced
+    AirMass : ndarray, optional
+        Air masses of the table. Default: 1 to 12, step 0.25
+    Pres : float, optional
+        Pressure of the table in [bar]; 0 is the Standard Atmosphere value
+        at Height (the band transmittance depends weakly on pressure)
+    """
+    def __init__( self, WaveLgt, Height, V0, Band=(925., 955.),\
+                  Windows=((860., 880.), (985., 1000.)),\
+                  Columns=np.geomspace(0.01, 8., 200),\
+                  AirMass=np.arange(1., 12.01, 0.25), Pres=0 ):
+        self.WaveLgt = np.ascontiguousarray( WaveLgt, dtype=float )
+        self.Height = float(Height)
+        self.Band = np.flatnonzero( (self.WaveLgt >= Band[0]) & \
+                                    (self.WaveLgt <= Band[1]) )
+        self.Windows = [ np.flatnonzero( (self.WaveLgt >= a) & (self.WaveLgt <= b) )\
+                         for a, b in Windows ]
+        if len(self.Band) == 0 or min( len(W) for W in self.Windows ) == 0:
+            raise ValueError('WaterVapourLUT: band or windows outside the grid')
+        self.WvlWin = np.array( [ self.WaveLgt[W].mean() for W in self.Windows ] )
+        V0 = np.asarray( V0, dtype=float )
+        self.Weight = V0[self.Band] / V0[self.Band].sum()
+        self.Columns = np.asarray( Columns, dtype=float )
+        self.AirMass = np.asarray( AirMass, dtype=float )
+        # Table (N_airmass, N_columns), all the nodes in one wv_MTau call
+        M, W = np.meshgrid( self.AirMass, self.Columns, indexing='ij' )
+        MTau = srt.wv_MTau( self.WaveLgt[self.Band], self.Height, Pres,\
+                            WVcol=W.ravel(), AMF=M.ravel() )
+        self.Table = ( np.exp(-MTau) @ self.Weight ).reshape( M.shape )
+
+    def transmittance( self, AMF ):
+        """
+        Support function: band transmittance against the columns of the
+        table, linearly interpolated at the air mass of each record
+        (N_records, N_columns).
+        """
+        AMF = np.clip( np.asarray(AMF, dtype=float), self.AirMass[0], self.AirMass[-1] )
+        J = np.clip( np.searchsorted(self.AirMass, AMF) - 1, 0, len(self.AirMass) - 2 )
+        F = ( ( AMF - self.AirMass[J] ) / ( self.AirMass[J+1] - self.AirMass[J] ) )[:,None]
+        return self.Table[J] * (1. - F) + self.Table[J+1] * F
+
+    def invert( self, Trans, AMF ):
+        """
+        Water vapour column of each record from its band transmittance, by
+        linear interpolation in log(column). Values beyond the table are
+        clipped to its first and last column; NaN transmittances give NaN.
+        """
+        Trans = np.asarray( Trans, dtype=float )
+        T = self.transmittance( AMF )
+        # Decreasing rows: number of nodes with a higher transmittance
+        K = np.clip( (T > Trans[:,None]).sum(1), 1, len(self.Columns) - 1 )
+        Rows = np.arange( len(T) )
+        T0 = T[Rows,K-1];   T1 = T[Rows,K]
+        LogW = np.log( self.Columns )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            F = np.clip( (Trans - T0) / (T1 - T0), 0., 1. )
+        WV = np.exp( LogW[K-1] * (1. - F) + LogW[K] * F )
+        WV[ ~np.isfinite(Trans) ] = np.nan
+        return WV
+
+    def retrieve( self, Signal, V0, OD ):
+        """
+        Water vapour column of a batch of spectra.
+
+        Parameters
+        ----------
+        Signal : ndarray
+            Dark-corrected signal, shape (N_spectra, N_wavelengths), in the
+            same units of V0
+        V0 : ndarray
+            Calibration constant V0(λ), shape (N_wavelengths,)
+        OD : dictionary of ndarrays
+            Air masses and optical depths of the spectra, as given by
+            OpticalDepthEngine.compute or iterchunks (keys 'SunR', 'AMF',
+            'AMF_O3', 'Tau_R', 'Tau_O3', 'Tau_NO2')
+
+        Returns
+        -------
+        Out : dictionary of ndarrays
+            'WVcol' : water vapour column [cm], (N_spectra,)
+            'Trans' : measured band transmittance
+            'Alpha' : Ångström exponent of the aerosol interpolation
+        """
+        Signal = np.atleast_2d( Signal )
+        V0 = np.asarray( V0, dtype=float )
+        M = np.asarray( OD['AMF'], dtype=float )[:,None]
+        Mo = np.asarray( OD['AMF_O3'], dtype=float )[:,None]
+        Pix = np.concatenate( [self.Band] + self.Windows )
+        # Slant optical depth without water vapour, on the pixels used
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Slant = np.log( V0[Pix] / ( Signal[:,Pix] * \
+                            np.asarray(OD['SunR'], dtype=float)[:,None]**2 ) )
+        Slant[ ~(Signal[:,Pix] > 0) ] = np.nan
+        Slant -= M * ( OD['Tau_R'][:,Pix] + OD['Tau_NO2'][:,Pix] ) + \
+                 Mo * OD['Tau_O3'][:,Pix]
+        Nb = len(self.Band)
+        # Aerosols: log-log interpolation between the two windows
+        Edges = np.cumsum( [Nb] + [ len(W) for W in self.Windows ] )
+        Tau = np.stack( [ np.mean( Slant[:,a:b], 1 ) for a, b in \
+                          zip(Edges[:-1], Edges[1:]) ], axis=1 ) / M
+        X = np.log( self.WvlWin )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Alpha = -( np.log(Tau[:,1]) - np.log(Tau[:,0]) ) / ( X[1] - X[0] )
+            TauA = Tau[:,:1] * ( self.WaveLgt[self.Band] / self.WvlWin[0] )**-Alpha[:,None]
+        TauA = np.where( np.isfinite(TauA), TauA, Tau.mean(1)[:,None] )
+        Trans = np.exp( -Slant[:,:Nb] + M * TauA ) @ self.Weight
+        return { 'WVcol': self.invert( Trans, M[:,0] ), 'Trans': Trans,\
+                 'Alpha': Alpha }
+
+def wvcolumns( Engine, Date, Signal, V0, Pres=0, Tamb=999, O3col=999,\
+               NO2col=999, Season=2, **kw ):
+    """
+    Water vapour column of every spectrum, processed in the chunks of the
+    optical depth engine (air masses, Rayleigh, ozone and NO2 from
+    OpticalDepthEngine).
+
+    Parameters
+    ----------
+    Engine : OpticalDepthEngine
+        Engine of the instrument
+    Date : list of datetime objects or datetime64 array
+        UTC timestamps of the spectra
+    Signal : ndarray
+        Dark-corrected signal, shape (N_spectra, N_wavelengths)
+    V0 : ndarray
+        Calibration constant V0(λ), shape (N_wavelengths,)
+    Pres, Tamb, O3col, NO2col, Season : optional
+        As in OpticalDepthEngine.compute (e.g. O3col from
+        totalozone.ozonecolumns)
+    **kw :
+        Band, Windows, Columns and AirMass of WaterVapourLUT (the table is
+        computed at the Standard Atmosphere pressure)
+
+    Returns
+    -------
+    Out : dictionary of ndarrays
+        'WVcol' [cm], 'Trans' and 'Alpha', (N_spectra,): WVcol is ready for
+        the WVcol argument of Engine.compute
+    """
+    LUT = WaterVapourLUT( Engine.WaveLgt, Engine.Height, V0, **kw )
+    N = len(Signal)
+    Out = dict( (F, np.empty(N)) for F in ('WVcol', 'Trans', 'Alpha') )
+    for S, OD in Engine.iterchunks( Date, Pres, Tamb, O3col, NO2col, 999, Season ):
+        R = LUT.retrieve( Signal[S], V0, OD )
+        for F in Out: Out[F][S] = R[F]
+    return Out
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Tracking of the wavelength shift and squeeze of the spectrometer, by cross
+correlation of the measured solar spectra against the extraterrestrial
+spectrum (E0nλ of Gueymard's table) convolved with the slit function on the
+nominal instrument grid (see slitconv).
+
+The spectral range is split into windows; in each window the logarithm of
+both spectra is resampled on a uniform grid, detrended by a low order
+polynomial (the atmospheric transmission is smooth, the Fraunhofer lines are
+not), tapered and cross-correlated by FFT. The correlation peak is refined
+to a fraction of the grid step by a parabola through its three highest
+points. The shifts of the windows are then fitted by a straight line:
+
+    δ(λ) = Shift + Squeeze * (λ - RefWvl)
+
+where δ is the offset to be added to the nominal wavelengths to get the
+true ones. All the spectra of a batch are processed at once.
+
+To see versions and changelog, open the __init__.py
+
+"""
+import time
+import numpy as np
+from . import slitconv
+#%%---------------------------------------------------------------------------
+class ShiftTracker(object):
+    """
+    Wavelength shift and squeeze estimator for one instrument.
+
+    Parameters
+    ----------
+    WaveLgt : ndarray
+        Nominal wavelength grid (e.g. from GetLambda), in [nanometers]
+    FWHM : float, optional
+        Slit FWHM in [nanometers], see slitconv.SlitMatrix. Default: 1.4
+    Windows : tuple of (min, max) wavelengths, optional
+        Correlation windows, in [nanometers]. Default: four 50 nm windows
+        from 300 to 500 nm, rich in Fraunhofer lines
+    RefWvl : float, optional
+        Reference wavelength of the shift, in [nanometers]. Default: centre
+        of the windows
+    MaxShift : float, optional
+        Largest shift searched, in [nanometers]. Default: 1 nm
+    Order : integer, optional
+        Order of the polynomial removed from each window. Default: 2
+    Slit : SlitMatrix, optional
+        Convolution matrix already built for WaveLgt (e.g. from a disk
+        cache); if given, FWHM is not used
+
+    Example
+    -------
+    >>> Tracker = ShiftTracker(Wvl)
+    >>> Res = Tracker.estimate(Signal)          # (N_spectra, N_pixels)
+    >>> Tracker.logdrift('drift.txt', Dates, Res)
+    """
+    def __init__( self, WaveLgt, FWHM=1.4, Windows=((300., 350.), (350., 400.),\
+                  (400., 450.), (450., 500.)), RefWvl=None, MaxShift=1.,\
+                  Order=2, Slit=None ):
+        self.WaveLgt = np.asarray( WaveLgt, dtype=float )
+        if Slit is None: Slit = slitconv.SlitMatrix( self.WaveLgt, FWHM )
+        E0 = Slit.coeff( 1 )
+        # Uniform step: the median pixel step
+        Step = np.median( np.diff(self.WaveLgt) )
+        self.Step = Step
+        self.Centres = np.array( [ (a + b) / 2. for a, b in Windows ] )
+        self.RefWvl = self.Centres.mean() if RefWvl is None else float(RefWvl)
+        self.MaxLag = int( np.ceil( MaxShift / Step ) )
+
+        # One grid for all the windows: same number of points each
+        n = int( min( (b - a) for a, b in Windows ) / Step )
+        self.Grid = np.array( [ a + Step * np.arange(n) for a, b in Windows ] )
+        G = self.Grid.ravel()
+        J = np.clip( np.searchsorted(self.WaveLgt, G) - 1, 0, len(self.WaveLgt) - 2 )
+        self.J = J
+        self.W = ( G - self.WaveLgt[J] ) / ( self.WaveLgt[J+1] - self.WaveLgt[J] )
+        # Detrending projector (removes the polynomial of degree Order) and
+        # taper, shared by all the windows
+        X = np.linspace( -1., 1., n )[:,None] ** np.arange(Order + 1)
+        self.Proj = np.eye(n) - X @ np.linalg.pinv(X)
+        self.Taper = np.hanning( n )
+        self.Nfft = 2 * n
+        R = self.prepare( E0[None,:] )[0]
+        self.RefF = np.fft.rfft( R, self.Nfft )
+        self.RefNorm = ( R**2 ).sum(-1)
+
+    def prepare( self, Spectra ):
+        """
+        Support function: log, resampled, detrended and tapered windows of a
+        batch of spectra, shape (N_spectra, N_windows, N_points).
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            L = np.log( np.atleast_2d(Spectra) )
+        L = L[:,self.J] * (1. - self.W) + L[:,self.J+1] * self.W
+        L = L.reshape( len(L), *self.Grid.shape )
+        L = np.nan_to_num( L, nan=0., posinf=0., neginf=0. )
+        return ( L @ self.Proj.T ) * self.Taper
+
+    def estimate( self, Spectra ):
+        """
+        Shift and squeeze of a batch of solar spectra (any units).
+
+        Parameters
+        ----------
+        Spectra : ndarray
+            Dark-corrected spectra, shape (N_pixels,) or (N_spectra, N_pixels)
+
+        Returns
+        -------
+        Res : dictionary of ndarrays
+            'Shift' : offset at RefWvl, in [nanometers], (N_spectra,)
+            'Squeeze' : change of the offset per nm, (N_spectra,)
+            'Shifts' : offset of each window, (N_spectra, N_windows)
+            'Corr' : normalized correlation peak of each window (0 to 1)
+        """
+        S = self.prepare( Spectra )
+        C = np.fft.irfft( np.fft.rfft(S, self.Nfft) * np.conj(self.RefF), self.Nfft )
+        # Lags from -MaxLag to +MaxLag (negative lags wrap around)
+        Lags = np.arange( -self.MaxLag, self.MaxLag + 1 )
+        C = C[...,Lags % self.Nfft]
+        K = np.clip( np.argmax(C, axis=-1), 1, len(Lags) - 2 )
+        c0 = np.take_along_axis( C, K[...,None] - 1, -1 )[...,0]
+        c1 = np.take_along_axis( C, K[...,None],     -1 )[...,0]
+        c2 = np.take_along_axis( C, K[...,None] + 1, -1 )[...,0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Frac = np.where( c0 - 2.*c1 + c2 < 0., 0.5 * (c0 - c2) / (c0 - 2.*c1 + c2), 0. )
+            Corr = c1 / np.sqrt( (S**2).sum(-1) * self.RefNorm )
+        # The spectrum matches the reference moved by -lag
+        Shifts = -( Lags[K] + Frac ) * self.Step
+        # Straight line through the window shifts
+        X = self.Centres - self.RefWvl
+        Mx = X.mean();   My = Shifts.mean(-1)
+        Squeeze = ( (X - Mx) * (Shifts - My[:,None]) ).sum(-1) / ((X - Mx)**2).sum()
+        return { 'Shift': My + Squeeze * ( -Mx ), 'Squeeze': Squeeze,
+                 'Shifts': Shifts, 'Corr': Corr }
+
+    def logdrift( self, File, Date, Res ):
+        """
+        Append the shift and squeeze of each spectrum to a text log: date,
+        time, shift [nm], squeeze [nm/nm], mean correlation peak.
+        """
+        Date = np.atleast_1d( np.asarray(Date, dtype='datetime64[s]') )
+        with open( File, 'a' ) as F:
+            for k in range( len(Date) ):
+                F.write( '%s %9.5f %11.3e %6.3f\n' % (str(Date[k]).replace('T', ' '),\
+                         Res['Shift'][k], Res['Squeeze'][k], Res['Corr'][k].mean()) )
+
+def benchmark( WaveLgt, N=256, Repeat=3, **kw ):
+    """
+    Time of the estimate for a batch of N spectra and for a single one, on
+    the convolved E0 spectrum itself. Returns (batch time, single time).
+    """
+    Tracker = ShiftTracker( WaveLgt, **kw )
+    S = np.tile( slitconv.SlitMatrix( WaveLgt ).coeff(1), (N, 1) )
+    Tracker.estimate( S[:1] )
+    Tb = Ts = np.inf
+    for r in range(Repeat):
+        t0 = time.perf_counter();   Tracker.estimate( S )
+        t1 = time.perf_counter();   Tracker.estimate( S[0] )
+        t2 = time.perf_counter()
+        Tb = min( Tb, t1 - t0 );    Ts = min( Ts, t2 - t1 )
+    return Tb, Ts
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized ozone_OD and no2_OD against the former per-pixel loops, kept
+below as reference copies (the Gueymard table is read by gueymard_table
+instead of from the working directory). no2_OD is compared with the loop
+result multiplied by the Anλ coefficients, as fixed in version 0.9.7.
+
+"""
+import numpy as np
+import pytest
+from SRSpci import SRStools as srt
+
+WAVELGT = np.linspace( 280., 1100., 2048 )
+HEIGHT = 570.
+RTOL = 1e-12
+
+def tground_loop( x, y ):
+    return ( x + 273.15 - min(49.42, 70.24 - 23.428 * y +\
+            2.523 * y**2) ) / (1. - min(0.1878, 0.26073 - 0.082424 * y +\
+            9.098e-3 * y**2) )
+
+def ozone_OD_loop( WaveLgt, Height, O3col=999, Tamb=999, Season=2 ):
+    H  = Height/1000.
+    AoCoeff = lambda a1, a2, a3, a4, x: (a1 + a2 * x + a3 * x**2) / (1. + a4 * x)
+    Table = srt.gueymard_table()
+    AoTro = np.interp(WaveLgt, Table[:,0], Table[:,3])
+    if Season == 0:
+        c0  = 0.3768
+        c11 = 220.46;  c12 = 1.67
+        c21 = 142.68;  c22 = 0.28498
+    elif Season == 1:
+        c0  = 0.3316
+        c11 = 232.12;  c12 = 2.42
+        c21 = 332.41;  c22 = - 0.34467
+    else :
+        c0  = 0.3434
+        c11 = 226.29;  c12 = 2.045
+    if O3col == 999:
+        O3col = c0 * (1. - 8.98e-3 * H)
+    if Tamb == 999:
+            Teo = c11 - c12 * H
+    elif Tamb != 999:
+            Teo = c21 + c22 * tground_loop(Tamb, H)
+    Ao3 = np.copy(AoTro)
+    WL = WaveLgt/1000.
+    for w in range(len(WaveLgt)):
+        if WaveLgt[w] < 310.:
+            Ao3[w] = max( 0, AoTro[w] + (Teo - 228.) * \
+                AoCoeff(0.25326  , -1.7253  , 2.92850, -3.5890, WL[w]) + \
+                AoCoeff(9.6635e-3, -0.063685, 0.10464, -3.6879, WL[w]) * \
+                (Teo - 228.)**2 )
+        elif 310. <= WaveLgt[w] < 344.:
+            Ao3[w] = max( 0, AoTro[w] + (Teo - 228.) * \
+                AoCoeff(0.396260, -2.3272  , 3.41760, 0, WL[w]) + \
+                AoCoeff(0.018268, -0.063685, 0.10464, 0, WL[w]) * \
+                (Teo - 228.)**2 )
+        elif 407. <= WaveLgt[w] < 560.:
+            Ao3[w] = max( 0, AoTro[w] * ( 1. + 0.0037083 * (Teo - 228.) * \
+                    np.exp(28.04 * (0.4474 - WL[w])) ) )
+    return Ao3 * O3col
+
+def no2_OD_loop( WaveLgt, Height, Tamb=999, Season=2 ):
+    H  = Height/1000.
+    Table = srt.gueymard_table()
+    AoTrn = np.interp(WaveLgt, Table[:,0], Table[:,4])
+    if Season == 0:
+        NO2col = 1.99e-4
+        c11 = 220.46;  c12 = 1.67
+        c21 = 142.68;  c22 = 0.28498
+    elif Season == 1:
+        NO2col = 2.18e-4
+        c11 = 232.12;  c12 = 2.42
+        c21 = 332.41;  c22 = - 0.34467
+    else :
+        NO2col = 2.04e-4
+        c11 = 226.29;  c12 = 2.045
+    if Tamb == 999:
+            Ten = c11 - c12 * H
+    elif Tamb != 999:
+            Ten = c21 + c22 * tground_loop(Tamb, H)
+    Aon = np.copy(AoTrn)
+    WL = WaveLgt/1000.
+    for w in range(len(WaveLgt)):
+        if WaveLgt[w] < 625.:
+            Aon[w] = max( 0, 1. + (Ten - 243.2) * np.polyval([-42.635, \
+                96.615, -86.136, 37.821, -8.1829, 0.69773], WL[w]) )
+        else :
+            Aon[w] = max( 0, 1. + (Ten - 243.2) * \
+                np.polyval([-0.04985, 0.03539], WL[w]) )
+    return Aon * NO2col
+
+def no2_OD_ref( WaveLgt, Height, Tamb=999, Season=2 ):
+    """Former loop with the factor applied to the Anλ coefficients."""
+    Table = srt.gueymard_table()
+    AoTrn = np.interp(WaveLgt, Table[:,0], Table[:,4])
+    return AoTrn * no2_OD_loop( WaveLgt, Height, Tamb, Season )
+
+# The loops had no Season 2 coefficients for a measured Tamb (NameError)
+CASES = [ (0, 999), (1, 999), (2, 999), (0, -15.), (0, 5.), (1, 12.), (1, 35.) ]
+
+@pytest.mark.parametrize( 'Season, Tamb', CASES )
+def test_ozone_scalar( Season, Tamb ):
+    for O3col in ( 999, 0.25, 0.41 ):
+        Ref = ozone_OD_loop( WAVELGT, HEIGHT, O3col, Tamb, Season )
+        New = srt.ozone_OD( WAVELGT, HEIGHT, O3col, Tamb, Season )
+        assert New.shape == Ref.shape
+        np.testing.assert_allclose( New, Ref, rtol=RTOL, atol=0 )
+
+@pytest.mark.parametrize( 'Season, Tamb', CASES )
+def test_no2_scalar( Season, Tamb ):
+    Ref = no2_OD_ref( WAVELGT, HEIGHT, Tamb, Season )
+    New = srt.no2_OD( WAVELGT, HEIGHT, Tamb, Season )
+    assert New.shape == Ref.shape
+    np.testing.assert_allclose( New, Ref, rtol=RTOL, atol=0 )
+
+def test_arrays_match_rows():
+    Season = np.array( [ S for S, T in CASES ] )
+    Tamb = np.array( [ T for S, T in CASES ], dtype=float )
+    O3col = np.linspace( 0.25, 0.41, len(CASES) )
+    O3col[::3] = 999
+    Tau_O3 = srt.ozone_OD( WAVELGT, HEIGHT, O3col, Tamb, Season )
+    Tau_NO2 = srt.no2_OD( WAVELGT, HEIGHT, Tamb, Season )
+    assert Tau_O3.shape == Tau_NO2.shape == ( len(CASES), len(WAVELGT) )
+    for k in range( len(CASES) ):
+        np.testing.assert_allclose( Tau_O3[k], ozone_OD_loop( WAVELGT, HEIGHT,\
+                                    O3col[k], Tamb[k], Season[k] ), rtol=RTOL, atol=0 )
+        np.testing.assert_allclose( Tau_NO2[k], no2_OD_ref( WAVELGT, HEIGHT,\
+                                    Tamb[k], Season[k] ), rtol=RTOL, atol=0 )
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+NLCorrection: counts are scaled to the ADC units of the coefficients
+before clipping to [Low, High].
+
+"""
+import numpy as np
+from SRSpci.nonlinearity import NLCorrection
+
+COEFFS = ( 1., 1e-5, -2e-10, 0., 0., 0., 0., 0. )
+LOW, HIGH, SCALE = 100., 16000., 4.
+
+def poly( C ):
+    return np.polyval( np.asarray(COEFFS)[::-1], C )
+
+def test_scale_before_clip():
+    NL = NLCorrection( COEFFS, LOW, HIGH, Scale=SCALE, Npix=4 )
+    C = np.array( [ HIGH * SCALE, 2. * HIGH * SCALE, HIGH * SCALE / 2., LOW ] )
+    F = NL.factor( C )
+    # Top of the scaled range and beyond: the polynomial at High
+    np.testing.assert_allclose( F[:2], poly(HIGH) )
+    # Below the top of the scaled range: not clipped
+    np.testing.assert_allclose( F[2], poly(HIGH / 2.) )
+    # Below Low after scaling: clipped to Low
+    np.testing.assert_allclose( F[3], poly(LOW) )
+
+def test_live_path_matches_batch():
+    NL = NLCorrection( COEFFS, LOW, HIGH, Scale=SCALE, Npix=4 )
+    Scan = np.array( [ 500., 20000., 64000., 90000. ] )
+    Dark = np.full( 4, 100. )
+    Batch = NL.apply( (Scan - Dark)[None,:] )[0]
+    np.testing.assert_allclose( NL.correctscan( Scan, Dark ), Batch )
+
+def test_integer_counts():
+    NL = NLCorrection( COEFFS, LOW, HIGH, Scale=SCALE, Npix=4 )
+    C = np.array( [ 1000, 30000 ] )
+    np.testing.assert_allclose( NL.factor( C ), poly( C / SCALE ) )
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+float32 processing mode: the AOD error against the float64 chain must stay
+below precision.ERROR_BOUND on a synthetic day.
+
+"""
+import numpy as np
+from SRSpci import precision
+from SRSpci.opticaldepth import OpticalDepthEngine
+
+SITE = ( 45.7422, 7.3568, 570. )
+
+def test_float32_error_bound():
+    WaveLgt = np.linspace( 300., 1000., 2048 )
+    V0 = 1000. * np.exp( -((WaveLgt - 600.) / 400.)**2 )
+    Date = np.datetime64('2018-06-01T00:00') + \
+           np.arange( 0, 86400, 300 ).astype('timedelta64[s]')
+    with np.errstate(invalid='ignore'):
+        Zang = OpticalDepthEngine( WaveLgt, SITE ).geometry( Date )[0]
+    Date = Date[ Zang < 80. ]
+    R = precision.compare( WaveLgt, SITE, Date, V0, Repeat=1, Season=1 )
+    assert np.isfinite( R['MaxError'] )
+    assert R['MaxError'] < precision.ERROR_BOUND
+    assert R['Bytes32'] * 2 == R['Bytes64']
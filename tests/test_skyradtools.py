@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+formatdata against the former nested-loop implementation, kept below as a
+reference copy. Run as a script to print the timings:
+
+    python tests/test_skyradtools.py
+
+"""
+import time
+import numpy as np
+import pytest
+from SRSpci.skyradtools import formatdata
+
+def formatdata_loop( Data, product='par' ):
+    """formatdata as before Ver. 0.9.7 (element by element loops)."""
+    if product == 'par':
+        Block1, Block2, Block3 = [ [], [], [] ]
+        AOD,    SSA,    RefIdx = [ [], [], [] ]
+        for j in range( len(Data) ):
+            for k in range( len(Data[0]) ):
+                Block1.append( Data[j][k][1] )
+                Block2.append( Data[j][k][3] )
+                Block3.append( [ Data[j][k][l] for l in (4,5) ] )
+            AOD.append( np.array( Block1 ) )
+            SSA.append( np.array( Block2 ) )
+            RefIdx.append( np.array( Block3 ) )
+            Block1, Block2, Block3 = [ [], [], [] ]
+        WL = [ int( Data[0][l][0]*1e3 ) for l in range( len( Data[0] ) ) ]
+        return np.array(AOD), np.array(SSA), np.array(RefIdx), WL
+
+    elif product == 'vol':
+        Block = [];     VolDist = []
+        for j in range( len(Data) ):
+            for k in range( len(Data[0]) ):
+                Block.append( Data[j][k][0] )
+            VolDist.append( np.array( Block ) )
+            Block = []
+        Sizes = [ Data[0][l][0] for l in range( len( Data[0] ) ) ]
+        return np.array(VolDist), np.array(Sizes)
+
+# Product, rows and columns of a retrieval block
+PRODUCTS = [ ('par', 6, 6), ('vol', 22, 2) ]
+
+def blocks( N, R, C, Seed=0 ):
+    return np.random.default_rng( Seed ).uniform( 0.3, 1., (N, R, C) )
+
+@pytest.mark.parametrize( 'product, R, C', PRODUCTS )
+def test_formatdata_matches_loops( product, R, C ):
+    Data = blocks( 300, R, C )
+    New = formatdata( Data, product )
+    Old = formatdata_loop( Data.tolist(), product )
+    assert len(New) == len(Old)
+    for A, B in zip( New, Old ):
+        assert np.array_equal( np.asarray(A), np.asarray(B) )
+    # Nested lists, as importskyrad used to return, give the same result
+    for A, B in zip( formatdata( Data.tolist(), product ), New ):
+        assert np.array_equal( np.asarray(A), np.asarray(B) )
+
+def benchformat( N=4000, Repeat=5 ):
+    """
+    Time formatdata (on the 3-D array of importskyrad) and the former loops
+    (on the nested lists they used to get) for a year of retrievals, about
+    one per daylight hour. Returns {product: (formatdata, loops)} in [s].
+    """
+    Timing = {}
+    for product, R, C in PRODUCTS:
+        Data = blocks( N, R, C );   Lists = Data.tolist()
+        Tn = To = np.inf
+        for r in range(Repeat):
+            t0 = time.perf_counter();   formatdata( Data, product )
+            t1 = time.perf_counter();   formatdata_loop( Lists, product )
+            t2 = time.perf_counter()
+            Tn = min( Tn, t1 - t0 );    To = min( To, t2 - t1 )
+        Timing[product] = ( Tn, To )
+    return Timing
+
+if __name__ == '__main__':
+    for product, (Tn, To) in benchformat().items():
+        print( '%s: formatdata %.3f ms, loops %.1f ms' % (product, Tn * 1e3, To * 1e3) )